@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+import enum
+import datetime
+from threading import Lock
+
+import pyais
+
+import geodesy
+
+#Fields kept per vessel, static ones come from type 5 and 24 (part A and B), dynamic ones from position reports
+STATIC_FIELDS = ("shipname", "callsign", "imo", "shiptype", "destination", "draught", "to_bow", "to_stern", "to_port", "to_starboard")
+DYNAMIC_FIELDS = ("lat", "lon", "speed", "course", "heading", "status", "turn")
+
+#Position reports: class A (1-3), class B (18, 19), SAR aircraft (9), aid to navigation (21)
+POSITION_TYPES = (1, 2, 3, 9, 18, 19, 21)
+HEADING_UNAVAILABLE = 511
+#Seconds between scans of the vessel table for vessels to expire
+EXPIRE_PERIOD = 10.0
+
+
+def _plain(value):
+	#pyais returns enums for some fields, the table only holds JSON types
+	if isinstance(value, enum.Enum):
+		return value.value
+	if isinstance(value, str):
+		return value.strip('@ ')
+	return value
+
+
+class AisEngine(object):
+
+	"""
+	Stateful AIS decoder for the Subscriber. Sentences of a multi-part message are
+	collected per (channel, sequence id) and decoded once all parts arrived, incomplete
+	groups are dropped after f_ais_fragment_timeout seconds.
+
+	Every decoded message is merged into a per MMSI vessel table. A vessel is forwarded
+	to Xastir when it moved more than f_ais_min_distance meters since the last forward,
+	or when f_ais_max_interval seconds passed, so a moored vessel does not flood Xastir.
+	Vessels not heard for f_ais_vessel_timeout seconds are removed.
+	"""
+
+	def __init__(self, config):
+		self.config = config
+		self.lock = Lock()
+
+		#(channel, sequence id, number of parts) -> [received, {part index: sentence}]
+		self.fragments = {}
+		self.vessels = {}
+		self.last_expire = 0.0
+
+		self.stats = 	{
+							"sentences" : 0,
+							"messages" : 0,
+							"multipart" : 0,
+							"fragments_expired" : 0,
+							"invalid" : 0,
+							"forwarded" : 0,
+							"suppressed" : 0
+						}
+
+	def _expire(self, now):
+		for key in [key for key, (received, parts) in self.fragments.items() if now - received > self.config["f_ais_fragment_timeout"]]:
+			del self.fragments[key]
+			self.stats["fragments_expired"] += 1
+
+	def _expire_vessels(self, now):
+		self.last_expire = now
+		for mmsi in [mmsi for mmsi, vessel in self.vessels.items() if now - vessel["last_seen"] > self.config["f_ais_vessel_timeout"]]:
+			del self.vessels[mmsi]
+
+	def assemble(self, sentence, now):
+		"""
+		Sentences of a complete message in part order, or None while parts are missing.
+		"""
+
+		fields = sentence.split(',')
+		if len(fields) < 7 or not fields[0].startswith('!'):
+			self.stats["invalid"] += 1
+			return None
+
+		count, index, sequence, channel = int(fields[1]), int(fields[2]), fields[3], fields[4]
+		if count == 1:
+			return [sentence]
+
+		self._expire(now)
+		key = (channel, sequence, count)
+		received, parts = self.fragments.setdefault(key, [now, {}])
+		parts[index] = sentence
+		if len(parts) < count:
+			return None
+
+		del self.fragments[key]
+		self.stats["multipart"] += 1
+		return [parts[i] for i in sorted(parts)]
+
+	def _merge(self, content, now):
+		mmsi = str(content["mmsi"])
+		vessel = self.vessels.get(mmsi)
+		if vessel is None:
+			vessel = {"mmsi": mmsi, "messages": 0, "first_seen": now, "forwarded": 0.0, "forwarded_position": None}
+			vessel.update({field: None for field in STATIC_FIELDS + DYNAMIC_FIELDS})
+			self.vessels[mmsi] = vessel
+
+		fields = DYNAMIC_FIELDS if content["type"] in POSITION_TYPES else STATIC_FIELDS
+		for field in fields:
+			if field in content:
+				vessel[field] = _plain(content[field])
+		#Type 19 and 21 also carry the name and dimensions
+		if content["type"] in (19, 21):
+			for field in STATIC_FIELDS:
+				if field in content:
+					vessel[field] = _plain(content[field])
+
+		#91 and 181 degrees mean position not available
+		if vessel["lat"] is not None and (abs(vessel["lat"]) > 90 or abs(vessel["lon"]) > 180):
+			vessel["lat"] = vessel["lon"] = None
+
+		vessel["messages"] += 1
+		vessel["last_seen"] = now
+		return vessel
+
+	def _forward(self, vessel, now):
+		if vessel["lat"] is None:
+			return False
+		if vessel["forwarded_position"] is not None and now - vessel["forwarded"] < self.config["f_ais_max_interval"]:
+			lat, lon = vessel["forwarded_position"]
+			if geodesy.distance(lat, lon, vessel["lat"], vessel["lon"]) < self.config["f_ais_min_distance"]:
+				return False
+		vessel["forwarded"] = now
+		vessel["forwarded_position"] = (vessel["lat"], vessel["lon"])
+		return True
+
+	def update(self, sentence):
+		"""
+		Feed one sentence. Returns a copy of the vessel when it is due for a Xastir update, None otherwise.
+		"""
+
+		now = time.time()
+		with self.lock:
+			self.stats["sentences"] += 1
+			if now - self.last_expire >= EXPIRE_PERIOD:
+				self._expire_vessels(now)
+			sentences = self.assemble(sentence.strip(), now)
+			if sentences is None:
+				return None
+
+			messages = [pyais.NMEAMessage.from_string(sentence) for sentence in sentences]
+			message = messages[0] if len(messages) == 1 else pyais.NMEAMessage.assemble_from_iterable(messages)
+			content = message.decode().content
+			if "mmsi" not in content:
+				self.stats["invalid"] += 1
+				return None
+
+			self.stats["messages"] += 1
+			vessel = self._merge(content, now)
+			if not self._forward(vessel, now):
+				if vessel["lat"] is not None:
+					self.stats["suppressed"] += 1
+				return None
+			self.stats["forwarded"] += 1
+			return dict(vessel)
+
+	def get_vessels(self):
+		now = time.time()
+		with self.lock:
+			self._expire_vessels(now)
+
+			vessels = []
+			for vessel in self.vessels.values():
+				entry = {key: value for key, value in vessel.items() if key not in ("forwarded", "forwarded_position", "first_seen", "last_seen")}
+				entry["first_seen"] = datetime.datetime.utcfromtimestamp(vessel["first_seen"]).isoformat() + 'Z'
+				entry["last_seen"] = datetime.datetime.utcfromtimestamp(vessel["last_seen"]).isoformat() + 'Z'
+				entry["age"] = round(now - vessel["last_seen"], 1)
+				vessels.append(entry)
+			return {"vessels": vessels, "stats": dict(self.stats), "pending_fragments": len(self.fragments)}
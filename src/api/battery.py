@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import math
+from collections import deque
+
+
+class BatteryEstimator(object):
+
+	"""
+	Charge state and time left from a stream of power bank level readings.
+
+	The level comes from the four 25 % indicator LEDs. While the bank charges the
+	highest lit LED blinks, so any spread inside the short level window means
+	charging. With a steady level it is charging only while the level rose between
+	the last two trend samples, so unplugging the charger shows within one level
+	window. The slope over the long trend window is only reported as the rate.
+	Discharge time is based on an exponentially weighted average of the load power,
+	so a single spike in consumption does not make t_left jump.
+	"""
+
+	def __init__(self, capacity, capacity_wh, level_window, trend_window, power_tau, sample_period):
+		self.capacity = capacity
+		self.capacity_wh = capacity_wh
+		self.level_window = level_window
+		self.power_tau = power_tau
+
+		self.levels = deque(maxlen=max(2, int(math.ceil(level_window / sample_period))))
+		self.trend = deque(maxlen=max(2, int(math.ceil(trend_window / level_window))))
+		self.last_trend = None
+
+		self.power = None
+		self.last_power = None
+
+	def add_level(self, t, level):
+		self.levels.append((t, level))
+		if self.last_trend is None or t - self.last_trend >= self.level_window:
+			self.trend.append((t, self.level()))
+			self.last_trend = t
+
+	def add_power(self, t, power):
+		if self.power is None:
+			self.power = power
+		else:
+			alpha = 1.0 - math.exp(-(t - self.last_power) / self.power_tau)
+			self.power += alpha * (power - self.power)
+		self.last_power = t
+
+	def level(self):
+		values = [level for t, level in self.levels]
+		return int((max(values) + min(values)) / 2) if values else 0
+
+	def slope(self):
+		#Least squares slope of the trend window in % per hour
+		n = len(self.trend)
+		if n < 2:
+			return 0.0
+		t0 = self.trend[0][0]
+		mean_t = sum(t - t0 for t, level in self.trend) / n
+		mean_l = sum(level for t, level in self.trend) / n
+		var = sum((t - t0 - mean_t) ** 2 for t, level in self.trend)
+		if var == 0:
+			return 0.0
+		cov = sum((t - t0 - mean_t) * (level - mean_l) for t, level in self.trend)
+		return cov / var * 3600.0
+
+	def rising(self):
+		#Level went up between the two newest trend samples, one level window apart
+		return len(self.trend) >= 2 and self.trend[-1][1] > self.trend[-2][1]
+
+	def charge_state(self):
+		values = [level for t, level in self.levels]
+		if not values or max(values) == 0:
+			return "IDLE"
+		if max(values) != min(values) or self.rising():
+			return "CHARGING"
+		return "DISCHARGING"
+
+	def t_left(self, charge_state):
+		level = self.level()
+		if charge_state == "DISCHARGING":
+			if not self.power:
+				return 0.0
+			return ((float(level)/100.0)*self.capacity_wh) / self.power
+		elif charge_state == "CHARGING":
+			capacity_left = (1-(float(level)/100.0))*self.capacity
+			return float(capacity_left/2000.0) #Charging at 5V 2A
+		return 0.0
+
+	def estimate(self):
+		charge_state = self.charge_state()
+		return 	{
+					"charge_state" : charge_state,
+					"level" : self.level(),
+					"trend" : round(self.slope(), 2),
+					"power_avg" : round(self.power or 0.0, 3),
+					"t_left" : self.t_left(charge_state)
+				}
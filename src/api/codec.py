@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Wire format shared by the forwarder, the proxy subscribers and the status publisher.
+
+Every frame starts with a fixed big-endian header:
+
+	version (u8) | kind (u8) | tag (8 bytes, NUL padded) | utc (i64, ns since epoch) | payload length (u32)
+
+Packet frames carry the decoded line as UTF-8, status frames carry a msgpack map.
+
+On ZMQ every frame is sent as a two part message, preceded by a topic
+(status.<s_id> or pkt.<tag>) so subscribers can filter by prefix without
+decoding anything they are not interested in.
+"""
+
+__author__ = 'Tom Mladenov'
+
+import struct
+import datetime
+import time
+import enum
+import threading
+
+import msgpack
+
+from packet import Packet
+
+VERSION = 1
+
+KIND_PACKET = 1
+KIND_STATUS = 2
+
+HEADER = struct.Struct('!BB8sqI')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+STATUS_TOPIC = "status."
+PACKET_TOPIC = "pkt."
+
+
+_local = threading.local()
+
+
+class CodecError(ValueError):
+	pass
+
+
+def _to_ns(utc):
+	delta = utc - EPOCH
+	return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+def _from_ns(ns):
+	return EPOCH + datetime.timedelta(microseconds=ns // 1000)
+
+def _encode_tag(tag):
+	raw = tag.encode('ascii')
+	if len(raw) > 8:
+		raise CodecError('Tag {} exceeds 8 characters'.format(tag))
+	return raw
+
+def _encode(kind, tag, utc_ns, payload):
+	return HEADER.pack(VERSION, kind, _encode_tag(tag), utc_ns, len(payload)) + payload
+
+def _decode(data, kind):
+	if len(data) < HEADER.size:
+		raise CodecError('Frame too short ({} bytes)'.format(len(data)))
+
+	version, frame_kind, tag, utc_ns, length = HEADER.unpack_from(data, 0)
+	if version != VERSION:
+		raise CodecError('Unsupported frame version {}'.format(version))
+	if frame_kind != kind:
+		raise CodecError('Unexpected frame kind {}'.format(frame_kind))
+	if len(data) != HEADER.size + length:
+		raise CodecError('Payload length mismatch ({} != {})'.format(len(data) - HEADER.size, length))
+
+	return tag.rstrip(b'\x00').decode('ascii'), utc_ns, data[HEADER.size:]
+
+
+def _default(value):
+	#Status values msgpack cannot pack: NumPy scalars and arrays, datetimes, sets, enums, anything else as str
+	if hasattr(value, "tolist"):
+		return value.tolist()
+	if isinstance(value, (datetime.datetime, datetime.date)):
+		return value.isoformat()
+	if isinstance(value, (set, frozenset)):
+		return list(value)
+	if isinstance(value, enum.Enum):
+		return value.value
+	return str(value)
+
+
+def _packer():
+	#Packers are reused, building one per frame costs as much as packing a delta frame.
+	#One per thread, a Packer is not thread safe.
+	packer = getattr(_local, "packer", None)
+	if packer is None:
+		packer = _local.packer = msgpack.Packer(use_bin_type=True, default=_default)
+	return packer
+
+
+def status_topic(id):
+	return (STATUS_TOPIC + id).encode('ascii')
+
+def packet_topic(tag):
+	return (PACKET_TOPIC + tag).encode('ascii')
+
+
+def encode_packet(packet):
+	return _encode(KIND_PACKET, packet.tag, _to_ns(packet.utc), packet.payload.encode('utf-8'))
+
+def decode_packet(data):
+	tag, utc_ns, payload = _decode(data, KIND_PACKET)
+	return Packet(tag, payload.decode('utf-8', errors='replace'), utc=_from_ns(utc_ns))
+
+
+def encode_status(status, tag="status"):
+	return _encode(KIND_STATUS, tag, time.time_ns(), _packer().pack(status))
+
+def decode_status(data):
+	tag, utc_ns, payload = _decode(data, KIND_STATUS)
+	return msgpack.unpackb(payload, raw=False, strict_map_key=False)
@@ -5,13 +5,15 @@ __author__ = 'Tom Mladenov'
 
 
 import json
-import pickle
 from threading import Thread
 import sys
+import time
 
 import requests
 import zmq
 
+import codec
+
 
 class RemoteCyberdeck(Thread):
 
@@ -23,11 +25,18 @@ class RemoteCyberdeck(Thread):
 
 		self.connected = False
 
+		#Latest configstatus, rebuilt from per-subsystem keyframes and deltas
+		self.status = []
+		self.index = {}
+		self.sequences = {}
+		self.synced = set()
+		self.last_resync = 0.0
+
 		self.context = zmq.Context()
 		self.socket = self.context.socket(zmq.SUB)
 		self.host = 'tcp://' + ip + ':' + str(zmq_port)
 		self.socket.connect(self.host)
-		self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
+		self.socket.setsockopt_string(zmq.SUBSCRIBE, codec.STATUS_TOPIC)
 		self.socket.setsockopt(zmq.RCVTIMEO, 5000)
 
 		self.active = True
@@ -154,13 +163,74 @@ class RemoteCyberdeck(Thread):
 	def set_frequency(self, frequency):
 		return self._put_request(path="/systems/rigctl/frequency", params={"frequency": frequency})
 
+	def resync(self):
+		return self._put_request(path="/systems/publisher/resync")
+
 	def stop(self):
 		self.active = False
 
+	def _apply_keyframe(self, frame):
+		item = self.index.get(frame["id"])
+		if item is None:
+			item = {"id": frame["id"]}
+			self.index[frame["id"]] = item
+			self.status.append(item)
+		item["config"] = frame["config"]
+		item["status"] = frame["status"]
+		self.synced.add(frame["id"])
+
+	def _seed(self):
+		#Full configstatus over HTTP, so every system is present before its first keyframe.
+		#Seeded systems are not synced, their deltas wait for the keyframe.
+		response = self.get_configstatus()
+		if not response.get("success"):
+			return False
+		for item in response["configstatus"]:
+			if item["id"] not in self.index:
+				entry = {"id": item["id"], "config": item["config"], "status": item["status"]}
+				self.index[item["id"]] = entry
+				self.status.append(entry)
+		return True
+
+	def _apply_delta(self, frame):
+		item = self.index[frame["id"]]
+		if "status" in frame:
+			item["status"].update(frame["status"])
+		if "config" in frame:
+			item["config"] = frame["config"]
+
+	def _remove(self, id):
+		self.index.pop(id, None)
+		self.sequences.pop(id, None)
+		self.synced.discard(id)
+		self.status = [item for item in self.status if item["id"] != id]
+
+	def _handle_frame(self, frame):
+		id = frame["id"]
+		expected = self.sequences.get(id, -2) + 1
+		self.sequences[id] = frame["seq"]
+
+		if frame.get("removed"):
+			self._remove(id)
+		elif frame["keyframe"]:
+			self._apply_keyframe(frame)
+		elif id in self.synced and frame["seq"] == expected:
+			self._apply_delta(frame)
+		else:
+			#Missed a frame (or joined between keyframes), wait for a snapshot
+			self.synced.discard(id)
+			if time.monotonic() - self.last_resync > 2.0:
+				self.last_resync = time.monotonic()
+				self.resync()
+
 	def run(self):
+		seeded = False
 		while self.active:
+			if not seeded:
+				seeded = self._seed()
 			try:
-				self.status = pickle.loads(self.socket.recv())["configstatus"]
+				topic, data = self.socket.recv_multipart()
+				self._handle_frame(codec.decode_status(data))
 				self.connected = True
 
 			except Exception as e:
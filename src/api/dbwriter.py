@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+import math
+import queue
+import numbers
+from threading import Thread, Lock
+
+import numpy as np
+from influxdb.exceptions import InfluxDBClientError
+
+from spool import Spool
+
+
+def _escape_key(key):
+	return str(key).replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def _escape_measurement(measurement):
+	return str(measurement).replace(',', '\\,').replace(' ', '\\ ')
+
+def _format_value(value):
+	#None for values line protocol cannot carry (NaN, inf), the field is left out
+	if isinstance(value, (bool, np.bool_)):
+		return 'true' if value else 'false'
+	elif isinstance(value, numbers.Integral):
+		#Also NumPy scalars like int64 and float32, which are not int or float subclasses
+		return '{}i'.format(int(value))
+	elif isinstance(value, numbers.Real):
+		return repr(float(value)) if math.isfinite(value) else None
+	else:
+		#A newline ends the point, escape it like the backslash and the quote
+		return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+def _rejected(e):
+	#4xx other than authentication, the points themselves are bad (field type conflict, partial
+	#write) so writing them again fails the same way. Anything else means the backend is unavailable.
+	return isinstance(e, InfluxDBClientError) and e.code is not None and 400 <= e.code < 500 and e.code not in (401, 403)
+
+def to_line(measurement, fields, timestamp):
+	"""
+	Serialize a single point to InfluxDB line protocol, timestamp in nanoseconds.
+	Types are mapped the same way as the influxdb client does for JSON points so
+	existing measurements keep their field types. None and non-finite fields are
+	left out, a point without any field is None.
+	"""
+	values = ((k, _format_value(v)) for k, v in fields.items() if v is not None)
+	field_set = ','.join('{}={}'.format(_escape_key(k), v) for k, v in values if v is not None)
+	if not field_set:
+		return None
+	return '{} {} {}'.format(_escape_measurement(measurement), field_set, timestamp)
+
+
+class BatchWriter(Thread):
+
+	"""
+	Coalesces points from all subsystems in a bounded queue and writes them to
+	InfluxDB in line protocol batches, either when i_batch_size points are pending
+	or when the oldest pending point is f_flush_interval seconds old.
+
+	While the database is unreachable batches go to the on-disk spool. The backend
+	is probed every f_retry_interval seconds and once it is back the spool is
+	replayed at no more than i_replay_rate points per second, after live batches.
+	A batch the database rejects with a client error is halved until the rejected
+	points are found, only those are dropped and counted, not spooled.
+	"""
+
+	def __init__(self, client, config, status):
+		Thread.__init__(self)
+		self.client = client
+		self.config = config
+		self.status = status
+		self.name = "{}_writer".format(self.config["s_id"])
+		self.daemon = True
+
+		self.queue = queue.Queue(maxsize=self.config["i_queue_size"])
+		self.lock = Lock()
+
+		self.spool = None
+		if self.config["b_spool_enabled"]:
+			try:
+				self.spool = Spool(	self.config["s_spool_dir"], self.config["i_spool_segment_kb"]*1024, \
+									self.config["i_spool_max_mb"]*1024*1024, self.config["s_spool_eviction"])
+			except Exception as e:
+				print("Database spool disabled: {}".format(str(e)))
+
+		self.backend_up = True
+		self.last_probe = 0.0
+		self.replay_tokens = 0.0
+		self.last_replay = time.monotonic()
+
+		self.status.update({
+							"queue_depth" : 0,
+							"batch_size" : 0,
+							"batch_latency" : 0.0,
+							"written" : 0,
+							"dropped" : 0,
+							"failed" : 0,
+							"rejected" : 0,
+							"backend_up" : 1,
+							"spooled" : 0,
+							"replayed" : 0,
+							"spool_points" : 0,
+							"spool_bytes" : 0,
+							"spool_evicted" : 0
+						})
+		self._update_spool_status()
+
+		self.running = True
+
+	def put(self, measurement, fields, timestamp=None):
+		if timestamp is None:
+			timestamp = time.time_ns()
+		line = to_line(measurement, fields, timestamp)
+		if line is None:
+			return False
+		try:
+			self.queue.put_nowait(line)
+			return True
+		except queue.Full:
+			self._count("dropped", 1)
+			return False
+
+	def _count(self, key, n):
+		with self.lock:
+			self.status[key] += n
+
+	def _set_backend(self, up):
+		if self.backend_up and not up:
+			print("Database unreachable, spooling points")
+			self.last_probe = time.monotonic()
+		self.backend_up = up
+		self.status["backend_up"] = int(up)
+
+	def _spool(self, batch):
+		if self.spool is not None and self.spool.append(batch):
+			self._count("spooled", len(batch))
+		else:
+			self._count("dropped", len(batch))
+
+	def _update_spool_status(self):
+		if self.spool is not None:
+			self.status["spool_points"] = self.spool.points
+			self.status["spool_bytes"] = self.spool.size
+			self.status["spool_evicted"] = self.spool.evicted
+
+	def _write(self, batch):
+		"""
+		Write a list of lines, halving it on a client error so only the rejected points are
+		dropped. Returns the number of rejected points and the lines not written because the
+		backend became unavailable. Points are idempotent, writing one again is harmless.
+		"""
+
+		rejected = 0
+		parts = [batch]
+		while parts:
+			lines = parts.pop()
+			try:
+				self.client.write_points(lines, protocol='line')
+			except Exception as e:
+				if not _rejected(e):
+					print("Exception when writing data to database:" + str(e))
+					return rejected, lines + [line for part in reversed(parts) for line in part]
+				if len(lines) == 1:
+					print("Point rejected by database: " + str(e))
+					rejected += 1
+				else:
+					parts.append(lines[len(lines) // 2:])
+					parts.append(lines[:len(lines) // 2])
+		return rejected, []
+
+	def _flush(self, batch):
+		if not self.backend_up:
+			self._spool(batch)
+			return
+
+		start = time.monotonic()
+		rejected, remaining = self._write(batch)
+		self._count("written", len(batch) - rejected - len(remaining))
+		self._count("rejected", rejected)
+		if rejected or remaining:
+			self._count("failed", 1)
+		if remaining:
+			self._set_backend(False)
+			self._spool(remaining)
+
+		self.status["batch_size"] = len(batch)
+		self.status["batch_latency"] = round((time.monotonic() - start) * 1000.0, 3) #ms
+
+	def _probe(self):
+		now = time.monotonic()
+		if now - self.last_probe >= self.config["f_retry_interval"]:
+			self.last_probe = now
+			try:
+				self.client.ping()
+				self._set_backend(True)
+				self.last_replay = now
+			except Exception:
+				pass
+
+	def _replay(self):
+		#Token bucket, at most one second worth of burst so replay never starves live writes
+		now = time.monotonic()
+		rate = self.config["i_replay_rate"]
+		self.replay_tokens = min(rate, self.replay_tokens + (now - self.last_replay) * rate)
+		self.last_replay = now
+
+		while self.replay_tokens > 0 and self.backend_up:
+			lines, count = self.spool.peek()
+			if lines is None:
+				break
+			rejected, remaining = self._write(lines.split('\n'))
+			if remaining:
+				#Kept in the spool as a whole, the next replay writes its points again
+				self._set_backend(False)
+				break
+			self.spool.consume()
+			self.replay_tokens -= count
+			self._count("replayed", count - rejected)
+			self._count("rejected", rejected)
+
+	def _replay_pending(self):
+		return self.spool is not None and self.backend_up and self.spool.points > 0
+
+	def _drain(self, batch, limit):
+		while len(batch) < limit:
+			try:
+				batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+
+	def run(self):
+		batch = []
+		deadline = time.monotonic() + self.config["f_flush_interval"]
+
+		while self.running:
+			timeout = max(0.0, deadline - time.monotonic())
+			if self._replay_pending():
+				timeout = min(timeout, 0.1)
+			try:
+				batch.append(self.queue.get(timeout=timeout))
+				self._drain(batch, self.config["i_batch_size"])
+			except queue.Empty:
+				pass
+
+			if len(batch) >= self.config["i_batch_size"] or time.monotonic() >= deadline:
+				if batch:
+					self._flush(batch)
+					batch = []
+				deadline = time.monotonic() + self.config["f_flush_interval"]
+
+			if not self.backend_up:
+				self._probe()
+			elif self._replay_pending():
+				self._replay()
+
+			self.status["queue_depth"] = self.queue.qsize()
+			self._update_spool_status()
+
+		#Flush whatever is still pending before exiting, spooling it if the database is down
+		self._drain(batch, self.config["i_queue_size"] + len(batch))
+		while batch:
+			self._flush(batch[:self.config["i_batch_size"]])
+			batch = batch[self.config["i_batch_size"]:]
+		self.status["queue_depth"] = 0
+		self._update_spool_status()
+		if self.spool is not None:
+			self.spool.close()
+
+	def stop(self):
+		self.running = False
+		if self.is_alive():
+			self.join(timeout=self.config["f_flush_interval"] + 5)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import re
+import json
+import datetime
+
+import ais
+import sonde
+from aprspy import PositionPacket
+from aprspy.packets.position import CompressionFix, CompressionSource, CompressionOrigin
+
+#Decoders turn one received Packet into a list of records for the sinks, each runs in the
+#thread of its decode stage.
+#record: tag, source, utc, lat, lon, alt, course (position fields None when there is no position)
+#and aprs, the APRS string to forward to Xastir or None.
+
+#decoder name -> function(packet, call), Process subclasses refer to a decoder by name in DECODER.
+#A class is a stateful decoder, the Subscriber creates one instance with its config and calls it
+#from a single thread.
+DECODERS = {}
+
+STATUS_LENGTH = 62
+
+
+def register(name):
+	def wrap(function):
+		DECODERS[name] = function
+		return function
+	return wrap
+
+
+def position_packet(call, source, latitude, longitude, altitude, course, symbol_table, symbol_id, path='WIDE2-2'):
+	aprs_packet = PositionPacket(	compressed = True, source=source, destination=call, \
+									compression_fix = CompressionFix.CURRENT, compression_source = CompressionSource.GLL, compression_origin = CompressionOrigin.COMPRESSED, \
+									latitude=latitude, longitude=longitude, altitude=int(altitude*3.28084), course=int(course), \
+									ambiguity=0, symbol_table=symbol_table, symbol_id=symbol_id, path=path)
+	return aprs_packet.generate()
+
+def status_packet(call, source, text, path='WIDE2-2'):
+	#APRS status report for decoders without a position, shows up in the Xastir station list
+	text = ''.join(c for c in str(text) if 32 <= ord(c) < 127 and c not in '|~')
+	return '{}>{},{}:>{}'.format(callsign(source), call, path, text[:STATUS_LENGTH])
+
+def callsign(source):
+	#APRS source calls are at most 9 alphanumeric characters, a dash would be read as an SSID
+	return re.sub('[^A-Z0-9]', '', str(source).upper())[:9] or 'UNKNOWN'
+
+def record(packet, source=None, lat=None, lon=None, alt=None, course=None, aprs=None):
+	return {"tag": packet.tag, "source": source, "utc": packet.utc, "lat": lat, "lon": lon, "alt": alt, "course": course, "aprs": aprs}
+
+
+@register("aprs")
+def decode_aprs(packet, call):
+	#direwolf output, already APRS after the 6 character prefix
+	return [record(packet, aprs=packet.payload[6:])]
+
+@register("radiosonde")
+class RadiosondeDecoder(object):
+
+	#Frames are added to the per sonde tracks in order, see sonde.SondeTracker
+
+	def __init__(self, config):
+		self.tracker = sonde.SondeTracker(config)
+
+	def __call__(self, packet, call):
+		if '{' not in packet.payload or '}' not in packet.payload: #only lines in json format carry a position
+			return []
+		line_json = json.loads(packet.payload)
+		id = line_json.get("id", line_json["type"])
+		#One station per serial, matching the station of its landing prediction
+		aprs = position_packet(call, callsign(id), line_json["lat"], line_json["lon"], line_json["alt"], line_json["heading"], '/', 'O')
+		records = [record(packet, id, line_json["lat"], line_json["lon"], line_json["alt"], line_json["heading"], aprs)]
+
+		t = packet.utc.replace(tzinfo=datetime.timezone.utc).timestamp()
+		summary = self.tracker.add(	id, line_json["type"], line_json.get("frame", 0), t, line_json["lat"], line_json["lon"], line_json["alt"], \
+									line_json.get("vel_h", 0.0), line_json["heading"], line_json.get("vel_v", 0.0), line_json.get("sats", 0))
+		if summary is not None:
+			#Predicted landing point as its own station, the serial with an L suffix
+			prediction = summary["prediction"]
+			aprs = position_packet(call, callsign(id)[:8] + 'L', prediction["lat"], prediction["lon"], self.tracker.config["f_sonde_ground_altitude"], 0, '/', '/')
+			records.append(record(packet, id, aprs=aprs))
+		return records
+
+@register("ais")
+class AisDecoder(object):
+
+	#Multi-part messages and the vessel table need every sentence in order, see ais.AisEngine
+
+	def __init__(self, config):
+		self.engine = ais.AisEngine(config)
+
+	def __call__(self, packet, call):
+		#message = "!AIVDM,1,1,,A,15RTgt0PAso;90TKcjM8h6g208CQ,0*4A"
+		vessel = self.engine.update(packet.payload)
+		if vessel is None:
+			return []
+		course = vessel["heading"] if vessel["heading"] not in (None, ais.HEADING_UNAVAILABLE) else (vessel["course"] or 0)
+		aprs = position_packet(call, vessel["mmsi"], vessel["lat"], vessel["lon"], 1, course, '/', 'Y')
+		return [record(packet, vessel["mmsi"], vessel["lat"], vessel["lon"], 0.0, course, aprs)]
+
+@register("acars")
+def decode_acars(packet, call):
+	#acarsdec -o 4, one JSON object per message
+	message = json.loads(packet.payload)
+	source = message.get("tail") or message.get("flight") or "ACARS"
+	text = '{} {} {}'.format(message.get("flight", ""), message.get("label", ""), message.get("text", "")).strip()
+	return [record(packet, callsign(source), aprs=status_packet(call, source, text))]
+
+@register("vdl2")
+def decode_vdl2(packet, call):
+	#dumpvdl2 --output decoded:json, the aircraft position is only sent in XID frames
+	avlc = json.loads(packet.payload)["vdl2"]["avlc"]
+	acars = avlc.get("acars", {})
+	source = acars.get("reg") or avlc["src"]["addr"]
+
+	for parameter in avlc.get("xid", {}).get("vdl_params", []):
+		if parameter.get("name") == "ac_location":
+			location = parameter["value"]
+			lat, lon, alt = location["loc"]["lat"], location["loc"]["lon"], location.get("alt", 0) * 0.3048
+			aprs = position_packet(call, callsign(source), lat, lon, alt, 0, '/', '^')
+			return [record(packet, callsign(source), lat, lon, alt, 0.0, aprs)]
+
+	text = '{} {} {}'.format(acars.get("flight", ""), acars.get("label", ""), acars.get("msg_text", "")).strip() or avlc["src"].get("status", "")
+	return [record(packet, callsign(source), aprs=status_packet(call, source, text))]
+
+@register("rtl433")
+def decode_rtl433(packet, call):
+	#rtl_433 -F json, fields depend on the device model
+	message = json.loads(packet.payload)
+	model = message.get("model", "ISM")
+	device = str(message.get("id", ""))
+	source = '{}-{}'.format(model, device) if device else model
+	#Short call from the model and the device id, e.g. ACUR1234
+	short = callsign(re.sub('[^A-Za-z0-9]', '', model)[:4] + device[-5:])
+	if "lat" in message and "lon" in message:
+		alt = message.get("alt", 0.0)
+		aprs = position_packet(call, short, message["lat"], message["lon"], alt, 0, '/', '[')
+		return [record(packet, source, message["lat"], message["lon"], alt, 0.0, aprs)]
+
+	values = ' '.join('{}={}'.format(key, value) for key, value in message.items() if isinstance(value, (int, float)) and key not in ("id", "channel"))
+	return [record(packet, source, aprs=status_packet(call, short, '{} {}'.format(model, values)))]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import datetime
+from threading import Lock
+
+import numpy as np
+
+#Rails with a power monitor. The display rail only feeds the display, everything
+#else (decoders, dongles) runs from the OBC rail and is split by a RailModel.
+RAILS = ("obc", "display")
+SHARED_RAILS = ("obc",)
+
+
+class RailModel(object):
+
+	"""
+	Marginal power of each consumer on a rail, estimated online. The mean rail power
+	of every window is regressed on the activity of the consumers (process running,
+	dongle powered) plus a constant baseline with a Kalman filter. A consumer that
+	is started or stopped shows up as a step in rail power, which moves its own
+	coefficient only. A consumer whose activity never changed (an always running
+	application) cannot be told apart from the baseline, it stays out of the
+	regression and the attribution until it is started or stopped once.
+	"""
+
+	def __init__(self, prior_power, prior_sigma, process_noise):
+		self.prior_power = prior_power
+		self.prior_variance = prior_sigma ** 2
+		self.process_noise = process_noise
+
+		self.features = []
+		#feature -> activity values seen, identified once it has two
+		self.values = {}
+		self.theta = np.zeros(1)
+		self.P = np.eye(1) * 100.0
+
+	def _ensure(self, features):
+		for feature in features:
+			if feature not in self.features:
+				self.features.append(feature)
+				self.values[feature] = set()
+				self.theta = np.append(self.theta, self.prior_power)
+				n = len(self.theta)
+				P = np.zeros((n, n))
+				P[:n-1, :n-1] = self.P
+				P[n-1, n-1] = self.prior_variance
+				self.P = P
+
+	def identified(self, feature):
+		return len(self.values[feature]) > 1
+
+	def update(self, activity, power):
+		self._ensure(activity)
+		for feature in self.features:
+			self.values[feature].add(float(activity.get(feature, 0)))
+		x = np.array([1.0] + [float(activity.get(feature, 0)) if self.identified(feature) else 0.0 for feature in self.features])
+
+		#Random walk on the coefficients, capped so idle consumers do not wind up
+		P = self.P + np.eye(len(x)) * self.process_noise
+		limit = np.full(len(x), self.prior_variance)
+		limit[0] = 100.0
+		scale = np.sqrt(np.minimum(1.0, limit / np.diag(P)))
+		P = P * np.outer(scale, scale)
+
+		Px = P.dot(x)
+		k = Px / (x.dot(Px) + 0.01)
+		self.theta = self.theta + k * (power - x.dot(self.theta))
+		self.P = P - np.outer(k, Px)
+
+	def attribute(self, activity, power):
+		#Watts per active consumer, the remainder is the rail baseline
+		shares = {}
+		for i, feature in enumerate(self.features):
+			if activity.get(feature, 0) and self.identified(feature):
+				shares[feature] = max(0.0, float(self.theta[i + 1]))
+		total = sum(shares.values())
+		if total > power > 0:
+			shares = {feature: share * power / total for feature, share in shares.items()}
+		return shares, max(0.0, power - sum(shares.values()))
+
+	def coefficients(self):
+		#None for consumers not identified yet, their power is in the baseline
+		result = {"baseline": round(float(self.theta[0]), 3)}
+		for i, feature in enumerate(self.features):
+			result[feature] = round(float(self.theta[i + 1]), 3) if self.identified(feature) else None
+		return result
+
+
+class EnergyAccountant(object):
+
+	"""
+	Cumulative energy per s_id from the power windows of the rail monitors, one
+	second with b_power_highrate and one polling period otherwise. Rail energy is split over the consumers active in that window,
+	using the marginal power estimated by the rail's RailModel.
+	"""
+
+	def __init__(self, config, activity, battery):
+		self.config = config
+		self.activity = activity
+		self.battery = battery
+		self.lock = Lock()
+
+		self.models = {rail: RailModel(config["f_prior_power"], config["f_prior_sigma"], config["f_process_noise"]) for rail in SHARED_RAILS}
+		self.energy = {}
+		self.power = {rail: {} for rail in RAILS}
+		self.rails = {rail: {"wh": 0.0, "power": 0.0} for rail in RAILS}
+		self.since = datetime.datetime.utcnow().isoformat() + 'Z'
+
+	def _owner(self, feature):
+		#Dongle features are named rf:<dongle>, their energy belongs to the RF subsystem
+		return feature.split(':')[0]
+
+	def add_window(self, rail, aggregate):
+		power = aggregate["consumption"]
+		energy = aggregate["energy"]
+		duration = energy / power if power > 0 else 0.0
+
+		model = self.models.get(rail)
+		activity = self.activity() if model is not None else {}
+		with self.lock:
+			if model is not None:
+				model.update(activity, power)
+				shares, baseline = model.attribute(activity, power)
+			else:
+				shares, baseline = {}, power
+
+			watts = {rail: baseline}
+			for feature, share in shares.items():
+				owner = self._owner(feature)
+				watts[owner] = watts.get(owner, 0.0) + share
+			for owner, share in watts.items():
+				self.energy[owner] = self.energy.get(owner, 0.0) + share * duration
+			self.power[rail] = watts
+
+			self.rails[rail]["wh"] += energy / 3600.0
+			self.rails[rail]["power"] = power
+
+	def get_energy(self):
+		with self.lock:
+			total_power = sum(entry["power"] for entry in self.rails.values())
+			wh_left = self.battery()
+			t_left = wh_left / total_power if total_power > 0 else 0.0
+
+			systems = {}
+			for owner, joules in self.energy.items():
+				power = sum(watts.get(owner, 0.0) for watts in self.power.values())
+				#Extra hours of battery if this consumer was stopped now
+				gain = 0.0
+				if 0 < power < total_power:
+					gain = wh_left / (total_power - power) - t_left
+				systems[owner] = {"wh": round(joules / 3600.0, 4), "power": round(power, 3), "runtime_gain": round(gain, 3)}
+
+			return 	{
+						"since" : self.since,
+						"systems" : systems,
+						"rails" : {rail: {"wh": round(entry["wh"], 4), "power": round(entry["power"], 3)} for rail, entry in self.rails.items()},
+						"models" : {rail: model.coefficients() for rail, model in self.models.items()},
+						"battery" : {"wh_left": round(wh_left, 2), "t_left": round(t_left, 3)}
+					}
@@ -11,17 +11,9 @@ import zmq
 import signal
 import socket
 import argparse
-import pickle
-import datetime
 
-
-class Packet(object):
-
-	def __init__(self, tag, payload):
-
-		self.tag = tag
-		self.utc = datetime.datetime.utcnow()
-		self.payload = payload
+import codec
+from packet import Packet
 
 
 class Forwarder(object):
@@ -34,8 +26,8 @@ class Forwarder(object):
 		self.socket.connect(self.host)
 
 	def publish(self, packet):
-		to_send = pickle.dumps(packet)
-		self.socket.send(to_send)
+		to_send = codec.encode_packet(packet)
+		self.socket.send_multipart([codec.packet_topic(packet.tag), to_send])
 
 def handler_stop_signals(signum, frame):
 	sys.exit()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import numpy as np
+
+#Polar regions (UPS) are left to the mgrs library, everything else is computed here
+try:
+	import mgrs as mgrs_lib
+except ImportError:
+	mgrs_lib = None
+
+EARTH_RADIUS = 6371008.8
+
+#WGS84 and the UTM projection, Krueger series to third order (sub-millimeter within a zone)
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+UTM_K0 = 0.9996
+_N = WGS84_F / (2 - WGS84_F)
+_A = WGS84_A / (1 + _N) * (1 + _N**2 / 4 + _N**4 / 64)
+_ALPHA = (	_N / 2 - 2 * _N**2 / 3 + 5 * _N**3 / 16,
+			13 * _N**2 / 48 - 3 * _N**3 / 5,
+			61 * _N**3 / 240)
+_E = 2 * np.sqrt(_N) / (1 + _N)
+
+_BANDS = np.frombuffer(b'CDEFGHJKLMNPQRSTUVWXX', dtype=np.uint8)
+_COLUMNS = np.frombuffer(b'ABCDEFGHJKLMNPQRSTUVWXYZ', dtype=np.uint8)
+_ROWS = np.frombuffer(b'ABCDEFGHJKLMNPQRSTUV', dtype=np.uint8)
+
+
+def _strings(codes):
+	#(n, width) array of ASCII codes to an array of str, one row per string
+	codes = np.ascontiguousarray(codes, dtype=np.uint8)
+	return codes.view('S{}'.format(codes.shape[1])).ravel().astype(str)
+
+def _valid(lat, lon):
+	#Rows with a position on the globe, NaN or out of range coordinates from a bad decode are not
+	return np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90.0) & (np.abs(lon) <= 180.0)
+
+def _masked(result, valid):
+	#Results of the valid rows spread over all rows, None for the others
+	masked = np.full(len(valid), None, dtype=object)
+	masked[valid] = result
+	return masked
+
+def maidenhead(lat, lon, length=6):
+	"""
+	Maidenhead locators of 2, 4, 6 or 8 characters for arrays of coordinates in degrees,
+	None for rows without a valid position.
+	"""
+
+	if length not in (2, 4, 6, 8):
+		raise ValueError('Maidenhead locator length must be 2, 4, 6 or 8, not {}'.format(length))
+
+	lat = np.atleast_1d(np.asarray(lat, dtype=float))
+	lon = np.atleast_1d(np.asarray(lon, dtype=float))
+	valid = _valid(lat, lon)
+	if not valid.all():
+		return _masked(maidenhead(lat[valid], lon[valid], length), valid)
+
+	lat = np.clip(lat + 90.0, 0.0, np.nextafter(180.0, 0))
+	lon = np.clip(lon + 180.0, 0.0, np.nextafter(360.0, 0))
+
+	#Field, square, subsquare and extended square, as (longitude, latitude) pairs
+	pairs = [	(ord('A'), lon // 20, lat // 10),
+				(ord('0'), lon // 2 % 10, lat // 1 % 10),
+				(ord('a'), np.floor(lon * 12) % 24, np.floor(lat * 24) % 24),
+				(ord('0'), np.floor(lon * 120) % 10, np.floor(lat * 240) % 10)]
+
+	codes = np.empty((len(lat), length), dtype=np.uint8)
+	for i, (base, x, y) in enumerate(pairs[:length // 2]):
+		codes[:, 2*i] = base + x
+		codes[:, 2*i+1] = base + y
+	return _strings(codes)
+
+def utm_zone(lat, lon):
+	zone = (np.floor((lon + 180.0) / 6.0).astype(int) % 60) + 1
+
+	#Norway and Svalbard exceptions
+	zone = np.where((lat >= 56) & (lat < 64) & (lon >= 3) & (lon < 12), 32, zone)
+	svalbard = (lat >= 72) & (lat < 84)
+	for west, east, exception in ((0, 9, 31), (9, 21, 33), (21, 33, 35), (33, 42, 37)):
+		zone = np.where(svalbard & (lon >= west) & (lon < east), exception, zone)
+	return zone
+
+def utm(lat, lon, zone):
+	#Easting and northing in meters for the given zones, false northing applied south of the equator
+	phi = np.radians(lat)
+	dlambda = np.radians(lon - (zone * 6 - 183))
+
+	t = np.sinh(np.arctanh(np.sin(phi)) - _E * np.arctanh(_E * np.sin(phi)))
+	xi = np.arctan2(t, np.cos(dlambda))
+	eta = np.arctanh(np.sin(dlambda) / np.sqrt(1 + t * t))
+
+	easting = eta.copy()
+	northing = xi.copy()
+	for j, alpha in enumerate(_ALPHA, 1):
+		easting += alpha * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+		northing += alpha * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+
+	easting = 500000.0 + UTM_K0 * _A * easting
+	northing = UTM_K0 * _A * northing
+	return easting, np.where(northing < 0, northing + 10000000.0, northing)
+
+def mgrs(lat, lon):
+	"""
+	MGRS references with 1 m resolution (zone, band, 100 km square, 5+5 digits) for arrays
+	of coordinates in degrees, formatted like mgrs.MGRS().toMGRS(). None for rows without a
+	valid position.
+	"""
+
+	lat = np.atleast_1d(np.asarray(lat, dtype=float))
+	lon = np.atleast_1d(np.asarray(lon, dtype=float))
+	valid = _valid(lat, lon)
+	if not valid.all():
+		return _masked(mgrs(lat[valid], lon[valid]), valid)
+
+	lon = (lon + 180.0) % 360.0 - 180.0
+
+	zone = utm_zone(lat, lon)
+	easting, northing = utm(lat, lon, zone)
+	easting = np.floor(easting).astype(np.int64)
+	northing = np.floor(northing).astype(np.int64)
+
+	band = _BANDS[np.clip((lat + 80.0) // 8, 0, len(_BANDS) - 1).astype(int)]
+
+	#100 km square letters repeat every 3 zones in easting and 2 zones in northing
+	group = (zone - 1) % 6
+	column = _COLUMNS[(group % 3) * 8 + easting // 100000 - 1]
+	row = _ROWS[(northing // 100000 + 5 * (group % 2)) % 20]
+
+	codes = np.empty((len(lat), 15), dtype=np.uint8)
+	codes[:, 0] = ord('0') + zone // 10
+	codes[:, 1] = ord('0') + zone % 10
+	codes[:, 2] = band
+	codes[:, 3] = column
+	codes[:, 4] = row
+	for i, divisor in enumerate((10000, 1000, 100, 10, 1)):
+		codes[:, 5+i] = ord('0') + easting % 100000 // divisor % 10
+		codes[:, 10+i] = ord('0') + northing % 100000 // divisor % 10
+	result = _strings(codes)
+
+	polar = (lat < -80.0) | (lat >= 84.0)
+	if polar.any():
+		converter = mgrs_lib.MGRS() if mgrs_lib is not None else None
+		result = result.astype(object)
+		for i in np.nonzero(polar)[0]:
+			#Older mgrs releases return bytes
+			reference = converter.toMGRS(lat[i], lon[i]) if converter is not None else ""
+			result[i] = reference.decode('utf-8') if isinstance(reference, bytes) else reference
+	return result
+
+def distance(lat1, lon1, lat2, lon2):
+	#Great circle distance in meters, haversine on the mean earth radius
+	phi1, phi2 = np.radians(lat1), np.radians(lat2)
+	dphi = phi2 - phi1
+	dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+	h = np.sin(dphi / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2)**2
+	return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+def bearing(lat1, lon1, lat2, lon2):
+	#Initial great circle bearing from point 1 to point 2 in degrees, 0 - 360
+	phi1, phi2 = np.radians(lat1), np.radians(lat2)
+	dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+	y = np.sin(dlambda) * np.cos(phi2)
+	x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlambda)
+	return np.degrees(np.arctan2(y, x)) % 360.0
+
+def annotate(contacts, origin=None, length=6):
+	"""
+	Add grid, mgrs and, when an origin (lat, lon) is given, range (m) and bearing (degrees)
+	to a list of contact dicts with lat and lon keys, in one vectorized pass. A contact
+	without a valid position gets None for all of them and for lat and lon, NaN is not JSON.
+	"""
+
+	if not contacts:
+		return contacts
+
+	lat = np.fromiter((contact["lat"] for contact in contacts), dtype=float, count=len(contacts))
+	lon = np.fromiter((contact["lon"] for contact in contacts), dtype=float, count=len(contacts))
+	valid = _valid(lat, lon)
+
+	grids = maidenhead(lat, lon, length)
+	references = mgrs(lat, lon)
+	if origin is not None:
+		ranges = _masked(np.round(distance(origin[0], origin[1], lat[valid], lon[valid]), 1), valid).tolist()
+		bearings = _masked(np.round(bearing(origin[0], origin[1], lat[valid], lon[valid]), 1), valid).tolist()
+	else:
+		ranges = bearings = [None] * len(contacts)
+
+	for i in np.nonzero(~valid)[0]:
+		contacts[i]["lat"] = contacts[i]["lon"] = None
+
+	for contact, grid, reference, r, b in zip(contacts, grids.tolist(), references.tolist(), ranges, bearings):
+		contact["grid"] = grid
+		contact["mgrs"] = reference
+		contact["range"] = r
+		contact["bearing"] = b
+	return contacts
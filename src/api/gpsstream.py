@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import json
+import socket
+
+WATCH = b'?WATCH={"enable":true,"json":true}\n'
+
+
+class GpsdStream(object):
+
+	"""
+	Client for the gpsd JSON WATCH stream. Every report (TPV, SKY, ...) is returned
+	by read() as soon as gpsd sends it, so the reader never falls behind the gpsd
+	buffer regardless of the receiver update rate. read() returns None when
+	nothing arrived within the socket timeout.
+	"""
+
+	def __init__(self, host, port, timeout=2.0):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.socket = None
+		self.buffer = b''
+
+	def connect(self):
+		self.close()
+		self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+		self.socket.sendall(WATCH)
+
+	def read(self):
+		if self.socket is None:
+			raise ConnectionError('gpsd not connected')
+		while b'\n' not in self.buffer:
+			try:
+				data = self.socket.recv(4096)
+			except socket.timeout:
+				return None
+			if not data:
+				raise ConnectionError('gpsd closed the connection')
+			self.buffer += data
+
+		line, self.buffer = self.buffer.split(b'\n', 1)
+		try:
+			return json.loads(line)
+		except ValueError:
+			return None
+
+	def close(self):
+		self.buffer = b''
+		if self.socket is not None:
+			self.socket.close()
+			self.socket = None
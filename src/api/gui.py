@@ -44,6 +44,9 @@ GREEN = 				'background-color: rgb(0, 255, 0); font: 9pt \"Noto Sans\";'
 RED = 					'background-color: rgb(255, 0, 0); font: 9pt \"Noto Sans\";'
 ORANGE =				'background-color: rgb(255, 165, 0); font: 9pt \"Noto Sans\";'
 
+#Systems shown by the status bar and menu, their widgets are updated once all of them were received
+STATUSBAR_SYSTEMS = ("obc", "audio", "display", "battery", "clock", "gps", "usb", "rf", "lan", "navigation", "gqrx", "keyboard")
+
 def is_time_between(begin_time, end_time, check_time=None):
 	# If check time is not given, default to current UTC time
 	check_time = check_time or datetime.datetime.utcnow().time()
@@ -952,6 +955,10 @@ class Main(QMainWindow):
 
 		#Update auxiliary widgets (non-grid based)
 
+		received = set(item["id"] for item in current_status)
+		if not received.issuperset(STATUSBAR_SYSTEMS):
+			return
+
 		self.statusbar.obc_temp1_label.setText("T={} °C".format(round([device["status"]["temp1"] for device in current_status if device["id"] == "obc"][0], 1)))
 
 
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hardware abstraction layer. Subsystems reach GPIO, the I2C power monitors, the battery ADC,
+the 1-wire sensors, the backlight, the mixer, the RTL-SDR enumerator and gpsd only through
+the functions at the bottom of this module.
+
+The real backend imports the Raspberry Pi libraries when it is selected, so none of them
+are needed to load systems.py. The simulated backend produces sine + noise waveforms with
+configurable access latencies, which is enough to run the full server on a development
+machine at the sample rates of the device.
+"""
+
+__author__ = 'Tom Mladenov'
+
+import os
+import math
+import time
+import random
+import datetime
+import glob
+from threading import Lock
+
+W1_DEVICES = '/sys/bus/w1/devices'
+
+
+class Waveform(object):
+
+	def __init__(self, offset, amplitude, period, noise, phase=0.0):
+		self.offset = offset
+		self.amplitude = amplitude
+		self.period = period
+		self.noise = noise
+		self.phase = phase
+
+	def sample(self, t=None):
+		if t is None:
+			t = time.monotonic()
+		value = self.offset + self.amplitude * math.sin(2 * math.pi * t / self.period + self.phase)
+		if self.noise:
+			value += random.gauss(0.0, self.noise * max(abs(self.offset), abs(self.amplitude), 1.0))
+		return value
+
+
+class RealBackend(object):
+
+	name = "real"
+
+	def __init__(self, config):
+		import RPi.GPIO as GPIO
+		self.config = config
+		self.GPIO = GPIO
+		self.GPIO.setmode(GPIO.BCM)
+		self.bus = None
+		self.lock = Lock()
+
+	def i2c(self):
+		#One bus object for every device, created on first use
+		with self.lock:
+			if self.bus is None:
+				import board
+				self.bus = board.I2C()
+			return self.bus
+
+	def setup_input(self, pin):
+		self.GPIO.setup(pin, self.GPIO.IN)
+
+	def setup_output(self, pin):
+		self.GPIO.setup(pin, self.GPIO.OUT)
+
+	def read_pin(self, pin):
+		return int(self.GPIO.input(pin))
+
+	def write_pin(self, pin, value):
+		self.GPIO.output(pin, bool(value))
+
+	def add_edge_callback(self, pin, callback, bouncetime):
+		self.GPIO.add_event_detect(pin, self.GPIO.BOTH, callback=callback, bouncetime=bouncetime)
+
+	def power_monitor(self, address, averaging=4):
+		from ina219 import CustomINA219
+		ina219 = CustomINA219(self.i2c(), addr=address)
+		ina219.set_custom_calibration_16V_3A()
+		ina219.set_averaging(averaging)
+		return ina219
+
+	def battery_adc(self, address):
+		import Adafruit_ADS1x15
+		return Adafruit_ADS1x15.ADS1115(address=address)
+
+	def trigger_temperature_conversion(self):
+		#Starts a conversion on every sensor of every bus master, False if the kernel has no bulk read support
+		masters = glob.glob('{}/w1_bus_master*/therm_bulk_read'.format(W1_DEVICES))
+		for path in masters:
+			with open(path, 'w') as f:
+				f.write('trigger\n')
+		return len(masters) > 0
+
+	def temperature_conversion_pending(self):
+		for path in glob.glob('{}/w1_bus_master*/therm_bulk_read'.format(W1_DEVICES)):
+			with open(path) as f:
+				if int(f.read()) == -1:
+					return True
+		return False
+
+	def read_temperature(self, sensor):
+		#After a bulk conversion this returns the latched value, otherwise the kernel converts first (~750 ms)
+		try:
+			with open('{}/{}/temperature'.format(W1_DEVICES, sensor)) as f:
+				return int(f.read())/1000.0, True
+		except (OSError, ValueError):
+			return 0.0, False
+
+	def system_sampler(self):
+		from sysmon import SysfsSampler
+		return SysfsSampler()
+
+	def backlight_present(self):
+		return os.path.isfile('/sys/class/backlight/rpi_backlight/max_brightness')
+
+	def backlight(self):
+		from rpi_backlight import Backlight
+		return Backlight()
+
+	def mixer(self):
+		import alsaaudio
+		return alsaaudio.Mixer(control="Headphone", id=0, cardindex=0, device="default")
+
+	def rtlsdr_index(self, serial):
+		from rtlsdr import RtlSdr
+		return RtlSdr.get_device_index_by_serial(serial)
+
+	def rtlsdr_probe(self, index):
+		#Raises when the dongle is in use by another process
+		from rtlsdr import RtlSdr
+		sdr = RtlSdr(index)
+		sdr.close()
+
+	def gps_stream(self, host, port):
+		from gpsstream import GpsdStream
+		return GpsdStream(host, port)
+
+
+class SimPowerMonitor(object):
+
+	def __init__(self, backend, address):
+		self.backend = backend
+		phase = (address & 0x0f) * 0.7
+		self.voltage = Waveform(5.1, 0.05, backend.period, backend.noise, phase)
+		self.current_ma = Waveform(900.0 + 300.0 * (address & 0x0f), 250.0, backend.period / 3.0, backend.noise, phase)
+
+	def set_custom_calibration_16V_3A(self):
+		pass
+
+	def set_averaging(self, samples):
+		pass
+
+	@property
+	def bus_voltage(self):
+		self.backend.i2c_access()
+		return self.voltage.sample()
+
+	@property
+	def shunt_voltage(self):
+		return self.current / 1000.0 * 0.1
+
+	@property
+	def current(self):
+		self.backend.i2c_access()
+		return self.current_ma.sample()
+
+	@property
+	def power(self):
+		return self.bus_voltage * self.current / 1000.0
+
+
+class SimADC(object):
+
+	#The battery board drives one ADS1115 channel per 25 % level LED
+	HIGH = 26000
+	LOW = 200
+
+	def __init__(self, backend):
+		self.backend = backend
+		self.level = Waveform(0.5, 0.5, backend.period, 0.0, -math.pi / 2)
+
+	def read_adc(self, channel, gain=1):
+		self.backend.i2c_access()
+		level = self.level.sample()
+		raw = self.HIGH if level > channel / 4.0 else self.LOW
+		return int(raw + random.gauss(0.0, self.backend.noise * 1000.0))
+
+
+class SimBacklight(object):
+
+	def __init__(self):
+		self.fade_duration = 0
+		self.power = False
+		self.brightness = 0
+
+
+class SimMixer(object):
+
+	def __init__(self):
+		self.volume = 0
+		self.mute = 0
+
+	def setvolume(self, volume):
+		self.volume = max(0, min(100, int(volume)))
+
+	def getvolume(self):
+		return [self.volume]
+
+	def setmute(self, mute):
+		self.mute = int(mute)
+
+	def getmute(self):
+		return [self.mute]
+
+
+class SimGpsStream(object):
+
+	"""
+	Same reports as the gpsd WATCH stream: TPV at f_sim_gps_rate Hz while driving
+	around a circle of about 1 km, SKY with per-satellite SNR once per second.
+	"""
+
+	def __init__(self, backend):
+		self.backend = backend
+		self.connected = False
+		self.period = 1.0 / backend.config.get("f_sim_gps_rate", 1.0)
+		self.next = 0.0
+		self.last_sky = 0.0
+
+	def connect(self):
+		self.connected = True
+		self.next = time.monotonic()
+
+	def _tpv(self, t):
+		angle = 2 * math.pi * t / self.backend.period
+		return 	{
+					"class" : "TPV",
+					"mode" : 3,
+					"time" : datetime.datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+					"lat" : self.backend.lat + 0.009 * math.sin(angle),
+					"lon" : self.backend.lon + 0.013 * math.cos(angle),
+					"altMSL" : self.backend.altitude.sample(t),
+					"track" : math.degrees(-angle) % 360.0,
+					"speed" : 10.0,
+					"climb" : 0.0,
+					"epx" : 3.0, "epy" : 3.5, "epv" : 4.5, "eps" : 0.3, "ept" : 0.005, "epc" : 0.5
+				}
+
+	def _sky(self, t):
+		satellites = []
+		for prn in range(1, 13):
+			ss = 20.0 + 25.0 * math.sin(2 * math.pi * t / self.backend.period + prn) + random.gauss(0.0, 1.0)
+			satellites.append({"PRN": prn, "el": (prn * 7) % 90, "az": (prn * 30) % 360, "ss": round(max(0.0, ss), 1), "used": ss > 30.0})
+		return {"class": "SKY", "satellites": satellites}
+
+	def read(self):
+		if not self.connected:
+			raise ConnectionError('gpsd not connected')
+		now = time.monotonic()
+		if now - self.last_sky >= 1.0:
+			self.last_sky = now
+			return self._sky(now)
+		if self.next > now:
+			time.sleep(self.next - now)
+		self.next = max(self.next + self.period, time.monotonic() - self.period)
+		return self._tpv(time.monotonic())
+
+	def close(self):
+		self.connected = False
+
+
+class SimSampler(object):
+
+	#Same fields as sysmon.SysfsSampler, the firmware throttles above TEMP_LIMIT
+	TEMP_LIMIT = 57.0
+
+	def __init__(self, backend):
+		self.backend = backend
+		self.cores = backend.config.get("i_sim_cores", 4)
+		self.load = Waveform(0.8, 0.6, backend.period / 2.0, backend.noise)
+
+	def sample(self):
+		temp = round(self.backend.cpu.sample(), 1)
+		throttled = 0x8 | 0x80000 if temp > self.TEMP_LIMIT else 0
+		load = max(0.0, self.load.sample())
+		sample = 	{
+						"temp1" : temp,
+						"cpu_freq" : 1200 if throttled else 1500,
+						"throttled" : throttled,
+						"under_voltage" : 0,
+						"freq_capped" : 0,
+						"throttling" : 0,
+						"temp_limit" : int(bool(throttled)),
+						"load1" : round(load, 2),
+						"load5" : round(self.load.offset, 2),
+						"load15" : round(self.load.offset, 2),
+						"cpu_util" : round(min(100.0, 100.0 * load / self.cores), 1)
+					}
+		for core in range(self.cores):
+			sample["cpu{}_util".format(core)] = round(min(100.0, max(0.0, random.gauss(sample["cpu_util"], 5.0))), 1)
+		return sample
+
+	def close(self):
+		pass
+
+
+class SimBackend(object):
+
+	name = "sim"
+
+	def __init__(self, config):
+		self.config = config
+		self.period = config.get("f_sim_period", 600.0)
+		self.noise = config.get("f_sim_noise", 0.01)
+		self.i2c_latency = config.get("f_sim_i2c_latency", 0.0)
+		self.w1_latency = config.get("f_sim_w1_latency", 0.0)
+		self.serials = config.get("l_sim_rtlsdr", [])
+		self.lat = config.get("f_sim_lat", 0.0)
+		self.lon = config.get("f_sim_lon", 0.0)
+
+		self.pins = {pin: 1 for pin in config.get("l_sim_gpio_high", [])}
+		self.callbacks = {}
+		self.temperatures = {}
+		self.cpu = Waveform(52.0, 6.0, self.period, self.noise)
+		self.altitude = Waveform(100.0, 5.0, self.period, self.noise)
+
+	def i2c_access(self):
+		if self.i2c_latency:
+			time.sleep(self.i2c_latency)
+
+	def setup_input(self, pin):
+		self.pins.setdefault(pin, 0)
+
+	def setup_output(self, pin):
+		self.pins[pin] = 0
+
+	def read_pin(self, pin):
+		return self.pins.get(pin, 0)
+
+	def write_pin(self, pin, value):
+		#Writing an input pin simulates an external level change and fires its edge callbacks
+		value = int(bool(value))
+		changed = self.pins.get(pin, 0) != value
+		self.pins[pin] = value
+		if changed:
+			for callback in self.callbacks.get(pin, []):
+				callback(pin)
+
+	def add_edge_callback(self, pin, callback, bouncetime):
+		self.callbacks.setdefault(pin, []).append(callback)
+
+	def power_monitor(self, address, averaging=4):
+		return SimPowerMonitor(self, address)
+
+	def battery_adc(self, address):
+		return SimADC(self)
+
+	def trigger_temperature_conversion(self):
+		if self.w1_latency:
+			time.sleep(self.w1_latency)
+		return True
+
+	def temperature_conversion_pending(self):
+		return False
+
+	def read_temperature(self, sensor):
+		if sensor not in self.temperatures:
+			self.temperatures[sensor] = Waveform(30.0, 4.0, self.period, self.noise, len(self.temperatures))
+		#DS18B20 resolution is 1/16 degree
+		return round(self.temperatures[sensor].sample() * 16) / 16.0, True
+
+	def system_sampler(self):
+		return SimSampler(self)
+
+	def backlight_present(self):
+		return True
+
+	def backlight(self):
+		return SimBacklight()
+
+	def mixer(self):
+		return SimMixer()
+
+	def rtlsdr_index(self, serial):
+		try:
+			return self.serials.index(serial)
+		except ValueError:
+			raise IOError('No RTL-SDR with serial {}'.format(serial))
+
+	def rtlsdr_probe(self, index):
+		if index >= len(self.serials):
+			raise IOError('No RTL-SDR at index {}'.format(index))
+
+	def gps_stream(self, host, port):
+		return SimGpsStream(self)
+
+
+BACKENDS = {
+	RealBackend.name: RealBackend,
+	SimBackend.name: SimBackend
+}
+
+_backend = None
+
+
+def init(name, config):
+	global _backend
+	if name not in BACKENDS:
+		raise ValueError('Unknown HAL backend {}, expected one of {}'.format(name, ', '.join(BACKENDS)))
+	_backend = BACKENDS[name](config)
+	return _backend
+
+def backend():
+	if _backend is None:
+		raise RuntimeError('HAL not initialized')
+	return _backend
+
+
+def setup_input(pin):
+	backend().setup_input(pin)
+
+def setup_output(pin):
+	backend().setup_output(pin)
+
+def read_pin(pin):
+	return backend().read_pin(pin)
+
+def write_pin(pin, value):
+	backend().write_pin(pin, value)
+
+def add_edge_callback(pin, callback, bouncetime):
+	backend().add_edge_callback(pin, callback, bouncetime)
+
+def power_monitor(address, averaging=4):
+	return backend().power_monitor(address, averaging)
+
+def battery_adc(address):
+	return backend().battery_adc(address)
+
+def trigger_temperature_conversion():
+	return backend().trigger_temperature_conversion()
+
+def temperature_conversion_pending():
+	return backend().temperature_conversion_pending()
+
+def read_temperature(sensor):
+	return backend().read_temperature(sensor)
+
+def system_sampler():
+	return backend().system_sampler()
+
+def backlight_present():
+	return backend().backlight_present()
+
+def backlight():
+	return backend().backlight()
+
+def mixer():
+	return backend().mixer()
+
+def rtlsdr_index(serial):
+	return backend().rtlsdr_index(serial)
+
+def rtlsdr_probe(index):
+	backend().rtlsdr_probe(index)
+
+def gps_stream(host, port):
+	return backend().gps_stream(host, port)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import os
+import time
+import heapq
+import itertools
+from concurrent.futures import Future
+from threading import Thread, Condition
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class Transaction(object):
+
+	def __init__(self, device, function, priority, key):
+		self.device = device
+		self.function = function
+		self.priority = priority
+		self.key = key
+		self.future = Future()
+
+
+class I2CBus(Thread):
+
+	"""
+	Single owner of the I2C bus. Subsystems submit transactions (a callable doing
+	the actual reads/writes on a device) and block on the result, the bus thread
+	runs them one at a time in priority order.
+
+	Every device can have a minimum interval between transactions, a transaction
+	that comes too early waits in a deferred heap instead of holding up the others.
+	All transactions that are ready at the same time run as one batch under a single
+	acquisition of the bus lock file, which is shared with the remote control
+	writer in the GUI process. A keyed transaction submitted while an identical one
+	is still queued is coalesced and gets the same result.
+	"""
+
+	def __init__(self, config):
+		Thread.__init__(self)
+		self.config = config
+		self.name = self.config["s_id"]
+		self.daemon = True
+
+		self.condition = Condition()
+		self.ready = []
+		self.deferred = []
+		self.pending = {}
+		self.last = {}
+		self.sequence = itertools.count()
+
+		self.lock_fd = None
+		if fcntl is not None and self.config["s_lock_file"]:
+			try:
+				self.lock_fd = os.open(self.config["s_lock_file"], os.O_RDWR | os.O_CREAT, 0o666)
+			except OSError as e:
+				print("I2C bus lock file disabled: {}".format(str(e)))
+
+		self.busy = 0.0
+		self.window_start = time.monotonic()
+
+		self.status = 	{
+							"queue_depth" : 0,
+							"transactions" : 0,
+							"batches" : 0,
+							"batch_size" : 0,
+							"coalesced" : 0,
+							"deferred" : 0,
+							"errors" : 0,
+							"utilization" : 0.0,
+							"device_errors" : {}
+						}
+
+		self.running = True
+
+	def _min_interval(self, device):
+		return self.config["l_min_interval"].get(device, self.config["f_min_interval"])
+
+	def submit(self, device, function, priority=PRIORITY_NORMAL, key=None):
+		with self.condition:
+			if key is not None and (device, key) in self.pending:
+				self.status["coalesced"] += 1
+				return self.pending[(device, key)].future
+
+			transaction = Transaction(device, function, priority, key)
+			if key is not None:
+				self.pending[(device, key)] = transaction
+			heapq.heappush(self.ready, (priority, next(self.sequence), transaction))
+			self.status["queue_depth"] = len(self.ready) + len(self.deferred)
+			self.condition.notify()
+			return transaction.future
+
+	def call(self, device, function, priority=PRIORITY_NORMAL, key=None):
+		return self.submit(device, function, priority, key).result(timeout=self.config["f_timeout"])
+
+	def _utilization(self, now):
+		if now - self.window_start >= 1.0:
+			self.status["utilization"] = round(100.0 * self.busy / (now - self.window_start), 1)
+			self.busy = 0.0
+			self.window_start = now
+
+	def get_status(self):
+		self._utilization(time.monotonic())
+		return {"success": True, "status": self.status}
+
+	def stop(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify()
+
+	def _release_deferred(self, now):
+		while self.deferred and self.deferred[0][0] <= now:
+			due, sequence, transaction = heapq.heappop(self.deferred)
+			heapq.heappush(self.ready, (transaction.priority, sequence, transaction))
+
+	def _next_batch(self):
+		#Everything that may run now, in priority order, deferring devices that are rate limited
+		with self.condition:
+			while self.running:
+				now = time.monotonic()
+				self._release_deferred(now)
+
+				batch = []
+				devices = set()
+				while self.ready and len(batch) < self.config["i_batch_max"]:
+					priority, sequence, transaction = heapq.heappop(self.ready)
+					due = self.last.get(transaction.device, 0.0) + self._min_interval(transaction.device)
+					if transaction.device in devices:
+						due = max(due, now + self._min_interval(transaction.device))
+					if due > now and self._min_interval(transaction.device) > 0:
+						heapq.heappush(self.deferred, (due, sequence, transaction))
+						self.status["deferred"] += 1
+						continue
+					devices.add(transaction.device)
+					if transaction.key is not None:
+						del self.pending[(transaction.device, transaction.key)]
+					batch.append(transaction)
+
+				self.status["queue_depth"] = len(self.ready) + len(self.deferred)
+				if batch:
+					return batch
+
+				timeout = self.deferred[0][0] - now if self.deferred else None
+				self.condition.wait(timeout)
+			return []
+
+	def _execute(self, batch):
+		start = time.monotonic()
+		if self.lock_fd is not None:
+			fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+		try:
+			for transaction in batch:
+				if not transaction.future.set_running_or_notify_cancel():
+					continue
+				try:
+					transaction.future.set_result(transaction.function())
+				except Exception as e:
+					self.status["errors"] += 1
+					errors = self.status["device_errors"]
+					errors[transaction.device] = errors.get(transaction.device, 0) + 1
+					transaction.future.set_exception(e)
+				self.last[transaction.device] = time.monotonic()
+		finally:
+			if self.lock_fd is not None:
+				fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+		end = time.monotonic()
+		self.busy += end - start
+		self.status["transactions"] += len(batch)
+		self.status["batches"] += 1
+		self.status["batch_size"] = len(batch)
+		self._utilization(end)
+
+	def run(self):
+		while self.running:
+			batch = self._next_batch()
+			if batch:
+				self._execute(batch)
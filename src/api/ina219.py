@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+from adafruit_ina219 import ADCResolution, BusVoltageRange, INA219, Mode, Gain
+
+
+class CustomINA219(INA219):
+
+	"""
+	Custom INA219 calibration due to use of 50mohm shunt resistor (standard is 100mohm)
+	"""
+
+	def set_averaging(self, samples):
+		#12 bit conversions averaged on chip, 1..128 samples (532 us per sample)
+		resolution = getattr(ADCResolution, "ADCRES_12BIT_{}S".format(samples))
+		self.bus_adc_resolution = resolution
+		self.shunt_adc_resolution = resolution
+		self.mode = Mode.SANDBVOLT_CONTINUOUS
+
+	def set_custom_calibration_16V_3A(self):  # pylint: disable=invalid-name
+
+		# VBUS_MAX = 16V
+		# VSHUNT_MAX = 0.16          (Assumes Gain 3, 160mV)
+		# RSHUNT = 0.05              (Resistor value in ohms)
+
+		# 1. Determine max possible current
+		# MaxPossible_I = VSHUNT_MAX / RSHUNT
+		# MaxPossible_I = 3.2A
+
+		# 2. Determine max expected current
+		# MaxExpected_I = 3.0A
+
+		# 3. Calculate possible range of LSBs (Min = 15-bit, Max = 12-bit)
+		# MinimumLSB = MaxExpected_I/32767
+		# MinimumLSB = 0.000091556              (uA per bit)
+		# MaximumLSB = MaxExpected_I/4096
+		# MaximumLSB = 0.0007324              (uA per bit)
+
+		# 4. Choose an LSB between the min and max values
+		#    (Preferrably a roundish number close to MinLSB)
+		# CurrentLSB = 0.00016 (uA per bit)
+		self._current_lsb = 0.0916  # in milliamps
+
+		# 5. Compute the calibration register
+		# Cal = trunc (0.04096 / (Current_LSB * RSHUNT))
+		# Cal = 13434 (0x347a)
+
+		self._cal_value = 8943
+
+		# 6. Calculate the power LSB
+		# PowerLSB = 20 * CurrentLSB
+		# PowerLSB = 0.003 (3.048mW per bit)
+		self._power_lsb = 0.001832
+
+		# 7. Compute the maximum current and shunt voltage values before overflow
+		#
+		# 8. Compute the Maximum Power
+		#
+
+		# Set Calibration register to 'Cal' calcutated above
+		self._raw_calibration = self._cal_value
+
+		# Set Config register to take into account the settings above
+		self.bus_voltage_range = BusVoltageRange.RANGE_16V
+		self.gain = Gain.DIV_4_160MV
+		self.bus_adc_resolution = ADCResolution.ADCRES_12BIT_4S
+		self.shunt_adc_resolution = ADCResolution.ADCRES_12BIT_4S
+		self.mode = Mode.SANDBVOLT_CONTINUOUS
@@ -6,17 +6,17 @@ __author__ = 'Tom Mladenov'
 from typing import Optional
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.openapi.utils import get_openapi
 from server import Server
 from packet import Packet
+import routes
 
 import sys
 import os
 import uvicorn
 import logging
 import time
-import inspect
 
 tags_metadata = [
     {
@@ -45,15 +45,15 @@ api = FastAPI(openapi_tags=tags_metadata)
 
 def execute_function_subsystem(**kwargs):
 	#print("Server subsystem function invocation: {}.{}({})".format(kwargs["system"], kwargs["function_name"], kwargs["args"]))
+	s = server.systems.get(kwargs["system"])
+	if s is None:
+		return {"success": False, "response": "System with provided ID not found"}
 	try:
-		s = [sys for sys in server.systems if sys.config["s_id"] == kwargs["system"]][0]
 		target_function = getattr(s, kwargs["function_name"])
 		if kwargs["args"]:
 			return target_function(*kwargs["args"])
 		else:
 			return target_function()
-	except IndexError:
-		return {"success": False, "response": "System with provided ID not found"}
 	except Exception as e:
 		return {"success": False, "response": str(e)}
 
@@ -63,8 +63,16 @@ def ping():
 	return {"success": True, "response": "pong"}
 
 @api.get("/systems")
-def get_systems():
-	return server.get_systems()
+def get_systems(type: Optional[str] = None, capability: Optional[str] = None):
+	return server.get_systems(type, capability)
+
+@api.post("/systems/{system}")
+def add_system(system: str):
+	return server.add_system(system)
+
+@api.delete("/systems/{system}")
+def remove_system(system: str):
+	return server.remove_system(system)
 
 @api.get("/config")
 def get_config():
@@ -82,107 +90,28 @@ def get_status():
 def get_configstatus():
 	return server.get_configstatus()
 
+@api.get("/startup")
+def get_startup():
+	return server.get_startup()
 
-@api.get("/systems/{system}/config", tags=["common"])
-def get_config(system: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/{system}/config", tags=["common"])
-def set_config(system: str, key: str, value: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=[key, value])
-
-@api.get("/systems/{system}/status", tags=["common"])
-def get_status(system: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=None)
-
-@api.get("/systems/{system}/configstatus", tags=["common"])
-def get_configstatus(system: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/{system}/power", tags=["common"])
-def set_power(system: str, power: bool):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=[power])
-
-@api.put("/systems/{system}/power/toggle", tags=["common"])
-def toggle_power(system: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/{system}/start_process", tags=["common"])
-def start_process(system: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/{system}/stop_process", tags=["common"])
-def stop_process(system: str):
-	return execute_function_subsystem(system=system, function_name=inspect.stack()[0][3], args=None)
-
-
-
-
-
-@api.put("/systems/obc/reboot", tags=["obc"])
-def reboot():
-	return execute_function_subsystem(system="obc", function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/obc/shutdown", tags=["obc"])
-def shutdown():
-	return execute_function_subsystem(system="obc", function_name=inspect.stack()[0][3], args=None)
-
-
-#-------------AUDIO-------------
-@api.put("/systems/audio/volume", tags=["audio"])
-def set_volume(volume: int):
-	return execute_function_subsystem(system="audio", function_name=inspect.stack()[0][3], args=[volume])
-
-@api.put("/systems/audio/volume/increment", tags=["audio"])
-def increment_volume():
-	return execute_function_subsystem(system="audio", function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/audio/volume/decrement", tags=["audio"])
-def decrement_volume():
-	return execute_function_subsystem(system="audio", function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/audio/mute", tags=["audio"])
-def set_mute(muted: bool):
-	return execute_function_subsystem(system="audio", function_name=inspect.stack()[0][3], args=[muted])
-
-@api.put("/systems/audio/mute/toggle", tags=["audio"])
-def toggle_mute():
-	return execute_function_subsystem(system="audio", function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/audio/test", tags=["audio"])
-def set_test(test: bool):
-	return execute_function_subsystem(system="audio", function_name=inspect.stack()[0][3], args=[test])
-
-
-#-------------DISPLAY-------------
-@api.put("/systems/display/brightness", tags=["display"])
-def set_brightness(brightness: int):
-	return execute_function_subsystem(system="display", function_name=inspect.stack()[0][3], args=[brightness])
-
-@api.put("/systems/display/brightness/increment", tags=["display"])
-def increment_brightness():
-	return execute_function_subsystem(system="display", function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/display/brightness/decrement", tags=["display"])
-def decrement_brightness():
-	return execute_function_subsystem(system="display", function_name=inspect.stack()[0][3], args=None)
-
-@api.put("/systems/display/screenshot")
-def screenshot():
-	return execute_function_subsystem(system="display", function_name=inspect.stack()[0][3], args=None)
+@api.get("/energy")
+def get_energy():
+	return server.get_energy()
 
-@api.get("/systems/rigctl/frequency")
-def get_frequency():
-	return execute_function_subsystem(system="rigctl", function_name=inspect.stack()[0][3], args=None)
+@api.get("/i2c")
+def get_i2c():
+	return server.get_i2c()
 
-@api.put("/systems/rigctl/frequency")
-def set_frequency(frequency: float):
-	return execute_function_subsystem(system="rigctl", function_name=inspect.stack()[0][3], args=[frequency])
+@api.get("/systems/gps/track.gpx")
+def get_track_gpx(hours: float = 1.0, method: str = "none", tolerance: float = 0.0):
+	result = execute_function_subsystem(system="gps", function_name="get_track_gpx", args=[hours, method, tolerance])
+	if not result["success"]:
+		return result
+	return Response(content=result["gpx"], media_type="application/gpx+xml")
 
-@api.get("/systems/rigctl/mode")
-def get_mode():
-	return execute_function_subsystem(system="rigctl", function_name=inspect.stack()[0][3], args=None)
 
+#Subsystem routes, see routes.ROUTES
+routes.register(api, execute_function_subsystem)
 
 
 def custom_openapi():
@@ -7,8 +7,8 @@ import datetime
 
 class Packet(object):
 
-	def __init__(self, tag, payload):
+	def __init__(self, tag, payload, utc=None):
 
 		self.tag = tag
-		self.utc = datetime.datetime.utcnow()
+		self.utc = utc if utc is not None else datetime.datetime.utcnow()
 		self.payload = payload
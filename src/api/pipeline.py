@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+import queue
+from threading import Thread, Lock
+
+
+def _apply(handler, item):
+	#Exceptions are returned instead of raised so one bad item does not abort the rest of the batch
+	try:
+		return True, handler(item)
+	except Exception as e:
+		return False, str(e)
+
+
+class Stage(Thread):
+
+	"""
+	One step of a packet pipeline. Items are put on a bounded queue, the stage thread
+	takes up to batch items at a time and passes each to handler, which returns a list
+	of results (or None) that is put on every output stage.
+	flush is called after every batch, for sinks that write once per batch, and while
+	the queue is empty, for sinks that hold items back.
+
+	A full queue drops the item and counts it, so a slow stage never blocks the ones
+	in front of it.
+	"""
+
+	def __init__(self, name, handler, size, outputs=(), batch=1, flush=None):
+		Thread.__init__(self)
+		self.name = name
+		self.daemon = True
+
+		self.handler = handler
+		self.outputs = list(outputs)
+		self.batch = batch
+		self.flush = flush
+		self.queue = queue.Queue(maxsize=size)
+		self.lock = Lock()
+
+		self.stats = 	{
+							"received" : 0,
+							"processed" : 0,
+							"dropped" : 0,
+							"errors" : 0,
+							"backlog" : 0,
+							"backlog_max" : 0,
+							"rate" : 0.0
+						}
+		self.window_count = 0
+		self.window_start = time.monotonic()
+
+		self.running = True
+
+	def put(self, item):
+		try:
+			self.queue.put_nowait(item)
+		except queue.Full:
+			with self.lock:
+				self.stats["dropped"] += 1
+			return False
+		with self.lock:
+			self.stats["received"] += 1
+			self.stats["backlog_max"] = max(self.stats["backlog_max"], self.queue.qsize())
+		return True
+
+	def get_stats(self):
+		with self.lock:
+			self.stats["backlog"] = self.queue.qsize()
+			return dict(self.stats)
+
+	def stop(self):
+		self.running = False
+
+	def _take(self):
+		items = [self.queue.get(timeout=0.5)]
+		while len(items) < self.batch:
+			try:
+				items.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+		return items
+
+	def _rate(self, n):
+		now = time.monotonic()
+		with self.lock:
+			self.window_count += n
+			if now - self.window_start >= 1.0:
+				self.stats["rate"] = round(self.window_count / (now - self.window_start), 1)
+				self.window_count = 0
+				self.window_start = now
+
+	def _process(self, items):
+		outcomes = [_apply(self.handler, item) for item in items]
+
+		errors = 0
+		for ok, results in outcomes:
+			if not ok:
+				errors += 1
+				continue
+			for result in results or ():
+				for output in self.outputs:
+					output.put(result)
+
+		errors += self._flush()
+
+		with self.lock:
+			self.stats["processed"] += len(items)
+			self.stats["errors"] += errors
+
+	def _flush(self):
+		#Number of errors, 0 or 1
+		if self.flush is None:
+			return 0
+		try:
+			self.flush()
+			return 0
+		except Exception:
+			return 1
+
+	def run(self):
+		while self.running:
+			try:
+				items = self._take()
+			except queue.Empty:
+				if self._flush():
+					with self.lock:
+						self.stats["errors"] += 1
+				self._rate(0)
+				continue
+			try:
+				self._process(items)
+			except Exception:
+				#Output or flush failure, count the batch and keep draining
+				with self.lock:
+					self.stats["errors"] += len(items)
+			self._rate(len(items))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+from threading import Thread
+
+import numpy as np
+
+
+def decimate(t, voltage, current, start, end):
+	"""
+	Reduce one window of samples to min/mean/max per quantity and the energy in joules.
+	Energy is the trapezoid integral of the samples, scaled to the full window so a
+	gap at the window edges does not read as zero consumption.
+	"""
+
+	power = voltage * current
+	if len(t) > 1:
+		energy = float(np.sum((power[1:] + power[:-1]) * np.diff(t)) / 2.0 * (end - start) / (t[-1] - t[0]))
+	else:
+		energy = float(power[0]) * (end - start)
+
+	return 	{
+				"voltage" : float(voltage.mean()),
+				"voltage_min" : float(voltage.min()),
+				"voltage_max" : float(voltage.max()),
+				"current" : float(current.mean()),
+				"current_min" : float(current.min()),
+				"current_max" : float(current.max()),
+				"consumption" : float(power.mean()),
+				"consumption_min" : float(power.min()),
+				"consumption_max" : float(power.max()),
+				"energy" : energy,
+				"samples" : len(t),
+				"sample_rate" : round(len(t) / (end - start), 1)
+			}
+
+
+class PowerSampler(Thread):
+
+	"""
+	Reads an INA219 through read() at i_power_sample_rate Hz into preallocated buffers
+	and hands one aggregate per window to on_window. The INA219 runs in continuous mode with
+	on-chip averaging, so every read returns the latest averaged conversion.
+	"""
+
+	def __init__(self, name, device, rate, on_window, read, window=1.0):
+		Thread.__init__(self)
+		self.name = "{}_power".format(name)
+		self.daemon = True
+
+		self.device = device
+		self.period = 1.0 / rate
+		self.window = window
+		self.on_window = on_window
+		self.read = read
+
+		#Room for late windows, samples beyond this are dropped
+		size = int(rate * window * 2) + 1
+		self.t = np.empty(size)
+		self.voltage = np.empty(size)
+		self.current = np.empty(size)
+		self.n = 0
+
+		self.energy_total = 0.0
+		self.errors = 0
+		self.running = True
+
+	def _read(self):
+		if self.n < len(self.t):
+			self.t[self.n] = time.monotonic()
+			self.voltage[self.n], self.current[self.n] = self.read()
+			self.n += 1
+
+	def _flush(self, start, end):
+		if self.n:
+			n = self.n
+			aggregate = decimate(self.t[:n], self.voltage[:n], self.current[:n], start, end)
+			self.energy_total += aggregate["energy"]
+			aggregate["energy_total"] = self.energy_total
+			aggregate["read_errors"] = self.errors
+			self.n = 0
+			self.on_window(aggregate)
+
+	def stop(self):
+		self.running = False
+
+	def run(self):
+		start = time.monotonic()
+		deadline = start + self.period
+		while self.running:
+			if self.device.available:
+				try:
+					self._read()
+				except Exception:
+					self.errors += 1
+
+			now = time.monotonic()
+			if now - start >= self.window:
+				self._flush(start, now)
+				start = now
+
+			delay = deadline - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+				deadline += self.period
+			else:
+				#Fell behind (bus busy), restart the schedule instead of bursting
+				deadline = time.monotonic() + self.period
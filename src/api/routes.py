@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import inspect
+
+#Declarative map of REST paths onto subsystem methods.
+#(method, path, subsystem function, fixed system or None when taken from the {system} path parameter, query parameters, tags)
+#Query parameters are (name, type) or (name, type, default) for optional ones.
+ROUTES = [
+	("get",	"/systems/{system}/config",				"get_config",			None,		[],								["common"]),
+	("put",	"/systems/{system}/config",				"set_config",			None,		[("key", str), ("value", str)],	["common"]),
+	("get",	"/systems/{system}/status",				"get_status",			None,		[],								["common"]),
+	("get",	"/systems/{system}/configstatus",		"get_configstatus",		None,		[],								["common"]),
+	("put",	"/systems/{system}/power",				"set_power",			None,		[("power", bool)],				["common"]),
+	("put",	"/systems/{system}/power/toggle",		"toggle_power",			None,		[],								["common"]),
+	("put",	"/systems/{system}/start_process",		"start_process",		None,		[],								["common"]),
+	("put",	"/systems/{system}/stop_process",		"stop_process",			None,		[],								["common"]),
+
+	("put",	"/systems/obc/reboot",					"reboot",				"obc",		[],								["obc"]),
+	("put",	"/systems/obc/shutdown",				"shutdown",				"obc",		[],								["obc"]),
+
+	("put",	"/systems/publisher/resync",			"resync",				"publisher",	[],							None),
+	("get",	"/systems/subscriber/contacts",		"get_contacts",			"subscriber",	[],							None),
+	("get",	"/systems/subscriber/pipeline",		"get_pipeline",			"subscriber",	[],							None),
+	("get",	"/systems/subscriber/vessels",		"get_vessels",			"subscriber",	[],							None),
+	("get",	"/systems/subscriber/sondes",			"get_sondes",			"subscriber",	[],							None),
+	("get",	"/systems/subscriber/sonde",			"get_sonde",			"subscriber",	[("id", str)],					None),
+
+	("put",	"/systems/audio/volume",				"set_volume",			"audio",	[("volume", int)],				["audio"]),
+	("put",	"/systems/audio/volume/increment",		"increment_volume",		"audio",	[],								["audio"]),
+	("put",	"/systems/audio/volume/decrement",		"decrement_volume",		"audio",	[],								["audio"]),
+	("put",	"/systems/audio/mute",					"set_mute",				"audio",	[("muted", bool)],				["audio"]),
+	("put",	"/systems/audio/mute/toggle",			"toggle_mute",			"audio",	[],								["audio"]),
+	("put",	"/systems/audio/test",					"set_test",				"audio",	[("test", bool)],				["audio"]),
+
+	("put",	"/systems/display/brightness",			"set_brightness",		"display",	[("brightness", int)],			["display"]),
+	("put",	"/systems/display/brightness/increment",	"increment_brightness",	"display",	[],							["display"]),
+	("put",	"/systems/display/brightness/decrement",	"decrement_brightness",	"display",	[],							["display"]),
+	("put",	"/systems/display/screenshot",			"screenshot",			"display",	[],								None),
+
+	("get",	"/systems/gps/satellites",				"get_satellites",		"gps",		[],								None),
+	("get",	"/systems/gps/track",					"get_track",			"gps",		[("hours", float, 1.0), ("method", str, "none"), ("tolerance", float, 0.0)],	None),
+
+	("get",	"/systems/rigctl/frequency",			"get_frequency",		"rigctl",	[],								None),
+	("put",	"/systems/rigctl/frequency",			"set_frequency",		"rigctl",	[("frequency", float)],			None),
+	("get",	"/systems/rigctl/mode",					"get_mode",				"rigctl",	[],								None),
+]
+
+
+def make_endpoint(dispatch, function_name, system, params):
+	"""
+	Build an endpoint bound to one subsystem method. The signature is generated
+	so FastAPI sees the same path and query parameters as a hand written handler.
+	"""
+
+	names = [param[0] for param in params]
+
+	def endpoint(**kwargs):
+		args = [kwargs[name] for name in names]
+		return dispatch(system=kwargs.get("system", system), function_name=function_name, args=args or None)
+
+	parameters = []
+	if system is None:
+		parameters.append(inspect.Parameter("system", inspect.Parameter.KEYWORD_ONLY, annotation=str))
+	for param in params:
+		default = param[2] if len(param) > 2 else inspect.Parameter.empty
+		parameters.append(inspect.Parameter(param[0], inspect.Parameter.KEYWORD_ONLY, annotation=param[1], default=default))
+
+	endpoint.__signature__ = inspect.Signature(parameters)
+	endpoint.__name__ = function_name
+	return endpoint
+
+
+def register(api, dispatch, routes=ROUTES):
+	for method, path, function_name, system, params, tags in routes:
+		api.add_api_route(path, make_endpoint(dispatch, function_name, system, params), methods=[method.upper()], tags=tags, name=function_name)
@@ -4,9 +4,12 @@
 __author__ = 'Tom Mladenov'
 
 import systems
-import RPi.GPIO as GPIO
-import board
-from threading import Thread
+from startup import StartupScheduler
+from temperature import TemperatureService
+from energy import EnergyAccountant
+from i2cbus import I2CBus
+import hal
+from threading import Thread, Lock
 from configparser import ConfigParser
 import json
 import os
@@ -14,6 +17,122 @@ from influxdb import InfluxDBClient
 import datetime
 import time
 
+CONFIG_FILE = os.environ.get("CYBERDECK_CONFIG", "/home/pi/git/pisdr-cyberdeck/src/api/config.ini")
+
+#(config section, class, sections that must be constructed first), in API/GUI order.
+#Dependencies serialize constructors that touch shared hardware, everything else starts in parallel.
+SYSTEM_TABLE = [
+	#devices
+	("obc",			systems.OBC,			[]),
+	("display",		systems.Display,		["obc"]),			#INA219s on the shared I2C bus
+	("battery",		systems.Battery,		["display"]),		#ADS1115 on the shared I2C bus
+	("dcdc",		systems.DCDC,			[]),
+	("audio",		systems.Audio,			[]),
+	("usb",			systems.USB,			[]),
+	("lan",			systems.LAN,			["usb"]),			#same uhubctl hub
+	("wlan",		systems.WLAN,			[]),
+	("bluetooth",	systems.Bluetooth,		[]),
+	("gps",			systems.GPS,			[]),
+	("rigctl",		systems.RigCtl,			[]),
+	("rf",			systems.RF,				["usb"]),			#dongles are powered by the USB hub
+	("indicator",	systems.Indicator,		[]),
+	("publisher",	systems.Publisher,		[]),
+	("clock",		systems.Clock,			[]),
+
+	#processes
+	("aprs",		systems.APRS,			[]),
+	("ais",			systems.AIS,			[]),
+	("vdl",			systems.VDL,			[]),
+	("acars",		systems.ACARS,			[]),
+	("ism",			systems.ISM,			[]),
+	("rs1",			systems.RS,				[]),
+	("rs2",			systems.RS,				[]),
+	("rtltcp1",		systems.RTLTCP,			[]),
+	("rtltcp2",		systems.RTLTCP,			[]),
+	("gqrx",		systems.GQRX,			[]),
+	("proxy",		systems.Proxy,			[]),
+	("subscriber",	systems.Subscriber,		["proxy", "navigation"]),	#reads the proxy port and the Xastir settings
+
+	#applications
+	("opencpn",		systems.Application,	[]),
+	("fldigi",		systems.Application,	[]),
+	("keyboard",	systems.Application,	[]),
+	("navigation",	systems.Application,	[]),
+	("gpredict",	systems.Gpredict,		[]),
+	("vnc1",		systems.Application,	[]),
+	("vnc2",		systems.Application,	[]),
+]
+
+
+class SystemRegistry(object):
+
+	"""
+	Index of all subsystems by s_id, by s_type (device/process/application) and
+	by capability. Systems can be added and removed at runtime, lookups never
+	walk the full list.
+	"""
+
+	CAPABILITIES = {
+						"power" : "set_power",
+						"process" : "start_process"
+					}
+
+	def __init__(self):
+		self.lock = Lock()
+		self.by_id = {}
+		self.by_type = {}
+		self.by_capability = {capability: {} for capability in self.CAPABILITIES}
+
+	def _capabilities(self, system):
+		return [c for c, function in self.CAPABILITIES.items() if callable(getattr(system, function, None))]
+
+	def add(self, system):
+		id = system.config["s_id"]
+		with self.lock:
+			if id in self.by_id:
+				raise ValueError('System {} already registered'.format(id))
+			self.by_id[id] = system
+			self.by_type.setdefault(system.config["s_type"], {})[id] = system
+			for capability in self._capabilities(system):
+				self.by_capability[capability][id] = system
+
+	def remove(self, id):
+		with self.lock:
+			system = self.by_id.pop(id, None)
+			if system is not None:
+				self.by_type[system.config["s_type"]].pop(id, None)
+				for index in self.by_capability.values():
+					index.pop(id, None)
+			return system
+
+	def get(self, id):
+		return self.by_id.get(id)
+
+	def ids(self):
+		return list(self.by_id)
+
+	def items(self):
+		with self.lock:
+			return list(self.by_id.items())
+
+	def of_type(self, type):
+		with self.lock:
+			return list(self.by_type.get(type, {}).values())
+
+	def with_capability(self, capability):
+		with self.lock:
+			return list(self.by_capability.get(capability, {}).values())
+
+	def __contains__(self, id):
+		return id in self.by_id
+
+	def __iter__(self):
+		with self.lock:
+			return iter(list(self.by_id.values()))
+
+	def __len__(self):
+		return len(self.by_id)
+
 
 class Server(object):
 
@@ -21,105 +140,104 @@ class Server(object):
 		super(Server, self).__init__()
 
 		self.configurator = ConfigParser()
-		self.configurator.read("/home/pi/git/pisdr-cyberdeck/src/api/config.ini")
+		self.configurator.read(CONFIG_FILE)
 
 		server_config = dict(self.load_config(self.configurator.items("server")))
 
 		self.host = server_config["s_server_host"]
 		self.port = server_config["i_server_port"]
 		self.s_header_description = server_config["s_header_description"]
+		self.lazy_hardware = server_config["b_lazy_hardware"]
+
+		#CYBERDECK_HAL=sim runs the server without any of the device hardware
+		self.hal = hal.init(os.environ.get("CYBERDECK_HAL", server_config["s_hal_backend"]), dict(self.load_config(self.configurator.items("hal"))))
+
+		#Every I2C transaction of OBC, Display and Battery goes through this scheduler
+		self.i2c = I2CBus(dict(self.load_config(self.configurator.items("i2c"))))
+		self.i2c.start()
 
-		GPIO.setmode(GPIO.BCM)
-		self.I2C_BUS = board.I2C()
-
-		#devices
-		self.obc = systems.OBC(			self, dict(self.load_config(self.configurator.items("obc"))))
-		self.display = systems.Display(	self, dict(self.load_config(self.configurator.items("display"))))
-		self.battery = systems.Battery(	self, dict(self.load_config(self.configurator.items("battery"))))
-		self.dcdc = systems.DCDC(		self, dict(self.load_config(self.configurator.items("dcdc"))))
-		self.audio = systems.Audio(		self, dict(self.load_config(self.configurator.items("audio"))))
-		self.usb = systems.USB(			self, dict(self.load_config(self.configurator.items("usb"))))
-		self.lan = systems.LAN(			self, dict(self.load_config(self.configurator.items("lan"))))
-		self.wlan = systems.WLAN(		self, dict(self.load_config(self.configurator.items("wlan"))))
-		self.bluetooth = systems.Bluetooth(		self, dict(self.load_config(self.configurator.items("bluetooth"))))
-		self.gps = systems.GPS(			self, dict(self.load_config(self.configurator.items("gps"))))
-		self.rigctl = systems.RigCtl(	self, dict(self.load_config(self.configurator.items("rigctl"))))
-		self.rf = systems.RF(			self, dict(self.load_config(self.configurator.items("rf"))))
-		self.indicator = systems.Indicator(self, dict(self.load_config(self.configurator.items("indicator"))))
-		self.publisher = systems.Publisher(self, dict(self.load_config(self.configurator.items("publisher"))))
-		self.clock = systems.Clock(self, dict(self.load_config(self.configurator.items("clock"))))
+		#Database first, every polling thread writes to it
 		self.database = systems.Database(self, dict(self.load_config(self.configurator.items("database"))))
 
-		#Processes
-		self.aprs = systems.APRS(self, 		dict(self.load_config(self.configurator.items("aprs"))))
-		self.ais = systems.AIS(self, 		dict(self.load_config(self.configurator.items("ais"))))
-		self.rtltcp1 = systems.RTLTCP(self, dict(self.load_config(self.configurator.items("rtltcp1"))))
-		self.rtltcp2 = systems.RTLTCP(self, dict(self.load_config(self.configurator.items("rtltcp2"))))
-		self.rs1 = systems.RS(self, 		dict(self.load_config(self.configurator.items("rs1"))))
-		self.rs2 = systems.RS(self, 		dict(self.load_config(self.configurator.items("rs2"))))
-		self.acars = systems.ACARS(self, 	dict(self.load_config(self.configurator.items("acars"))))
-		self.vdl = systems.VDL(self, 		dict(self.load_config(self.configurator.items("vdl"))))
-		self.ism = systems.ISM(self, 		dict(self.load_config(self.configurator.items("ism"))))
-		self.gqrx = systems.GQRX(self, 		dict(self.load_config(self.configurator.items("gqrx"))))
-		self.proxy = systems.Proxy(self, 		dict(self.load_config(self.configurator.items("proxy"))))
-		self.subscriber = systems.Subscriber(self, 		dict(self.load_config(self.configurator.items("subscriber"))))
-
-		#Applications
-		self.opencpn = 		systems.Application(self, dict(self.load_config(self.configurator.items("opencpn"))))
-		self.fldigi = 		systems.Application(self, dict(self.load_config(self.configurator.items("fldigi"))))
-		self.keyboard = 	systems.Application(self, dict(self.load_config(self.configurator.items("keyboard"))))
-		self.navigation = 	systems.Application(self, dict(self.load_config(self.configurator.items("navigation"))))
-		self.gpredict = 	systems.Gpredict(self, dict(self.load_config(self.configurator.items("gpredict"))))
-		self.vnc1 = 	systems.Application(self, dict(self.load_config(self.configurator.items("vnc1"))))
-		self.vnc2 = 	systems.Application(self, dict(self.load_config(self.configurator.items("vnc2"))))
-
-		self.systems = []
-		self.systems.append(self.obc)
-		self.systems.append(self.display)
-		self.systems.append(self.battery)
-		self.systems.append(self.dcdc)
-		self.systems.append(self.audio)
-		self.systems.append(self.usb)
-		self.systems.append(self.lan)
-		self.systems.append(self.wlan)
-		self.systems.append(self.bluetooth)
-		self.systems.append(self.gps)
-		self.systems.append(self.rigctl)
-		self.systems.append(self.rf)
-		self.systems.append(self.indicator)
-
-		self.systems.append(self.publisher)
-		self.systems.append(self.clock)
-		self.systems.append(self.aprs)
-		self.systems.append(self.ais)
-		self.systems.append(self.vdl)
-		self.systems.append(self.acars)
-		self.systems.append(self.ism)
-		self.systems.append(self.rs1)
-		self.systems.append(self.rs2)
-		self.systems.append(self.rtltcp1)
-		self.systems.append(self.rtltcp2)
-		self.systems.append(self.gqrx)
-		self.systems.append(self.proxy)
-		self.systems.append(self.subscriber)
-
-		#self.systems.append(self.gqrx)
-		self.systems.append(self.opencpn)
-		self.systems.append(self.fldigi)
-		self.systems.append(self.keyboard)
-		self.systems.append(self.navigation)
-		self.systems.append(self.gpredict)
-		self.systems.append(self.vnc1)
-		self.systems.append(self.vnc2)
+		#Shared 1-wire reader, polling threads only get cached temperatures
+		self.temperatures = TemperatureService(dict(self.load_config(self.configurator.items("w1"))))
+		self.temperatures.start()
 
-		#Start threads
-		# = [system.start() for system in self.systems if isinstance(system, Thread)]
+		#Attributes the rail energy measured by OBC and Display to the individual subsystems
+		self.energy = EnergyAccountant(dict(self.load_config(self.configurator.items("energy"))), self._energy_activity, self._battery_energy)
+
+		scheduler = StartupScheduler(server_config["i_startup_workers"])
+		for section, system_class, depends in SYSTEM_TABLE:
+			scheduler.add(section, lambda section=section, system_class=system_class: self._construct(section, system_class), depends)
+		scheduler.run()
+
+		self.startup = {"total_time": scheduler.total_time, "systems": scheduler.report}
+		print("Subsystems initialized in {} s".format(scheduler.total_time))
+		for section, entry in sorted(scheduler.report.items(), key=lambda e: e[1]["start"]):
+			print("  {:<12} {:>7} {:>8.3f} s {}".format(section, entry["state"], entry["init_time"], entry["error"]))
 
+		#Failed systems and the ones depending on them stay out of the registry, the rest is served.
+		#They are in the startup report and can be added again with add_system.
+		failures = scheduler.failures()
+		if failures:
+			print("Subsystem initialization failed: {}".format(", ".join("{} ({})".format(k, v["error"]) for k, v in failures.items())))
+
+		self.systems = SystemRegistry()
+		self.system_classes = {}
+		for section, system_class, depends in SYSTEM_TABLE:
+			if section in scheduler.results:
+				self.systems.add(scheduler.results[section])
+			else:
+				self.system_classes[section] = system_class
+
+		#Start threads
 		for system in self.systems:
 			if isinstance(system, Thread):
 				system.start()
-				time.sleep(1)
 
+		#Subsystems without a polling loop open their lazy devices in the background
+		Thread(target=self._activate, name="activate", daemon=True).start()
+
+
+	def _construct(self, section, system_class):
+		system = system_class(self, dict(self.load_config(self.configurator.items(section))))
+		setattr(self, section, system)
+		return system
+
+	def _activate(self):
+		for system in self.systems:
+			if not isinstance(system, Thread) and hasattr(system, "activate"):
+				system.activate()
+
+	def get_startup(self):
+		return {"success": True, "startup": self.startup}
+
+	def _energy_activity(self):
+		#Hardware consumers on the OBC rail from l_consumers: a process is active while it runs,
+		#a dongle (<s_id>:<dongle>) while its <dongle>_power status is set
+		activity = {}
+		for consumer in self.energy.config["l_consumers"]:
+			id, _, dongle = consumer.partition(':')
+			system = self.systems.get(id)
+			if system is None:
+				continue
+			if dongle:
+				activity[consumer] = int(bool(system.status.get("{}_power".format(dongle), 0)))
+			else:
+				activity[consumer] = int(bool(system.status.get("running", 0)))
+		return activity
+
+	def _battery_energy(self):
+		battery = self.systems.get("battery")
+		if battery is None:
+			return 0.0
+		return (float(battery.status["level"])/100.0)*battery.config["i_capacity_wh"]
+
+	def get_energy(self):
+		return {"success": True, "energy": self.energy.get_energy()}
+
+	def get_i2c(self):
+		return self.i2c.get_status()
 
 	def str2bool(self, v):
 	  return v.lower() in ("yes", "true", "t", "1")
@@ -143,36 +261,68 @@ class Server(object):
 
 		return result
 
-	def get_systems(self):
-		return {"success": True, "systems": [s.config["s_id"] for s in self.systems]}
+	def get_systems(self, type=None, capability=None):
+		if type is not None and capability is not None:
+			capable = set(s.config["s_id"] for s in self.systems.with_capability(capability))
+			systems = [s for s in self.systems.of_type(type) if s.config["s_id"] in capable]
+		elif type is not None:
+			systems = self.systems.of_type(type)
+		elif capability is not None:
+			systems = self.systems.with_capability(capability)
+		else:
+			return {"success": True, "systems": self.systems.ids()}
+		return {"success": True, "systems": [s.config["s_id"] for s in systems]}
 
 	def get_status(self):
-		status = []
-		indexes = range(len(self.systems))
-		keys = [s.config["s_id"] for s in self.systems]
-		statuses = [s.status for s in self.systems]
-		for i in indexes:
-			status.append({"id": keys[i], "status": statuses[i]})
-		return {"success": True, "status": status}
+		return {"success": True, "status": [{"id": id, "status": s.status} for id, s in self.systems.items()]}
 
 	def get_config(self):
-		config = []
-		indexes = range(len(self.systems))
-		keys = [s.config["s_id"] for s in self.systems]
-		configs = [s.config for s in self.systems]
-		for i in indexes:
-			config.append({"id": keys[i], "config": configs[i]})
-		return {"success": True, "config": config}
+		return {"success": True, "config": [{"id": id, "config": s.config} for id, s in self.systems.items()]}
 
 	def get_configstatus(self):
-		configstatus = []
-		indexes = range(len(self.systems))
-		keys = [s.config["s_id"] for s in self.systems]
-		configs = [s.config for s in self.systems]
-		statuses = [s.status for s in self.systems]
-		for i in indexes:
-			 configstatus.append({"id": keys[i], "config": configs[i], "status": statuses[i]})
-		return {"success": True, "configstatus": configstatus}
+		return {"success": True, "configstatus": [{"id": id, "config": s.config, "status": s.status} for id, s in self.systems.items()]}
+
+	def add_system(self, id):
+		#(Re)creates a system from its config.ini section. Previously removed systems keep their class,
+		#new sections select one with the s_class key.
+		if id in self.systems:
+			return {"success": False, "message": "System {} already exists".format(id)}
+
+		self.configurator.read(CONFIG_FILE)
+		if not self.configurator.has_section(id):
+			return {"success": False, "message": "No section {} in configuration".format(id)}
+
+		try:
+			config = dict(self.load_config(self.configurator.items(id)))
+			system_class = self.system_classes.get(id, getattr(systems, config.get("s_class", ""), None))
+			if system_class is None:
+				return {"success": False, "message": "No system class for {}".format(id)}
+
+			system = system_class(self, config)
+			self.systems.add(system)
+			setattr(self, id, system)
+			if isinstance(system, Thread):
+				system.start()
+		except Exception as e:
+			return {"success": False, "message": str(e)}
+
+		return {"success": True, "systems": self.systems.ids()}
+
+	def remove_system(self, id):
+		system = self.systems.remove(id)
+		if system is None:
+			return {"success": False, "message": "System with provided ID not found"}
+
+		self.system_classes[id] = type(system)
+		#Also the attribute set by add_system, so nothing reaches the removed instance through the server
+		if vars(self).get(id) is system:
+			delattr(self, id)
+		if isinstance(system, Thread):
+			system._shutdown_thread()
+		elif system.status.get("running") and hasattr(system, "stop_process"):
+			system.stop_process()
+
+		return {"success": True, "systems": self.systems.ids()}
 
 	def save_config(self):
 		current_config = self.get_config()["config"]
@@ -183,6 +333,9 @@ class Server(object):
 
 	def stop_threads(self):
 		status = [system._shutdown_thread() for system in self.systems if isinstance(system, Thread)]
+		self.temperatures.stop()
+		self.i2c.stop()
+		self.database.close()
 
 	def shutdown(self):
 		self.stop_threads()
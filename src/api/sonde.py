@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+import datetime
+from threading import Lock
+
+import numpy as np
+
+COLUMNS = ("t", "lat", "lon", "alt", "vel_h", "heading", "vel_v")
+T, LAT, LON, ALT, VEL_H, HEADING, VEL_V = range(len(COLUMNS))
+
+METERS_PER_DEGREE = 111320.0
+#Density scale height of the standard atmosphere, a parachute falls faster in thin air
+SCALE_HEIGHT = 7238.3
+
+
+def _utc(t):
+	return datetime.datetime.utcfromtimestamp(t).isoformat(timespec='milliseconds') + 'Z'
+
+def wind_profile(alt, vel_h, heading, layer):
+	"""
+	Mean wind (east, north in m/s) per altitude layer of layer meters, from the horizontal
+	velocity of the sonde. Returns layer centers and both components, sorted by altitude.
+	"""
+
+	direction = np.radians(heading)
+	u = vel_h * np.sin(direction)
+	v = vel_h * np.cos(direction)
+	layers, inverse = np.unique(np.floor(alt / layer).astype(int), return_inverse=True)
+	count = np.bincount(inverse)
+	return (layers + 0.5) * layer, np.bincount(inverse, u) / count, np.bincount(inverse, v) / count
+
+def descent_speed(alt, sea_level_rate):
+	return sea_level_rate * np.exp(alt / (2 * SCALE_HEIGHT))
+
+def predict(lat, lon, alt, profile, ascent_rate, burst_altitude, sea_level_rate, ground, step):
+	"""
+	Landing point by integrating the wind profile over the remaining flight, in steps of
+	step meters. While ascent_rate is given the sonde first climbs to burst_altitude.
+	Winds outside the observed layers are taken from the nearest layer.
+	Returns (lat, lon, seconds to landing, burst (lat, lon, seconds) or None).
+	"""
+
+	centers, u, v = profile
+	top = max(alt, burst_altitude) if ascent_rate else alt
+
+	up = np.arange(alt, top, step) if ascent_rate else np.empty(0)
+	down = np.arange(top, ground, -step) if top > ground else np.empty(0)
+	dt = np.concatenate((np.full(len(up), step / ascent_rate) if ascent_rate else up, step / descent_speed(down, sea_level_rate)))
+	h = np.concatenate((up, down))
+
+	east = np.cumsum(np.interp(h, centers, u) * dt)
+	north = np.cumsum(np.interp(h, centers, v) * dt)
+	seconds = np.cumsum(dt)
+
+	def position(i):
+		if i < 0:
+			return lat, lon, 0.0
+		return (lat + north[i] / METERS_PER_DEGREE,
+				lon + east[i] / (METERS_PER_DEGREE * np.cos(np.radians(lat))),
+				float(seconds[i]))
+
+	burst = position(len(up) - 1) if ascent_rate else None
+	landing = position(len(h) - 1)
+	return landing[0], landing[1], landing[2], burst
+
+
+class SondeTrack(object):
+
+	"""
+	Frames of one sonde in a columnar NumPy buffer that doubles when full. At capacity
+	every other frame is dropped, so a long flight keeps its full extent at lower resolution.
+	"""
+
+	def __init__(self, id, type, capacity):
+		self.id = id
+		self.type = type
+		self.capacity = capacity
+		self.data = np.empty((64, len(COLUMNS)))
+		self.n = 0
+
+		self.frame = 0
+		self.sats = 0
+		self.phase = None
+		self.rate = 0.0
+		self.max_index = 0
+		self.burst = None
+		self.prediction = None
+		self.forwarded = 0.0
+
+	def append(self, row):
+		if self.n == len(self.data):
+			if len(self.data) >= self.capacity:
+				kept = self.data[:self.n:2].copy()
+				self.n = len(kept)
+				self.data[:self.n] = kept
+				self.max_index = int(np.argmax(kept[:, ALT]))
+			else:
+				data = np.empty((min(2 * len(self.data), self.capacity), len(COLUMNS)))
+				data[:self.n] = self.data[:self.n]
+				self.data = data
+		self.data[self.n] = row
+		if row[ALT] >= self.data[self.max_index, ALT]:
+			self.max_index = self.n
+		self.n += 1
+
+	def rows(self):
+		return self.data[:self.n]
+
+	def vertical_rate(self, window):
+		#Least squares slope of altitude over the last window seconds, smoother than vel_v
+		rows = self.rows()
+		recent = rows[rows[:, T] >= rows[-1, T] - window]
+		if len(recent) < 3 or recent[-1, T] - recent[0, T] <= 0:
+			return float(rows[-1, VEL_V])
+		return float(np.polyfit(recent[:, T] - recent[0, T], recent[:, ALT], 1)[0])
+
+
+class SondeTracker(object):
+
+	"""
+	Tracks every radiosonde by id. Every frame updates the vertical rate and the flight
+	phase (ascent, descent after burst, landed), and the landing point is predicted from
+	the wind profile measured during the ascent.
+
+	Burst is detected when the sonde descends f_sonde_burst_drop meters below its maximum
+	altitude. Until then the prediction assumes a burst at f_sonde_burst_altitude. The
+	descent rate is calibrated on the observed rate once descending, before that it is
+	f_sonde_descent_rate at sea level.
+	"""
+
+	def __init__(self, config):
+		self.config = config
+		self.lock = Lock()
+		self.tracks = {}
+
+	def add(self, id, type, frame, t, lat, lon, alt, vel_h, heading, vel_v, sats):
+		"""
+		Add one frame. Returns a copy of the summary when the landing prediction is due
+		for a Xastir update (every f_sonde_predict_interval seconds), None otherwise.
+		"""
+
+		with self.lock:
+			self._expire(t)
+			track = self.tracks.get(id)
+			if track is None:
+				track = self.tracks[id] = SondeTrack(id, type, self.config["i_sonde_capacity"])
+
+			track.append((t, lat, lon, alt, vel_h, heading, vel_v))
+			track.frame = frame
+			track.sats = sats
+			self._update(track)
+
+			if track.prediction is None or t - track.forwarded < self.config["f_sonde_predict_interval"]:
+				return None
+			track.forwarded = t
+			return self._summary(track)
+
+	def _expire(self, now):
+		for id in [id for id, track in self.tracks.items() if now - track.rows()[-1, T] > self.config["f_sonde_timeout"]]:
+			del self.tracks[id]
+
+	def _update(self, track):
+		rows = track.rows()
+		last = rows[-1]
+		rate = track.vertical_rate(self.config["f_sonde_rate_window"])
+		ground = self.config["f_sonde_ground_altitude"]
+
+		if track.phase is None:
+			track.phase = "ascent" if rate >= 0 else "descent"
+		if track.phase == "ascent" and rate < 0 and rows[track.max_index, ALT] - last[ALT] > self.config["f_sonde_burst_drop"]:
+			track.phase = "descent"
+			peak = rows[track.max_index]
+			track.burst = {"lat": float(peak[LAT]), "lon": float(peak[LON]), "alt": float(peak[ALT]), "time_utc": _utc(peak[T])}
+		if track.phase == "descent" and abs(rate) < 1.0 and last[ALT] - ground < 1000.0:
+			track.phase = "landed"
+		track.rate = rate
+
+		if track.phase == "landed":
+			track.prediction = {"lat": float(last[LAT]), "lon": float(last[LON]), "time_utc": _utc(last[T]), "seconds": 0.0, "burst": None}
+			return
+
+		#Wind from the ascent, or from the descent when the sonde was first heard after burst
+		winds = rows[:track.max_index + 1] if track.burst is not None else rows
+		profile = wind_profile(winds[:, ALT], winds[:, VEL_H], winds[:, HEADING], self.config["f_sonde_layer"])
+
+		if track.phase == "ascent":
+			ascent_rate = rate if rate > 1.0 else self.config["f_sonde_ascent_rate"]
+			sea_level_rate = self.config["f_sonde_descent_rate"]
+		else:
+			ascent_rate = None
+			sea_level_rate = -rate / np.exp(last[ALT] / (2 * SCALE_HEIGHT)) if rate < -1.0 else self.config["f_sonde_descent_rate"]
+
+		lat, lon, seconds, burst = predict(	last[LAT], last[LON], last[ALT], profile, ascent_rate, self.config["f_sonde_burst_altitude"], \
+											sea_level_rate, ground, self.config["f_sonde_step"])
+		track.prediction = {"lat": round(float(lat), 6), "lon": round(float(lon), 6), "time_utc": _utc(last[T] + seconds), "seconds": round(seconds, 1), "burst": None}
+		if burst is not None:
+			track.prediction["burst"] = {"lat": round(float(burst[0]), 6), "lon": round(float(burst[1]), 6), "alt": self.config["f_sonde_burst_altitude"], "time_utc": _utc(last[T] + burst[2])}
+
+	def _summary(self, track):
+		last = track.rows()[-1]
+		return 	{
+					"id" : track.id,
+					"type" : track.type,
+					"frame" : track.frame,
+					"datetime" : _utc(last[T]),
+					"lat" : float(last[LAT]),
+					"lon" : float(last[LON]),
+					"alt" : float(last[ALT]),
+					"heading" : float(last[HEADING]),
+					"vel_h" : float(last[VEL_H]),
+					"vel_v" : float(last[VEL_V]),
+					"sats" : track.sats,
+					"phase" : track.phase,
+					"vertical_rate" : round(track.rate, 2),
+					"max_alt" : float(track.rows()[track.max_index, ALT]),
+					"frames" : track.n,
+					"burst" : track.burst,
+					"prediction" : track.prediction
+				}
+
+	def get_sondes(self):
+		with self.lock:
+			self._expire(time.time())
+			return [self._summary(track) for track in self.tracks.values()]
+
+	def get_sonde(self, id):
+		with self.lock:
+			track = self.tracks.get(id)
+			if track is None:
+				return None
+			summary = self._summary(track)
+			rows = track.rows()
+			summary["track"] = {column: np.round(rows[:, i], 6).tolist() for i, column in enumerate(COLUMNS)}
+			return summary
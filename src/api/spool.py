@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import os
+import mmap
+import struct
+from collections import deque
+from threading import Lock
+
+
+class Segment(object):
+
+	"""
+	Fixed size, memory-mapped, append-only spool file.
+	Layout: header (magic, write offset, read offset) followed by records of
+	(payload length, point count, payload).
+	"""
+
+	MAGIC = b'CDSP'
+	HEADER = struct.Struct('<4sII')
+	RECORD = struct.Struct('<II')
+
+	def __init__(self, filename, size=None):
+		self.filename = filename
+
+		if size is not None:
+			with open(self.filename, 'wb') as f:
+				f.truncate(size)
+
+		self.file = open(self.filename, 'r+b')
+		self.mm = mmap.mmap(self.file.fileno(), 0)
+
+		if size is not None:
+			self.write_off = self.HEADER.size
+			self.read_off = self.HEADER.size
+			self._sync_header()
+		else:
+			magic, self.write_off, self.read_off = self.HEADER.unpack_from(self.mm, 0)
+			if magic != self.MAGIC:
+				self.close()
+				raise ValueError('Invalid spool segment {}'.format(self.filename))
+
+		self.points = 0
+		offset = self.read_off
+		while offset < self.write_off:
+			length, count = self.RECORD.unpack_from(self.mm, offset)
+			self.points += count
+			offset += self.RECORD.size + length
+
+	def _sync_header(self):
+		self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.write_off, self.read_off)
+
+	@property
+	def size(self):
+		return len(self.mm)
+
+	@property
+	def empty(self):
+		return self.read_off >= self.write_off
+
+	def append(self, payload, count):
+		if self.write_off + self.RECORD.size + len(payload) > len(self.mm):
+			return False
+
+		self.RECORD.pack_into(self.mm, self.write_off, len(payload), count)
+		start = self.write_off + self.RECORD.size
+		self.mm[start:start + len(payload)] = payload
+		self.write_off = start + len(payload)
+		self._sync_header()
+		self.mm.flush()
+		self.points += count
+		return True
+
+	def peek(self):
+		if self.empty:
+			return None, 0
+		length, count = self.RECORD.unpack_from(self.mm, self.read_off)
+		start = self.read_off + self.RECORD.size
+		return bytes(self.mm[start:start + length]), count
+
+	def consume(self):
+		length, count = self.RECORD.unpack_from(self.mm, self.read_off)
+		self.read_off += self.RECORD.size + length
+		self._sync_header()
+		self.points -= count
+
+	def close(self):
+		self.mm.close()
+		self.file.close()
+
+	def remove(self):
+		self.close()
+		os.remove(self.filename)
+
+
+class Spool(object):
+
+	"""
+	Durable store for line protocol batches that could not be written to the
+	database. Batches are appended to memory-mapped segment files and replayed
+	oldest first. The total size on disk is capped at max_size bytes; when full,
+	the "oldest" eviction policy deletes the oldest segments to make room, any
+	other policy rejects the new batch instead.
+	"""
+
+	def __init__(self, path, segment_size, max_size, eviction="oldest"):
+		self.path = path
+		self.segment_size = segment_size
+		self.max_size = max_size
+		self.eviction = eviction
+
+		self.lock = Lock()
+		self.segments = deque()
+		self.evicted = 0
+		self.rejected = 0
+
+		os.makedirs(self.path, exist_ok=True)
+
+		for filename in sorted(f for f in os.listdir(self.path) if f.endswith('.seg')):
+			try:
+				segment = Segment(os.path.join(self.path, filename))
+			except Exception as e:
+				print("Discarding spool segment {}: {}".format(filename, e))
+				os.remove(os.path.join(self.path, filename))
+				continue
+
+			if segment.empty:
+				segment.remove()
+			else:
+				self.segments.append(segment)
+
+		self.sequence = 0
+		if self.segments:
+			self.sequence = int(os.path.basename(self.segments[-1].filename).split('.')[0]) + 1
+
+	@property
+	def points(self):
+		return sum(s.points for s in self.segments)
+
+	@property
+	def size(self):
+		return sum(s.size for s in self.segments)
+
+	def _new_segment(self, size):
+		#A fully replayed tail segment is never removed by consume(), drop it here
+		if self.segments and self.segments[-1].empty:
+			self.segments.pop().remove()
+
+		while self.segments and self.size + size > self.max_size:
+			if self.eviction != "oldest":
+				return None
+			oldest = self.segments.popleft()
+			self.evicted += oldest.points
+			oldest.remove()
+
+		if size > self.max_size:
+			return None
+
+		segment = Segment(os.path.join(self.path, '{:010d}.seg'.format(self.sequence)), size)
+		self.sequence += 1
+		self.segments.append(segment)
+		return segment
+
+	def append(self, lines):
+		payload = '\n'.join(lines).encode('utf-8')
+		with self.lock:
+			if self.segments and self.segments[-1].append(payload, len(lines)):
+				return True
+
+			size = max(self.segment_size, Segment.HEADER.size + Segment.RECORD.size + len(payload))
+			segment = self._new_segment(size)
+			if segment is None:
+				self.rejected += len(lines)
+				return False
+			return segment.append(payload, len(lines))
+
+	def peek(self):
+		"""Return the oldest spooled batch as a line protocol string and its point count."""
+		with self.lock:
+			if not self.segments:
+				return None, 0
+			payload, count = self.segments[0].peek()
+			if payload is None:
+				return None, 0
+			return payload.decode('utf-8'), count
+
+	def consume(self):
+		with self.lock:
+			segment = self.segments[0]
+			segment.consume()
+			if segment.empty and len(self.segments) > 1:
+				self.segments.popleft().remove()
+
+	def close(self):
+		with self.lock:
+			for segment in self.segments:
+				segment.close()
+			self.segments.clear()
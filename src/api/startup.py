@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class StartupScheduler(object):
+
+	"""
+	Runs subsystem constructors on a thread pool. A task is started as soon as all
+	the tasks it depends on have finished, independent tasks run in parallel.
+	When a task fails, everything that depends on it is skipped.
+	The report records per task when it started, how long it took and its outcome.
+	"""
+
+	def __init__(self, workers):
+		self.workers = workers
+		self.tasks = {}
+		self.report = {}
+		self.results = {}
+		self.total_time = 0.0
+
+	def add(self, name, factory, depends=()):
+		if name in self.tasks:
+			raise ValueError('Startup task {} defined twice'.format(name))
+		self.tasks[name] = (factory, list(depends))
+
+	def _check(self):
+		for name, (factory, depends) in self.tasks.items():
+			for dependency in depends:
+				if dependency not in self.tasks:
+					raise ValueError('Startup task {} depends on unknown task {}'.format(name, dependency))
+
+		#Kahn's algorithm, anything left over is part of a cycle
+		remaining = {name: set(depends) for name, (factory, depends) in self.tasks.items()}
+		while remaining:
+			ready = [name for name, depends in remaining.items() if not depends]
+			if not ready:
+				raise ValueError('Startup dependency cycle between {}'.format(', '.join(sorted(remaining))))
+			for name in ready:
+				del remaining[name]
+			for depends in remaining.values():
+				depends.difference_update(ready)
+
+	def _execute(self, name, t0):
+		factory, depends = self.tasks[name]
+		start = time.monotonic()
+		self.report[name] = {"start": round(start - t0, 3), "init_time": 0.0, "state": "running", "error": ""}
+		result = factory()
+		self.report[name]["init_time"] = round(time.monotonic() - start, 3)
+		return result
+
+	def _skip(self, name, dependents, reason):
+		for dependent in dependents[name]:
+			if dependent not in self.report:
+				self.report[dependent] = {"start": 0.0, "init_time": 0.0, "state": "skipped", "error": reason}
+				self._skip(dependent, dependents, reason)
+
+	def run(self):
+		self._check()
+
+		dependents = {name: [] for name in self.tasks}
+		waiting = {}
+		for name, (factory, depends) in self.tasks.items():
+			waiting[name] = set(depends)
+			for dependency in depends:
+				dependents[dependency].append(name)
+
+		t0 = time.monotonic()
+		with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="startup") as pool:
+			futures = {pool.submit(self._execute, name, t0): name for name in self.tasks if not waiting[name]}
+
+			while futures:
+				done, pending = wait(futures, return_when=FIRST_COMPLETED)
+				for future in done:
+					name = futures.pop(future)
+					error = future.exception()
+
+					if error is not None:
+						self.report[name]["state"] = "failed"
+						self.report[name]["error"] = str(error)
+						self.report[name]["init_time"] = round(time.monotonic() - t0 - self.report[name]["start"], 3)
+						self._skip(name, dependents, "dependency {} failed".format(name))
+						continue
+
+					self.results[name] = future.result()
+					self.report[name]["state"] = "ready"
+					for dependent in dependents[name]:
+						waiting[dependent].discard(name)
+						if not waiting[dependent] and dependent not in self.report:
+							futures[pool.submit(self._execute, dependent, t0)] = dependent
+
+		self.total_time = round(time.monotonic() - t0, 3)
+		return self.results
+
+	def failures(self):
+		return {name: entry for name, entry in self.report.items() if entry["state"] != "ready"}
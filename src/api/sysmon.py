@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import os
+import glob
+
+THERMAL_ZONES = '/sys/class/thermal/thermal_zone*/temp'
+CPU_FREQ = '/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq'
+THROTTLED = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+LOADAVG = '/proc/loadavg'
+STAT = '/proc/stat'
+
+#get_throttled bits that are active right now, the same bits << 16 latch since boot
+UNDER_VOLTAGE = 0x1
+FREQ_CAPPED = 0x2
+THROTTLING = 0x4
+TEMP_LIMIT = 0x8
+
+
+def core_times(stat):
+	#(idle, total) jiffies per 'cpu' line of /proc/stat, aggregate first
+	times = []
+	for line in stat.splitlines():
+		if not line.startswith('cpu'):
+			break
+		fields = [int(v) for v in line.split()[1:9]]
+		times.append((fields[3] + fields[4], sum(fields)))
+	return times
+
+def utilization(previous, current):
+	result = []
+	for (idle0, total0), (idle1, total1) in zip(previous, current):
+		elapsed = total1 - total0
+		result.append(round(100.0 * (1.0 - (idle1 - idle0) / elapsed), 1) if elapsed > 0 else 0.0)
+	return result
+
+
+class SysfsSampler(object):
+
+	"""
+	Samples CPU temperature, frequency, firmware throttling flags, load average and
+	per-core utilization. All files are opened once and re-read with pread at offset
+	0, so a sample costs a handful of syscalls and never forks. Files that do not
+	exist on this kernel are skipped and their fields are left out.
+	"""
+
+	def __init__(self):
+		self.thermal = [self._open(path) for path in sorted(glob.glob(THERMAL_ZONES))]
+		self.thermal = [fd for fd in self.thermal if fd is not None]
+		self.freq = self._open(CPU_FREQ)
+		self.throttled = self._open(THROTTLED)
+		self.loadavg = self._open(LOADAVG)
+		self.stat = self._open(STAT)
+		self.previous = core_times(self._read(self.stat)) if self.stat is not None else []
+
+	def _open(self, path):
+		try:
+			return os.open(path, os.O_RDONLY)
+		except OSError:
+			return None
+
+	def _read(self, fd):
+		return os.pread(fd, 8192, 0).decode('ascii')
+
+	def sample(self):
+		sample = {}
+
+		temps = []
+		for fd in self.thermal:
+			try:
+				temps.append(int(self._read(fd)) / 1000.0)
+			except (OSError, ValueError):
+				pass
+		if temps:
+			sample["temp1"] = max(temps)
+
+		if self.freq is not None:
+			sample["cpu_freq"] = int(self._read(self.freq)) // 1000
+
+		if self.throttled is not None:
+			flags = int(self._read(self.throttled), 16)
+			sample["throttled"] = flags
+			sample["under_voltage"] = int(bool(flags & UNDER_VOLTAGE))
+			sample["freq_capped"] = int(bool(flags & FREQ_CAPPED))
+			sample["throttling"] = int(bool(flags & THROTTLING))
+			sample["temp_limit"] = int(bool(flags & TEMP_LIMIT))
+
+		if self.loadavg is not None:
+			load = self._read(self.loadavg).split()
+			sample["load1"], sample["load5"], sample["load15"] = float(load[0]), float(load[1]), float(load[2])
+
+		if self.stat is not None:
+			current = core_times(self._read(self.stat))
+			util = utilization(self.previous, current)
+			self.previous = current
+			if util:
+				sample["cpu_util"] = util[0]
+				for core, value in enumerate(util[1:]):
+					sample["cpu{}_util".format(core)] = value
+
+		return sample
+
+	def close(self):
+		for fd in self.thermal + [self.freq, self.throttled, self.loadavg, self.stat]:
+			if fd is not None:
+				os.close(fd)
+		self.thermal = []
+		self.freq = self.throttled = self.loadavg = self.stat = None
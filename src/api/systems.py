@@ -4,43 +4,48 @@
 __author__ = 'Tom Mladenov'
 
 import json
+import copy
+import math
 import time
-import alsaaudio
 import subprocess
 import os
 import telnetlib
 import socket
-import gpsd
-import mgrs
 import zmq
 import sys
-from threading import Thread
+from threading import Thread, Lock, Event
 import logging
 import re
 from enum import Enum
-import pickle
 import datetime
 from configparser import ConfigParser
 import multiprocessing
-import pyais
+import functools
 from influxdb import InfluxDBClient
+from dbwriter import BatchWriter
+from battery import BatteryEstimator
+from powermon import PowerSampler
+import track
+import geodesy
+import pipeline
+import decoders
+import xastir
+import i2cbus
+import hal
 
-from adafruit_ina219 import ADCResolution, BusVoltageRange, INA219, Mode, Gain
-import board
-import RPi.GPIO as GPIO
-from rpi_backlight import Backlight
 import netifaces
-import Adafruit_ADS1x15
-from rtlsdr import RtlSdr
-from aprspy import APRS, PositionPacket, GenericPacket
-from aprspy.packets.position import CompressionFix, CompressionSource, CompressionOrigin
+from aprspy import APRS, GenericPacket
 from packet import Packet
+import codec
 
 
 class Process():
 
 	#This class should be used for any programs that require a data source from a device as an input (either RF or audio, or another device)
 
+	#Name of the decoders.DECODERS entry the Subscriber runs on packets tagged with this s_id, None when not forwarded
+	DECODER = None
+
 	def __init__(self, parent, config):
 		self.parent = parent
 		self.config = config
@@ -66,8 +71,7 @@ class Process():
 			if self.parent.rf.status["{}_power".format(device)]:
 				try:
 					index = self.parent.rf.status["{}_index".format(device)]
-					sdr = RtlSdr(index)
-					sdr.close()
+					hal.rtlsdr_probe(index)
 
 					if not self.status["running"]:
 						return self._run_executable()
@@ -331,6 +335,17 @@ class Proxy(Application, Thread):
 
 class Subscriber(Application, Thread):
 
+	"""
+	Receives decoded packets from the proxy and forwards them, as a staged pipeline:
+	the receive thread only takes packets off the socket and hands them to the decode
+	stage of their tag, decode stages (one thread per decoder) turn them into records,
+	and the xastir and database sink stages consume the records.
+	The xastir sink drops duplicates and holds back too frequent updates of a station,
+	see xastir.XastirSink.
+	All stages are connected by bounded queues of i_queue_size and report throughput,
+	backlog and drops in the status.
+	"""
+
 	def __init__(self, parent, config):
 		Thread.__init__(self)
 		self.parent = parent
@@ -340,12 +355,41 @@ class Subscriber(Application, Thread):
 
 		self.xastir_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+		#Last position of every decoded contact, keyed on (tag, source)
+		self.contacts = {}
+		self.contacts_lock = Lock()
+
 		self.context = zmq.Context()
 		self.socket = self.context.socket(zmq.SUB)
+		self.socket.setsockopt(zmq.RCVHWM, self.config["i_receive_hwm"])
 		host = 'tcp://127.0.0.1:{}'.format(self.parent.proxy.config["i_pubx_port"])
 		self.socket.connect(host)
-		self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
-		self.socket.setsockopt(zmq.RCVTIMEO, 5000)
+		self.socket.setsockopt_string(zmq.SUBSCRIBE, codec.PACKET_TOPIC)
+		self.socket.setsockopt(zmq.RCVTIMEO, 1000)
+
+		size = self.config["i_queue_size"]
+		batch = self.config["i_batch"]
+		call = self.parent.navigation.config["s_xastir_call"]
+
+		self.sink = xastir.XastirSink(self.config)
+		self.xastir = pipeline.Stage("xastir", self._forward, size, batch=batch, flush=self._send)
+		self.store = pipeline.Stage("database", self._store, size, batch=batch, flush=self._dump)
+		self.decoders = {}
+		self.engines = {}
+		for name, decoder in decoders.DECODERS.items():
+			if isinstance(decoder, type):
+				#Stateful decoder, one instance used from its stage thread
+				decoder = self.engines[name] = decoder(self.config)
+			self.decoders[name] = pipeline.Stage("decode_{}".format(name), functools.partial(decoder, call=call), size, [self.xastir, self.store], batch)
+		self.stages = list(self.decoders.values()) + [self.xastir, self.store]
+		#packet tag -> decode stage
+		self.routes = {}
+
+		self.receive = {"received": 0, "unhandled": 0, "errors": 0, "rate": 0.0}
+		self.receive_count = 0
+		self.receive_start = time.monotonic()
+		self.dump_lock = Lock()
+		self.last_dump = 0.0
 
 		self._init_status()
 
@@ -353,115 +397,155 @@ class Subscriber(Application, Thread):
 	def _init_status(self):
 
 		self.status = 	{
-							"running" : 0
+							"running" : 0,
+							"received" : 0
 						}
+		for stage in self.stages:
+			self.status["{}_rate".format(stage.name)] = 0.0
+			self.status["{}_backlog".format(stage.name)] = 0
+			self.status["{}_dropped".format(stage.name)] = 0
+			self.status["{}_errors".format(stage.name)] = 0
+		self.status["xastir_forwarded"] = 0
+		self.status["xastir_suppressed"] = 0
 
 		if self.config["b_autostart"]:
 			self.start_process()
 
-	def send_to_xastir(self, source, latitude, longitude, altitude, course, symbol_table, symbol_id, path):
-
-		aprs_packet = PositionPacket(	compressed = True, source=source, destination=self.parent.navigation.config["s_xastir_call"], \
-										compression_fix = CompressionFix.CURRENT, compression_source = CompressionSource.GLL, compression_origin = CompressionOrigin.COMPRESSED, \
-										latitude=latitude, longitude=longitude, altitude=int(altitude*3.28084), course=int(course), \
-										ambiguity=0, symbol_table=symbol_table, symbol_id=symbol_id, path=path)
-
-		self.send_UDP_xastir(aprs_packet.generate())
-
-
 	def send_UDP_xastir(self, aprs_string):
 		xastir_string = '{CALL},{PASSCODE}\n{MESSAGE}\n'.format(CALL=self.parent.navigation.config["s_xastir_call"], PASSCODE=self.parent.navigation.config["i_xastir_passcode"], MESSAGE=aprs_string)
 		self.xastir_socket.sendto(xastir_string.encode('utf-8'), (self.parent.navigation.config["s_xastir_ip"], self.parent.navigation.config["i_xastir_port"]))
 
+	def add_contact(self, tag, source, latitude, longitude, altitude, course, utc):
+		with self.contacts_lock:
+			self.contacts[(tag, str(source))] = {	"tag" : tag,
+													"source" : str(source),
+													"lat" : float(latitude),
+													"lon" : float(longitude),
+													"alt" : float(altitude),
+													"course" : float(course),
+													"time_utc" : utc.isoformat() + 'Z',
+													"received" : time.time()}
+
+	def get_contacts(self):
+		#Range and bearing are relative to the current GPS fix, all contacts are annotated in one pass
+		origin = None
+		gps = getattr(self.parent, "gps", None)
+		if gps is not None and gps.status["mode"] >= 2:
+			origin = (gps.status["lat"], gps.status["lon"])
+
+		now = time.time()
+		with self.contacts_lock:
+			for key in [key for key, contact in self.contacts.items() if now - contact["received"] > self.config["f_contact_timeout"]]:
+				del self.contacts[key]
+			contacts = [dict(contact) for contact in self.contacts.values()]
+
+		geodesy.annotate(contacts, origin, gps.config["i_grid_length"] if gps is not None else 6)
+		return {"success": True, "origin": origin, "contacts": contacts}
+
+	def get_pipeline(self):
+		stages = {"receive": dict(self.receive)}
+		for stage in self.stages:
+			stages[stage.name] = stage.get_stats()
+		return {"success": True, "stages": stages, "xastir": self.sink.get_stats()}
+
+	def get_sondes(self):
+		#Radiosondes with flight phase, burst and predicted landing point
+		return {"success": True, "sondes": self.engines["radiosonde"].tracker.get_sondes()}
+
+	def get_sonde(self, id):
+		#Same as get_sondes for one sonde, with its track as columns
+		sonde = self.engines["radiosonde"].tracker.get_sonde(id)
+		if sonde is None:
+			return {"success": False, "message": "No sonde with id {}".format(id)}
+		return {"success": True, "sonde": sonde}
+
+	def get_vessels(self):
+		#Live AIS vessels with merged static and dynamic data
+		vessels = self.engines["ais"].engine.get_vessels()
+		vessels["success"] = True
+		return vessels
+
 	def updatePacketCount(self, tag):
 		id = "{s_id}_packets".format(s_id=tag)
 		if id not in self.status:
 			  self.status[id] = 0
 		self.status[id] += 1
 
+	def _forward(self, record):
+		#xastir sink, updates are queued and sent by _send
+		self.sink.offer(record)
+
+	def _send(self):
+		#After every batch and while idle, the updates that passed the sink
+		for aprs in self.sink.flush():
+			self.send_UDP_xastir(aprs)
+
+	def _store(self, record):
+		#database sink, the status is written once per batch by _dump
+		if record["lat"] is not None:
+			self.add_contact(record["tag"], record["source"], record["lat"], record["lon"], record["alt"], record["course"], record["utc"])
+
+	def _dump(self):
+		#At most once per f_dump_period, called by the database sink and the receive thread
+		with self.dump_lock:
+			now = time.monotonic()
+			if now - self.last_dump < self.config["f_dump_period"]:
+				return
+			self.last_dump = now
+
+			self.receive["rate"] = round(self.receive_count / (now - self.receive_start), 1)
+			self.receive_count = 0
+			self.receive_start = now
+			self.status["received"] = self.receive["received"]
+			for stage in self.stages:
+				stats = stage.get_stats()
+				self.status["{}_rate".format(stage.name)] = stats["rate"]
+				self.status["{}_backlog".format(stage.name)] = stats["backlog"]
+				self.status["{}_dropped".format(stage.name)] = stats["dropped"]
+				self.status["{}_errors".format(stage.name)] = stats["errors"]
+			stats = self.sink.get_stats()
+			self.status["xastir_forwarded"] = stats["forwarded"]
+			self.status["xastir_suppressed"] = stats["suppressed"]
+		self.parent.database.dumpData(id=self.config["s_id"], fields=dict(self.status))
+
+	def _dispatch(self, data):
+		packet = codec.decode_packet(data)
+		self.receive["received"] += 1
+		self.receive_count += 1
+
+		if self.config["b_print_packets"]:
+			print("[{}] Received packet with tag [{}] and payload [{}]".format(packet.utc, packet.tag, packet.payload))
+
+		stage = self.routes.get(packet.tag) or self._route(packet.tag)
+		if stage is None:
+			self.receive["unhandled"] += 1
+			return
+		self.updatePacketCount(packet.tag)
+		stage.put(packet)
+
+	def _route(self, tag):
+		#First packet of a tag, the decode stage is the DECODER of the system with that s_id.
+		#Tags of systems that do not exist yet are not cached, the system may still be added.
+		system = self.parent.systems.get(tag)
+		if system is None:
+			return None
+		self.routes[tag] = self.decoders.get(getattr(system, "DECODER", None))
+		return self.routes[tag]
+
 	def run(self):
+		for stage in self.stages:
+			stage.start()
+
 		while self.alive:
 			while self.status["running"]:
 				try:
-					packet = pickle.loads(self.socket.recv())
-
-					print("[{}] Received packet with tag [{}] and payload [{}]".format(packet.utc, packet.tag, packet.payload))
-
-					if packet.tag == "aprs":
-						self.send_UDP_xastir(aprs_string=packet.payload[6:])
-						self.updatePacketCount(packet.tag)
-
-					elif packet.tag == "rs1" or packet.tag == "rs2":
-
-						if '{' in packet.payload and '}' in packet.payload: #if received line is in json format
-							line_json = json.loads(packet.payload)
-
-							self.send_to_xastir(source=line_json["type"], \
-												latitude=line_json["lat"], \
-												longitude=line_json["lon"], \
-												altitude=line_json["alt"], \
-												course=line_json["heading"], \
-												symbol_table='/', \
-												symbol_id='O', \
-												path='WIDE2-2')
-
-							self.updatePacketCount(packet.tag)
-
-
-					elif packet.tag == "ais":
-
-						#message = "!AIVDM,1,1,,A,15RTgt0PAso;90TKcjM8h6g208CQ,0*4A"
-						message = packet.payload
-						aisMessage = json.loads(pyais.AISMessage(pyais.NMEAMessage.from_string(message)).to_json())
-
-						self.send_to_xastir(source=aisMessage["decoded"]["mmsi"], \
-											latitude=aisMessage["decoded"]["lat"], \
-											longitude=aisMessage["decoded"]["lon"], \
-											altitude=1, \
-											course=aisMessage["decoded"]["heading"], \
-											symbol_table='/', \
-											symbol_id='Y', \
-											path='WIDE2-2')
-
-						self.updatePacketCount(packet.tag)
-
-						"""
-						{
-							"nmea": {
-								"ais_id": 1,
-								"raw": "!AIVDM,1,1,,A,15RTgt0PAso;90TKcjM8h6g208CQ,0*4A",
-								"talker": "AI",
-								"msg_type": "VDM",
-								"count": 1,
-								"index": 1,
-								"seq_id": "",
-								"channel": "A",
-								"data": "15RTgt0PAso;90TKcjM8h6g208CQ",
-								"checksum": 74,
-								"bit_array": "000001000101100010100100101111111100000000100000010001111011110111001011001001000000100100011011101011110010011101001000110000000110101111000010000000001000010011100001"
-							},
-							"decoded": {
-								"type": 1,
-								"repeat": 0,
-								"mmsi": "371798000",
-								"status": 0,
-								"turn": -127,
-								"speed": 12.3,
-								"accuracy": true,
-								"lon": -123.39538333333333,
-								"lat": 48.38163333333333,
-								"course": 224.0,
-								"heading": 215,
-								"second": 33,
-								"maneuver": 0,
-								"raim": false,
-								"radio": 34017
-							}
-						}
-						"""
-					self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
-				except Exception as e:
+					topic, data = self.socket.recv_multipart()
+					self._dispatch(data)
+				except zmq.Again:
 					pass
+				except Exception as e:
+					self.receive["errors"] += 1
+				self._dump()
 
 			time.sleep(1)
 
@@ -482,9 +566,13 @@ class Subscriber(Application, Thread):
 	def _shutdown_thread(self):
 		self.stop_process()
 		self.alive = False
+		for stage in self.stages:
+			stage.stop()
 
 class APRS(Process):
 
+	DECODER = "aprs"
+
 	def _init_status(self):
 
 		self.status = 	{
@@ -522,6 +610,8 @@ class APRS(Process):
 
 class AIS(Process):
 
+	DECODER = "ais"
+
 	def _init_status(self):
 
 		self.status = 	{
@@ -586,6 +676,8 @@ class RTLTCP(Process):
 
 class RS(Process):
 
+	DECODER = "radiosonde"
+
 	def _init_status(self):
 
 		self.status = 	{
@@ -637,6 +729,8 @@ class RS(Process):
 
 class ACARS(Process):
 
+	DECODER = "acars"
+
 	def _init_status(self):
 
 		self.status = 	{
@@ -655,10 +749,12 @@ class ACARS(Process):
 		for f in freqs:
 			freqs_unpacked += str(f) + " "
 
-		command1 = "acarsdec -d {} -p {} -g {} {}".format(index, ppm, gain, freqs_unpacked)
+		command1 = "acarsdec -o 4 -d {} -p {} -g {} {}".format(index, ppm, gain, freqs_unpacked)
+		command2 = "python3 forwarder.py -t {}".format(self.config["s_id"])
 
 		self.commands.append(command1)
-		self.process = subprocess.Popen("{} &".format(command1), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		self.commands.append(command2)
+		self.process = subprocess.Popen("{} | {} &".format(command1, command2), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 		self.status["running"] = 1
 
 		return {"success": True, "status": self.status}
@@ -666,6 +762,8 @@ class ACARS(Process):
 
 class VDL(Process):
 
+	DECODER = "vdl2"
+
 	def _init_status(self):
 
 		self.status = 	{
@@ -686,7 +784,7 @@ class VDL(Process):
 			freqs_unpacked += str(f) + " "
 
 		command1 = "dumpvdl2 --rtlsdr {} --correction {} --gain {} --station-id {} --output decoded:json:file:path=- {}".format(index, ppm, gain, id, freqs_unpacked)
-		command2 = "/home/pi/git/pisdr-cyberdeck/src/scripts/sonde_to_xastir.py"
+		command2 = "python3 forwarder.py -t {}".format(self.config["s_id"])
 
 		self.commands.append(command1)
 		self.commands.append(command2)
@@ -698,6 +796,8 @@ class VDL(Process):
 
 class ISM(Process):
 
+	DECODER = "rtl433"
+
 	def _init_status(self):
 
 		self.status = 	{
@@ -717,12 +817,12 @@ class ISM(Process):
 		samprate = self.config["i_samprate"]
 
 		command1 = "rtl_433 -d {} -p {} -g {} -f {} -s {} -F json -C si".format(index, ppm, gain, freq, samprate)
-		#command2 = "/home/pi/git/pisdr-cyberdeck/src/scripts/sonde_to_xastir.py"
+		command2 = "python3 forwarder.py -t {}".format(self.config["s_id"])
 		#rtl_433 -d 0 -p 0 -f 433920000 -s 1400000 -F json
 
 		self.commands.append(command1)
-		#self.commands.append(command2)
-		self.process = subprocess.Popen("{} &".format(command1), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		self.commands.append(command2)
+		self.process = subprocess.Popen("{} | {} &".format(command1, command2), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 		self.status["running"] = 1
 
 		return {"success": True, "status": self.status}
@@ -804,8 +904,7 @@ class GQRX(Process):
 				if self.parent.rf.status["{}_power".format(device)]:
 					try:
 						index = self.parent.rf.status["{}_index".format(device)]
-						sdr = RtlSdr(index)
-						sdr.close()
+						hal.rtlsdr_probe(index)
 
 						if not self.status["running"]:
 							return self._run_executable()
@@ -842,6 +941,74 @@ class GQRX(Process):
 
 
 
+class DeviceUnavailable(Exception):
+	pass
+
+
+class LazyDevice(object):
+
+	"""
+	Defers opening a hardware device until it is first used. A failed open is kept
+	as the device error and retried at most every retry_interval seconds, so a
+	missing board degrades its subsystem instead of failing Server().
+	"""
+
+	def __init__(self, factory, retry_interval=30.0):
+		self.factory = factory
+		self.retry_interval = retry_interval
+		self.device = None
+		self.error = ""
+		self.last_attempt = None
+		self.lock = Lock()
+
+	@property
+	def available(self):
+		return self.device is not None
+
+	def open(self):
+		with self.lock:
+			if self.device is None:
+				self.last_attempt = time.monotonic()
+				try:
+					self.device = self.factory()
+					self.error = ""
+				except Exception as e:
+					self.error = str(e) or type(e).__name__
+					raise DeviceUnavailable(self.error)
+			return self.device
+
+	def get(self):
+		if self.device is not None:
+			return self.device
+		if self.last_attempt is not None and time.monotonic() - self.last_attempt < self.retry_interval:
+			raise DeviceUnavailable(self.error)
+		return self.open()
+
+	def close(self):
+		with self.lock:
+			if self.device is not None and hasattr(self.device, "close"):
+				self.device.close()
+			self.device = None
+
+
+def activate_devices(status, *devices):
+	#Try to open all devices of a subsystem and reflect failures in its status
+	for device in devices:
+		try:
+			device.get()
+		except DeviceUnavailable:
+			pass
+
+	errors = [device.error for device in devices if device.error]
+	status["degraded"] = int(len(errors) > 0)
+	status["error"] = errors[0] if errors else ""
+
+def device_failed(status, error):
+	#A read or write of an opened device failed, shown like a failed open and retried on the next cycle
+	status["degraded"] = 1
+	status["error"] = str(error) or type(error).__name__
+
+
 class GenericSystem(Thread):
 
 	def __init__(self, parent, config):
@@ -854,11 +1021,24 @@ class GenericSystem(Thread):
 		self.running = True
 
 	def _getTemperatureDS18B20(self, ID):
-		try:
-			output = subprocess.check_output(['cat', '/sys/bus/w1/devices/{TEMP_ID}/temperature'.format(TEMP_ID=ID)])
-			return int(output.decode('utf-8'))/1000.0, True
-		except Exception:
-			return 0.0, False
+		return self.parent.temperatures.read(ID)
+
+	def _read_power(self):
+		#Voltage on V- (load side) and current in A, as one bus transaction
+		ina219 = self.ina219.device
+		return self.parent.i2c.call(self.config["s_id"], lambda: (ina219.bus_voltage, ina219.current/1000.0), i2cbus.PRIORITY_HIGH, key="power")
+
+	def _power_window(self, aggregate):
+		#One aggregate per second from the PowerSampler, the energy budget is built from <id>_power
+		self.status.update(aggregate)
+		self.parent.database.dumpData(id="{}_power".format(self.config["s_id"]), fields=aggregate)
+		self.parent.energy.add_window(self.config["s_id"], aggregate)
+
+	def _poll_power(self):
+		#Low rate reading without a PowerSampler, the energy budget gets it as a window of one polling period
+		self.status["voltage"], self.status["current"] = self._read_power()
+		self.status["consumption"] = self.status["voltage"] * self.status["current"]
+		self.parent.energy.add_window(self.config["s_id"], {"consumption": self.status["consumption"], "energy": self.status["consumption"] * self.config["i_polling_period"]})
 
 	def get_status(self):
 		return {"success": True, "status": self.status}
@@ -950,6 +1130,11 @@ class RigCtl(Application):
 		return self._request('l')
 
 
+def _snapshot(values):
+	#Nested containers are copied too, a shallow copy would share them and hide changes from the delta
+	return {key: copy.deepcopy(value) if isinstance(value, (dict, list)) else value for key, value in values.items()}
+
+
 class Publisher(GenericSystem):
 
 	def __init__(self, parent, config):
@@ -958,22 +1143,105 @@ class Publisher(GenericSystem):
 		self.config = config
 		self.name = self.config["s_id"]		
 
-		self.status = {}
+		self.status = 	{
+							"cycles" : 0,
+							"keyframes" : 0,
+							"messages" : 0,
+							"cycle_bytes" : 0,
+							"errors" : 0
+						}
 
 		self.context = zmq.Context()
 		self.socket = self.context.socket(zmq.PUB)
 		self.host = 'tcp://{}:{}'.format(self.config["s_host"], self.config["i_port"])
 		self.socket.bind(self.host)
 
+		#Every subsystem is published on its own topic (status.<s_id>) with its own sequence number
+		self.sequences = {}
+		self.last_keyframe = 0.0
+		self.resync_requested = False
+		self.snapshot = {}
+		self.wakeup = Event()
+
 		self.running = True
 
+	def notify(self):
+		#Publish the next cycle now instead of at the end of i_period, for event driven changes
+		self.wakeup.set()
+
+	def resync(self):
+		#Called by clients that missed a frame, the next cycle sends full snapshots
+		self.resync_requested = True
+		return {"success": True, "status": self.status}
+
+	def _delta(self, item):
+		previous = self.snapshot.get(item["id"])
+		if previous is None:
+			return {"id": item["id"], "keyframe": True, "config": item["config"], "status": item["status"]}
+
+		frame = {"id": item["id"], "keyframe": False}
+		status = {k: v for k, v in item["status"].items() if k not in previous["status"] or previous["status"][k] != v}
+		if status:
+			frame["status"] = status
+		if item["config"] != previous["config"]:
+			frame["config"] = item["config"]
+
+		if len(frame) > 2:
+			return frame
+		else:
+			return None
+
+	def _publish(self, id, frame):
+		frame["seq"] = self.sequences.get(id, 0)
+		try:
+			to_send = codec.encode_status(frame)
+			self.socket.send_multipart([codec.status_topic(id), to_send])
+		except Exception as e:
+			#The sequence does not advance and the next cycle is a keyframe, so clients do not miss the frame
+			print("Exception when publishing status of {}: {}".format(id, str(e)))
+			self.status["errors"] += 1
+			self.resync_requested = True
+			return 0
+		self.sequences[id] = frame["seq"] + 1
+		return len(to_send)
+
 	def run(self):
 		while self.running:
-			status = self.parent.get_configstatus()
-			to_send = pickle.dumps(status)
+			configstatus = self.parent.get_configstatus()["configstatus"]
+			now = time.monotonic()
+
+			keyframe = not self.config["b_delta_enabled"] or self.resync_requested or now - self.last_keyframe >= self.config["i_keyframe_period"]
+			if keyframe:
+				self.resync_requested = False
+				self.last_keyframe = now
+				self.status["keyframes"] += 1
+
+			sent = 0
+			messages = 0
+			for item in configstatus:
+				if keyframe:
+					frame = {"id": item["id"], "keyframe": True, "config": item["config"], "status": item["status"]}
+				else:
+					frame = self._delta(item)
+					if frame is None:
+						continue
+				sent += self._publish(item["id"], frame)
+				messages += 1
+
+			current = set(item["id"] for item in configstatus)
+			for id in [id for id in self.snapshot if id not in current]:
+				sent += self._publish(id, {"id": id, "keyframe": True, "removed": True})
+				messages += 1
+				self.sequences.pop(id, None)
 
-			self.socket.send(to_send)
-			time.sleep(self.config["i_period"])
+			#Copies, subsystems keep updating their dicts (and lists or dicts in them) in place
+			self.snapshot = {item["id"]: {"config": _snapshot(item["config"]), "status": _snapshot(item["status"])} for item in configstatus}
+
+			self.status["cycles"] += 1
+			self.status["messages"] = messages
+			self.status["cycle_bytes"] = sent
+			self.wakeup.wait(self.config["i_period"])
+			self.wakeup.clear()
 
 
 class Battery(GenericSystem):
@@ -989,76 +1257,74 @@ class Battery(GenericSystem):
 							"level": 0,
 							"temp1": 0.0,
 							"temp2" : 0.0,
-							"t_left" : 0.0
+							"t_left" : 0.0,
+							"trend" : 0.0,
+							"power_avg" : 0.0,
+							"degraded" : 0,
+							"error" : ""
 						}
 
+		self.battadc = LazyDevice(self._open_adc)
+		if not self.parent.lazy_hardware:
+			self.battadc.open()
 
-		self.battadc = Adafruit_ADS1x15.ADS1115(address=int(self.config["s_level_i2c_addr"], 16))
+		self.estimator = BatteryEstimator(	self.config["i_capacity"], self.config["i_capacity_wh"], self.config["f_level_window"], \
+											self.config["f_trend_window"], self.config["f_power_tau"], self.config["f_sample_period"])
 
 		self.running = True
 
+	def _open_adc(self):
+		address = int(self.config["s_level_i2c_addr"], 16)
+		return self.parent.i2c.call(self.config["s_id"], lambda: hal.battery_adc(address))
+
+	def activate(self):
+		activate_devices(self.status, self.battadc)
+
 	def getLevel(self):
-		raw_readings = [0] * 4
-		raw_readings[0] = self.battadc.read_adc(0, gain=1)
-		raw_readings[1] = self.battadc.read_adc(1, gain=1)
-		raw_readings[2] = self.battadc.read_adc(2, gain=1)
-		raw_readings[3] = self.battadc.read_adc(3, gain=1)
+		battadc = self.battadc.get()
+		#All four channels in one bus transaction
+		raw_readings = self.parent.i2c.call(self.config["s_id"], lambda: [battadc.read_adc(channel, gain=1) for channel in range(4)], i2cbus.PRIORITY_LOW, key="level")
 
 		readings = [25 if r >= self.config["i_pd_threshold"] else 0 for r in raw_readings]
 		level = sum(readings)
 
 		return level
 
-	def checkBattState(self):
-
-		#Take 4 readings and use samples to determine battery state
-		levels = []
-		for i in range (1, 5):
-			level = self.getLevel()
-			levels.append(level)
-			time.sleep(1)
-
-		if sum(levels) == 0:
-			self.status["charge_state"] = "IDLE"
-			self.status["level"] = 0
-			self.status["t_left"] = 0.0
-
-		elif all(l == levels[0] for l in levels):
-			self.status["charge_state"] = "DISCHARGING"
-			self.status["level"] = levels[0]
-			total_p = self.parent.obc.status["consumption"] + self.parent.display.status["consumption"]
-			self.status["t_left"] = ((float(self.status["level"])/100.0)*self.config["i_capacity_wh"]) / total_p
-
-		else:
-			self.status["charge_state"] = "CHARGING"
-			self.status["level"] = int((max(levels) + min(levels))/2)
-
-			capacity_left = (1-(float(self.status["level"])/100.0))*self.config["i_capacity"]
-			self.status["t_left"] = float(capacity_left/2000.0) #Charging at 5V 2A
-
-		#print("Battery state is {}".format(self.status["charge_state"]))
-		#print("Battery level is {}".format(self.status["level"]))
-
+	def _sample(self):
+		now = time.monotonic()
+		self.estimator.add_level(now, self.getLevel())
+		self.estimator.add_power(now, self.parent.obc.status["consumption"] + self.parent.display.status["consumption"])
 
 	def run(self):
+		#The ADC is sampled every f_sample_period, the estimate is published every f_publish_period
+		last_publish = 0.0
 		while self.running:
+			start = time.monotonic()
 			try:
+				self.activate()
+				if self.battadc.available:
+					self._sample()
 
-				self.checkBattState()
+				if start - last_publish >= self.config["f_publish_period"]:
+					last_publish = start
+					if self.battadc.available:
+						self.status.update(self.estimator.estimate())
 
-				temp1, valid = self._getTemperatureDS18B20(self.config["s_temp1_sensor"])
-				if valid:
-					self.status["temp1"] = temp1
+					temp1, valid = self._getTemperatureDS18B20(self.config["s_temp1_sensor"])
+					if valid:
+						self.status["temp1"] = temp1
 
-				temp2, valid = self._getTemperatureDS18B20(self.config["s_temp2_sensor"])
-				if valid:
-					self.status["temp2"] = temp2
+					temp2, valid = self._getTemperatureDS18B20(self.config["s_temp2_sensor"])
+					if valid:
+						self.status["temp2"] = temp2
 
-				self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
-				time.sleep(self.config["i_batt_poll_period"])
+					self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
 
 			except Exception as e:
 				print(str(e))
+				device_failed(self.status, e)
+
+			time.sleep(max(0.0, self.config["f_sample_period"] - (time.monotonic() - start)))
 
 
 class DCDC(GenericSystem):
@@ -1069,93 +1335,87 @@ class DCDC(GenericSystem):
 		self.config = config
 		self.name = self.config["s_id"]		
 
-		GPIO.setup(self.config["i_j1a_sense_pin"], GPIO.IN)
-		GPIO.setup(self.config["i_j1b_sense_pin"], GPIO.IN)
-
-
 		self.status = 	{
 								"power" : 0,
-								"temp": 0,
+								"temp": 0.0,
 								"j1a_power" : 0,
-								"j1b_power" : 0
+								"j1b_power" : 0,
+								"changed_utc" : "",
+								"degraded" : 0,
+								"error" : ""
 						}
 
-		self.running = True
-
-	def run(self):
-		while self.running:
-			temp, valid = self._getTemperatureDS18B20(self.config["s_temp_sensor"])
-			if valid:
-				self.status["temp"] = temp
-
-			self.status["j1a_power"] = int(GPIO.input(self.config["i_j1a_sense_pin"]))
-			self.status["j1b_power"] = int(GPIO.input(self.config["i_j1b_sense_pin"]))
-
-			if self.status["j1b_power"]:
-				self.status["power"] = 1
-			else:
-				self.status["power"] = 0
-
-			self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
-			time.sleep(self.config["i_polling_period"])
-			
-
+		#Rail changes are edge triggered, i_polling_period only paces the temperature and a fallback read
+		self.edge = Event()
+		self.edge_time = None
 
-class CustomINA219(INA219):
+		for pin in (self.config["i_j1a_sense_pin"], self.config["i_j1b_sense_pin"]):
+			hal.setup_input(pin)
+			hal.add_edge_callback(pin, self._edge, self.config["i_debounce_ms"])
 
-	"""
-	Custom INA219 calibration due to use of 50mohm shunt resistor (standard is 100mohm)
-	"""
-
-	def set_custom_calibration_16V_3A(self):  # pylint: disable=invalid-name
-
-		# VBUS_MAX = 16V
-		# VSHUNT_MAX = 0.16          (Assumes Gain 3, 160mV)
-		# RSHUNT = 0.05              (Resistor value in ohms)
-
-		# 1. Determine max possible current
-		# MaxPossible_I = VSHUNT_MAX / RSHUNT
-		# MaxPossible_I = 3.2A
-
-		# 2. Determine max expected current
-		# MaxExpected_I = 3.0A
-
-		# 3. Calculate possible range of LSBs (Min = 15-bit, Max = 12-bit)
-		# MinimumLSB = MaxExpected_I/32767
-		# MinimumLSB = 0.000091556              (uA per bit)
-		# MaximumLSB = MaxExpected_I/4096
-		# MaximumLSB = 0.0007324              (uA per bit)
+		self.running = True
 
-		# 4. Choose an LSB between the min and max values
-		#    (Preferrably a roundish number close to MinLSB)
-		# CurrentLSB = 0.00016 (uA per bit)
-		self._current_lsb = 0.0916  # in milliamps
+	def _edge(self, pin):
+		#Runs in the GPIO callback thread, the first edge of a burst timestamps the change
+		if self.edge_time is None:
+			self.edge_time = time.time()
+		self.edge.set()
+
+	def _sense(self, timestamp):
+		j1a_power = hal.read_pin(self.config["i_j1a_sense_pin"])
+		j1b_power = hal.read_pin(self.config["i_j1b_sense_pin"])
+		if self.status["changed_utc"] and j1a_power == self.status["j1a_power"] and j1b_power == self.status["j1b_power"]:
+			return False
+
+		self.status["j1a_power"] = j1a_power
+		self.status["j1b_power"] = j1b_power
+		self.status["power"] = int(bool(j1b_power))
+		self.status["changed_utc"] = datetime.datetime.utcfromtimestamp(timestamp).isoformat(timespec='milliseconds') + 'Z'
+		return True
+
+	def _poll(self, timestamp):
+		#Rail levels and temperature, True when the status changed. A failed read is kept in the status until a read succeeds
+		degraded = self.status["degraded"]
+		try:
+			changed = self._sense(timestamp)
 
-		# 5. Compute the calibration register
-		# Cal = trunc (0.04096 / (Current_LSB * RSHUNT))
-		# Cal = 13434 (0x347a)
+			temp, valid = self._getTemperatureDS18B20(self.config["s_temp_sensor"])
+			if valid and temp != self.status["temp"]:
+				self.status["temp"] = temp
+				changed = True
 
-		self._cal_value = 8943
+			self.status["degraded"] = 0
+			self.status["error"] = ""
+		except Exception as e:
+			device_failed(self.status, e)
+			changed = False
+		return changed or self.status["degraded"] != degraded
 
-		# 6. Calculate the power LSB
-		# PowerLSB = 20 * CurrentLSB
-		# PowerLSB = 0.003 (3.048mW per bit)
-		self._power_lsb = 0.001832
+	def _shutdown_thread(self):
+		self.running = False
+		self.edge.set()
 
-		# 7. Compute the maximum current and shunt voltage values before overflow
-		#
-		# 8. Compute the Maximum Power
-		#
+	def run(self):
+		#Initial state, written once even though nothing changed yet
+		self._poll(time.time())
+		self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
 
-		# Set Calibration register to 'Cal' calcutated above
-		self._raw_calibration = self._cal_value
+		while self.running:
+			if self.edge.wait(self.config["i_polling_period"]):
+				#Let the contacts settle before reading the levels
+				time.sleep(self.config["i_debounce_ms"] / 1000.0)
+				timestamp = self.edge_time or time.time()
+				self.edge_time = None
+				self.edge.clear()
+			else:
+				timestamp = time.time()
 
-		# Set Config register to take into account the settings above
-		self.bus_voltage_range = BusVoltageRange.RANGE_16V
-		self.gain = Gain.DIV_4_160MV
-		self.bus_adc_resolution = ADCResolution.ADCRES_12BIT_4S
-		self.shunt_adc_resolution = ADCResolution.ADCRES_12BIT_4S
-		self.mode = Mode.SANDBVOLT_CONTINUOUS
+			if self._poll(timestamp):
+				self.parent.database.dumpData(id=self.config["s_id"], fields=self.status, timestamp=int(timestamp * 1000) * 1000000)
+				#The publisher may have failed to start
+				publisher = self.parent.systems.get("publisher")
+				if publisher is not None:
+					publisher.notify()
 
 
 class OBC(GenericSystem):
@@ -1168,24 +1428,49 @@ class OBC(GenericSystem):
 
 		self.running = True
 
-		self.I2C_BUS = board.I2C()
-
 		self.status = 	{
 							"power": 1,
-							"temp1": 0,
-							"temp2": 0,
-							"voltage" : 0,
-							"current" : 0,
-							"consumption" : 0
+							"temp1": 0.0,
+							"temp2": 0.0,
+							"voltage" : 0.0,
+							"current" : 0.0,
+							"consumption" : 0.0,
+							"cpu_freq" : 0,
+							"throttled" : 0,
+							"under_voltage" : 0,
+							"freq_capped" : 0,
+							"throttling" : 0,
+							"temp_limit" : 0,
+							"load1" : 0.0,
+							"load5" : 0.0,
+							"load15" : 0.0,
+							"cpu_util" : 0.0,
+							"degraded" : 0,
+							"error" : ""
 						 }
 
-		self.ina219 = CustomINA219(self.I2C_BUS, addr=int(self.config["s_power_ina219_addr"], 16))
-		self.ina219.set_custom_calibration_16V_3A()
+		#Thermal zones, cpufreq, throttling flags and /proc/stat, read from pre-opened files
+		self.sampler = hal.system_sampler()
+
+		self.ina219 = LazyDevice(self._open_ina219)
+		if not self.parent.lazy_hardware:
+			self.ina219.open()
+
+		self.power_sampler = None
+		if self.config["b_power_highrate"]:
+			self.power_sampler = PowerSampler(self.config["s_id"], self.ina219, self.config["i_power_sample_rate"], self._power_window, self._read_power)
+
+	def _shutdown_thread(self):
+		if self.power_sampler is not None:
+			self.power_sampler.stop()
+		self.running = False
 
-	def _getInternalTemperature(self):
-		output = subprocess.check_output(['vcgencmd', 'measure_temp'])
-		floats = re.findall("\d+\.\d+", output.decode('utf-8'))
-		return float(floats[0])
+	def _open_ina219(self):
+		address = int(self.config["s_power_ina219_addr"], 16)
+		return self.parent.i2c.call(self.config["s_id"], lambda: hal.power_monitor(address, self.config["i_power_averaging"]))
+
+	def activate(self):
+		activate_devices(self.status, self.ina219)
 
 	def reboot(self):
 		subprocess.run(["sudo reboot now"], shell=True)
@@ -1196,17 +1481,22 @@ class OBC(GenericSystem):
 		return {"success": True, "status": self.status}
 
 	def run(self):
-		while self.running:
-			self.status["temp1"] = self._getInternalTemperature()
+		if self.power_sampler is not None:
+			self.power_sampler.start()
 
-			temp2, valid = self._getTemperatureDS18B20(self.config["s_temp_sensor"])
-			if valid:
-				self.status["temp2"] = temp2
+		while self.running:
+			self.activate()
+			try:
+				self.status.update(self.sampler.sample())
 
+				temp2, valid = self._getTemperatureDS18B20(self.config["s_temp_sensor"])
+				if valid:
+					self.status["temp2"] = temp2
 
-			self.status["voltage"] = self.ina219.bus_voltage  # voltage on V- (load side)
-			self.status["current"] = self.ina219.current/1000.0 # current in mA
-			self.status["consumption"] = self.status["voltage"] * self.status["current"]
+				if self.ina219.available and self.power_sampler is None:
+					self._poll_power()
+			except Exception as e:
+				device_failed(self.status, e)
 
 			self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
 			time.sleep(self.config["i_polling_period"])
@@ -1222,11 +1512,13 @@ class Indicator(GenericSystem):
 		self.name = self.config["s_id"]		
 
 		self.status = 	{
-							"power" : 0
+							"power" : 0,
+							"degraded" : 0,
+							"error" : ""
 						}
 
-		GPIO.setup(self.config["i_control_pin"], GPIO.OUT)
-		GPIO.output(self.config["i_control_pin"], False)
+		hal.setup_output(self.config["i_control_pin"])
+		hal.write_pin(self.config["i_control_pin"], False)
 
 		self.interval_high = self.config["f_interval_high"]
 		self.interval_medium = self.config["f_interval_medium"]
@@ -1269,10 +1561,15 @@ class Indicator(GenericSystem):
 	def run(self):
 		while self.running:
 			while self.alarm_active:
-				GPIO.output(self.config["i_control_pin"], True)
-				time.sleep(self.interval)
+				try:
+					hal.write_pin(self.config["i_control_pin"], True)
+					time.sleep(self.interval)
 
-				GPIO.output(self.config["i_control_pin"], False)
+					hal.write_pin(self.config["i_control_pin"], False)
+					self.status["degraded"] = 0
+					self.status["error"] = ""
+				except Exception as e:
+					device_failed(self.status, e)
 				time.sleep(self.interval)
 			time.sleep(0.5)
 			#self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
@@ -1316,7 +1613,7 @@ class RF(GenericSystem):
 			time.sleep(2)
 
 	def _getDeviceIndex(self, serial):
-		return RtlSdr.get_device_index_by_serial(serial)
+		return hal.rtlsdr_index(serial)
 
 
 class LAN(GenericSystem):
@@ -1494,15 +1791,15 @@ class Audio():
 		self.config = config
 		self.name = self.config["s_id"]		
 
-		GPIO.setup(self.config["i_control_pin"], GPIO.OUT)
-		self.mixer = alsaaudio.Mixer(control="Headphone", id=0, cardindex=0, device="default")
+		hal.setup_output(self.config["i_control_pin"])
 
 		self.status = 	{
 							"power" : 0,
-							"volume": self.mixer.getvolume()[0],
-							"mute": int(self.mixer.getmute()[0]),
-							"test" : 0
-
+							"volume": 0,
+							"mute": 0,
+							"test" : 0,
+							"degraded" : 0,
+							"error" : ""
 						 }
 
 		if self.config["b_on_startup"]:
@@ -1510,10 +1807,22 @@ class Audio():
 		else:
 			self.set_power(False)
 
-		self.set_volume(self.config["i_startup_volume"])
+		self.mixer = LazyDevice(self._open_mixer)
+		if not self.parent.lazy_hardware:
+			self.mixer.open()
 
 		self.running = True
 
+	def _open_mixer(self):
+		mixer = hal.mixer()
+		mixer.setvolume(self.config["i_startup_volume"])
+		self.status["volume"] = self.config["i_startup_volume"]
+		self.status["mute"] = int(mixer.getmute()[0])
+		return mixer
+
+	def activate(self):
+		activate_devices(self.status, self.mixer)
+
 	def get_status(self):
 		return {"success": True, "status": self.status}
 
@@ -1526,7 +1835,7 @@ class Audio():
 
 	def set_volume(self, volume):
 		try:
-			self.mixer.setvolume(volume)
+			self.mixer.get().setvolume(volume)
 			self.status["volume"] = volume
 			return {"success": True, "status": self.status}
 		except Exception as e:
@@ -1534,7 +1843,7 @@ class Audio():
 
 	def increment_volume(self):
 		try:
-			self.mixer.setvolume(self.status["volume"] + 5)
+			self.mixer.get().setvolume(self.status["volume"] + 5)
 			self.status["volume"] += 5
 			return {"success": True, "status": self.status}
 		except Exception as e:
@@ -1542,7 +1851,7 @@ class Audio():
 
 	def decrement_volume(self):
 		try:
-			self.mixer.setvolume(self.status["volume"] - 5)
+			self.mixer.get().setvolume(self.status["volume"] - 5)
 			self.status["volume"] -= 5
 			return {"success": True, "status": self.status}
 		except Exception as e:
@@ -1550,7 +1859,7 @@ class Audio():
 
 	def set_mute(self, mute):
 		try:
-			self.mixer.setmute(mute)
+			self.mixer.get().setmute(mute)
 			self.status["mute"] = int(mute)
 			return {"success": True, "status": self.status}
 		except Exception as e:
@@ -1575,11 +1884,11 @@ class Audio():
 
 	def set_power(self, power):
 		if power:
-			GPIO.output(self.config["i_control_pin"], True)
+			hal.write_pin(self.config["i_control_pin"], True)
 			self.status["power"] = 1
 			return {"success": True, "status": self.status}
 		else:
-			GPIO.output(self.config["i_control_pin"], False)
+			hal.write_pin(self.config["i_control_pin"], False)
 			self.status["power"] = 0
 			return {"success": True, "status": self.status}
 
@@ -1651,44 +1960,57 @@ class Display(GenericSystem):
 
 		logging.info("Display init")
 
-		self.I2C_BUS = board.I2C()
+		self.display_connected = hal.backlight_present()
+
+		self.status = {
+							"power": 0,
+							"brightness": 0,
+							"voltage" : 0.0,
+							"current" : 0.0,
+							"consumption" : 0.0,
+							"degraded" : 0,
+							"error" : ""
+						 }
 
-		self.display_connected = os.path.isfile('/sys/class/backlight/rpi_backlight/max_brightness')
+		self.devices = []
 
 		if self.display_connected:
-			self.backlight = Backlight()
-			self.backlight.fade_duration = self.config["f_fade_duration"]
-			self.status = {
-								"power": int(self.backlight.power),
-								"brightness": self.backlight.brightness,
-								"voltage" : 0,
-								"current" : 0,
-								"consumption" : 0
-							 }
-		else:
-			self.status = {
-								"power": 0,
-								"brightness": 0,
-								"voltage" : 0,
-								"current" : 0,
-								"consumption" : 0
-							 }
-
+			self.backlight = LazyDevice(self._open_backlight)
+			self.devices.append(self.backlight)
 
+		self.power_sampler = None
 		if self.config["b_power_polling_enabled"]:
-			self.ina219 = CustomINA219(self.I2C_BUS, addr=int(self.config["s_power_ina219_addr"], 16))
-			self.ina219.set_custom_calibration_16V_3A()
+			self.ina219 = LazyDevice(self._open_ina219)
+			self.devices.append(self.ina219)
+			if self.config["b_power_highrate"]:
+				self.power_sampler = PowerSampler(self.config["s_id"], self.ina219, self.config["i_power_sample_rate"], self._power_window, self._read_power)
 
-
-		self.set_power(True)
-		self.set_brightness(self.config["i_backlight_startup"])
+		if not self.parent.lazy_hardware:
+			for device in self.devices:
+				device.open()
 
 		self.running = True
 
+	def _open_backlight(self):
+		backlight = hal.backlight()
+		backlight.fade_duration = self.config["f_fade_duration"]
+		backlight.power = True
+		backlight.brightness = self.config["i_backlight_startup"]
+		self.status["power"] = int(backlight.power)
+		self.status["brightness"] = backlight.brightness
+		return backlight
+
+	def _open_ina219(self):
+		address = int(self.config["s_power_ina219_addr"], 16)
+		return self.parent.i2c.call(self.config["s_id"], lambda: hal.power_monitor(address, self.config["i_power_averaging"]))
+
+	def activate(self):
+		activate_devices(self.status, *self.devices)
+
 	def set_brightness(self, brightness):
 		if self.display_connected:
 			try:
-				self.backlight.brightness = brightness
+				self.backlight.get().brightness = brightness
 				self.status["brightness"] = brightness
 				return {"success": True, "status": self.status}
 			except Exception as e:
@@ -1699,7 +2021,7 @@ class Display(GenericSystem):
 	def increment_brightness(self):
 		if self.display_connected:
 			try:
-				self.backlight.brightness = self.status["brightness"] + 5
+				self.backlight.get().brightness = self.status["brightness"] + 5
 				self.status["brightness"] += 5
 				return {"success": True, "status": self.status}
 			except Exception as e:
@@ -1710,7 +2032,7 @@ class Display(GenericSystem):
 	def decrement_brightness(self):
 		if self.display_connected:
 			try:
-				self.backlight.brightness = self.status["brightness"] - 5
+				self.backlight.get().brightness = self.status["brightness"] - 5
 				self.status["brightness"] -= 5
 				return {"success": True, "status": self.status}
 			except Exception as e:
@@ -1721,7 +2043,7 @@ class Display(GenericSystem):
 	def set_power(self, power):
 		if self.display_connected:
 			try:
-				self.backlight.power = power
+				self.backlight.get().power = power
 				self.status["power"] = int(power)
 				return {"success": True, "status": self.status}
 			except Exception as e:
@@ -1732,8 +2054,9 @@ class Display(GenericSystem):
 	def toggle_power(self):
 		if self.display_connected:
 			try:
-				self.backlight.power = not self.status["power"]
-				self.status["power"] = int(self.backlight.power)
+				backlight = self.backlight.get()
+				backlight.power = not self.status["power"]
+				self.status["power"] = int(backlight.power)
 				return {"success": True, "status": self.status}
 			except Exception as e:
 				return {"success": False, "message": str(e)}
@@ -1749,12 +2072,22 @@ class Display(GenericSystem):
 		return {"success": True, "file": file}
 
 
+	def _shutdown_thread(self):
+		if self.power_sampler is not None:
+			self.power_sampler.stop()
+		self.running = False
+
 	def run(self):
+		if self.power_sampler is not None:
+			self.power_sampler.start()
+
 		while self.running:
-			if self.config["b_power_polling_enabled"]:
-				self.status["voltage"] = self.ina219.bus_voltage  # voltage on V- (load side)
-				self.status["current"] = self.ina219.current/1000.0 # current in mA
-				self.status["consumption"] = self.status["voltage"] * self.status["current"]
+			self.activate()
+			try:
+				if self.config["b_power_polling_enabled"] and self.ina219.available and self.power_sampler is None:
+					self._poll_power()
+			except Exception as e:
+				device_failed(self.status, e)
 
 			self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
 			time.sleep(self.config["i_polling_period"])
@@ -1764,6 +2097,11 @@ class Display(GenericSystem):
 
 class GPS(GenericSystem):
 
+	#TPV key, status key. The 3D fields are only valid in a mode 3 fix.
+	TPV_FIELDS = [("lat", "lat"), ("lon", "lon"), ("track", "track"), ("speed", "hspeed")]
+	TPV_3D_FIELDS = [	("climb", "climb"), ("epc", "error_c"), ("eps", "error_s"), ("ept", "error_t"),
+						("epv", "error_v"), ("epx", "error_x"), ("epy", "error_y")]
+
 	def __init__(self, parent, config):
 		Thread.__init__(self)
 		self.parent = parent
@@ -1775,20 +2113,34 @@ class GPS(GenericSystem):
 							"mode" : 0,
 							"sats_visible" : 0,
 							"sats_used" : 0,
+							"snr_mean" : 0.0,
+							"snr_max" : 0.0,
 							"lat" : 0.0,
 							"lon" : 0.0,
 							"track" : 0.0,
 							"hspeed" : 0.0,
 							"time_utc" : "",
-							#"error" : 0,
 							"mgrs" : "",
 							"grid" : "",
 							"alt" : 0.0,
-							"climb" : 0.0
-
+							"climb" : 0.0,
+							"error_c" : 0.0,
+							"error_s" : 0.0,
+							"error_t" : 0.0,
+							"error_v" : 0.0,
+							"error_x" : 0.0,
+							"error_y" : 0.0
 						 }
 
-		self.m = mgrs.MGRS()
+		#Latest SKY report, one entry per satellite
+		self.satellites = []
+		#Position the MGRS and grid locators were computed for
+		self.derived = None
+
+		#Position history for the GUI and navigation, served without a database round trip
+		self.track = track.TrackStore(self.config["i_track_capacity"], self.config["f_track_interval"])
+
+		self.stream = hal.gps_stream(self.config["s_gpsd_ip"], self.config["i_gpsd_port"])
 
 		self.running = True
 		self.connected = False
@@ -1804,7 +2156,7 @@ class GPS(GenericSystem):
 			subprocess.run(["../scripts/enable_gps.sh"], shell=True) #Enable GPSD and wake GPS
 			time.sleep(0.5)
 			try:
-				gpsd.connect()
+				self.stream.connect()
 				self.connected = True
 				self.status["power"] = int(self.connected)
 				return {"success": True, "status": self.status}
@@ -1814,145 +2166,120 @@ class GPS(GenericSystem):
 		else:
 			if self.status["power"]:
 				self.connected = False
+				self.stream.close()
 				subprocess.run(["../scripts/disable_gps.sh"], shell=True) #Disable GPS
-				self.status["power"] = int(self.connected)
 				self.status["mode"] = 0
 				self.status["sats_visible"] = 0
 				self.status["sats_used"] = 0
-				self.status["lat"] = 0.0
-				self.status["lon"] = 0.0
-				self.status["track"] = 0.0
-				self.status["hspeed"] = 0.0
-				self.status["time_utc"] = ""
-
-				self.status["error_c"] = 0.0
-				self.status["error_s"] = 0.0
-				self.status["error_t"] = 0.0
-				self.status["error_v"] = 0.0
-				self.status["error_x"] = 0.0
-				self.status["error_y"] = 0.0
-
-				self.status["mgrs"] = ""
-				self.status["grid"] = ""
-				self.status["alt"] = 0.0
-				self.status["climb"] = 0.0
+				self.status["snr_mean"] = 0.0
+				self.status["snr_max"] = 0.0
+				self.satellites = []
+				self._clear_fix()
 				self.status["power"] = int(self.connected)
 				return {"success": True, "status": self.status}
 			else:
 				return {"success": False, "message": "GPS is already disabled"}
 
-
-	def to_grid(self, dec_lat, dec_lon):
-
-		upper = 'ABCDEFGHIJKLMNOPQRSTUVWX'
-		lower = 'abcdefghijklmnopqrstuvwx'
-		adj_lat = dec_lat + 90.0
-		adj_lon = dec_lon + 180.0
-		grid_lat_sq = upper[int(adj_lat/10)]
-		grid_lon_sq = upper[int(adj_lon/20)]
-		grid_lat_field = str(int(adj_lat%10))
-		grid_lon_field = str(int((adj_lon/2)%10))
-		adj_lat_remainder = (adj_lat - int(adj_lat)) * 60
-		adj_lon_remainder = ((adj_lon) - int(adj_lon/2)*2) * 60
-		grid_lat_subsq = lower[int(adj_lat_remainder/2.5)]
-		grid_lon_subsq = lower[int(adj_lon_remainder/5)]
-
-		return grid_lon_sq + grid_lat_sq + grid_lon_field + grid_lat_field + grid_lon_subsq + grid_lat_subsq
+	def get_satellites(self):
+		return {"success": True, "satellites": self.satellites}
+
+	def get_track(self, hours, method, tolerance):
+		#method none, dp (Douglas-Peucker, tolerance in m) or time (one point per tolerance s)
+		points = self.track.query(hours, method, tolerance)
+		return {"success": True, "points": len(points), "track": track.to_geojson(points, self.config["s_name"])}
+
+	def get_track_gpx(self, hours, method, tolerance):
+		points = self.track.query(hours, method, tolerance)
+		return {"success": True, "points": len(points), "gpx": track.to_gpx(points, self.config["s_name"])}
+
+	def _clear_fix(self):
+		for key, field in self.TPV_FIELDS + self.TPV_3D_FIELDS:
+			self.status[field] = 0.0
+		self.status["alt"] = 0.0
+		self.status["time_utc"] = ""
+		self.status["mgrs"] = ""
+		self.status["grid"] = ""
+		self.derived = None
+
+	def _derive(self, lat, lon):
+		#MGRS and grid only change when the position moved more than f_derive_threshold meters
+		if self.derived is not None:
+			dy = (lat - self.derived[0]) * 111320.0
+			dx = (lon - self.derived[1]) * 111320.0 * math.cos(math.radians(lat))
+			if dx * dx + dy * dy < self.config["f_derive_threshold"] ** 2:
+				return
+		self.status["mgrs"] = str(geodesy.mgrs(lat, lon)[0])
+		self.status["grid"] = str(geodesy.maidenhead(lat, lon, self.config["i_grid_length"])[0])
+		self.derived = (lat, lon)
+
+	def _handle_tpv(self, report):
+		self.status["mode"] = report.get("mode", 0)
+		if self.status["mode"] < 2:
+			self._clear_fix()
+			return
+
+		self.status["time_utc"] = str(report.get("time", ""))
+		for key, field in self.TPV_FIELDS:
+			self.status[field] = float(report.get(key, 0.0))
+
+		#gpsd >= 3.20 reports altMSL, older versions alt
+		if self.status["mode"] == 3:
+			self.status["alt"] = float(report.get("altMSL", report.get("alt", 0.0)))
+			for key, field in self.TPV_3D_FIELDS:
+				self.status[field] = float(report.get(key, 0.0))
+		else:
+			self.status["alt"] = 0.0
+			for key, field in self.TPV_3D_FIELDS:
+				self.status[field] = 0.0
+
+		self._derive(self.status["lat"], self.status["lon"])
+		self.track.add(	time.time(), self.status["lat"], self.status["lon"], self.status["alt"], self.status["hspeed"], self.status["track"], \
+						self.status["error_x"], self.status["error_y"], self.status["error_v"])
+
+	def _handle_sky(self, report):
+		satellites = report.get("satellites")
+		if satellites is None:
+			return
+		self.satellites = [{"prn": s.get("PRN", 0), "el": s.get("el", 0.0), "az": s.get("az", 0.0), "snr": s.get("ss", 0.0), "used": bool(s.get("used", False))} for s in satellites]
+		used = [s["snr"] for s in self.satellites if s["used"]]
+		self.status["sats_visible"] = len(self.satellites)
+		self.status["sats_used"] = len(used)
+		self.status["snr_mean"] = round(sum(used) / len(used), 1) if used else 0.0
+		self.status["snr_max"] = max(used) if used else 0.0
 
 	def _shutdown_thread(self):
 		self.running = False
 		self.connected = False
-
+		self.stream.close()
 
 	def run(self):
+		#Every report is handled as it arrives, the database gets the latest state every f_dump_period
+		last_dump = 0.0
 		while self.running:
 			while self.connected:
-
-				self.packet = gpsd.get_current() #this will continue to loop and grab EACH set of gpsd info to clear the buffer
-				self.status["mode"] = self.packet.mode
-				self.status["sats_visible"] = self.packet.sats
-				self.status["sats_used"] = self.packet.sats_valid
-
-				if self.status["mode"] == 0:
-
-					self.status["lat"] = 0.0
-					self.status["lon"] = 0.0
-					self.status["track"] = 0.0
-					self.status["hspeed"] = 0.0
-					self.status["time_utc"] = ""
-
-					self.status["error_c"] = 0.0
-					self.status["error_s"] = 0.0
-					self.status["error_t"] = 0.0
-					self.status["error_v"] = 0.0
-					self.status["error_x"] = 0.0
-					self.status["error_y"] = 0.0
-
-					self.status["mgrs"] = ""
-					self.status["grid"] = ""
-					self.status["alt"] = 0.0
-					self.status["climb"] = 	0.0
-
-				elif self.status["mode"] == 1:
-
-					self.status["lat"] = 0.0
-					self.status["lon"] = 0.0
-					self.status["track"] = 0.0
-					self.status["hspeed"] = 0.0
-					self.status["time_utc"] = ""
-					self.status["error_c"] = 0.0
-					self.status["error_s"] = 0.0
-					self.status["error_t"] = 0.0
-					self.status["error_v"] = 0.0
-					self.status["error_x"] = 0.0
-					self.status["error_y"] = 0.0
-					self.status["mgrs"] = ""
-					self.status["grid"] = ""
-					self.status["alt"] = 0.0
-					self.status["climb"] = 	0.0
-
-				elif self.status["mode"] == 2:
-
-					self.status["lat"] = self.packet.lat
-					self.status["lon"] = self.packet.lon
-					self.status["track"] = self.packet.track
-					self.status["hspeed"] = self.packet.track
-					self.status["time_utc"] = str(self.packet.time)
-
-					self.status["error_c"] = 0.0
-					self.status["error_s"] = 0.0
-					self.status["error_t"] = 0.0
-					self.status["error_v"] = 0.0
-					self.status["error_x"] = 0.0
-					self.status["error_y"] = 0.0
-
-					self.status["mgrs"] = self.m.toMGRS(self.packet.lat, self.packet.lon).decode('utf-8')
-					self.status["grid"] = self.to_grid(self.packet.lat, self.packet.lon)
-					self.status["alt"] = 0.0
-					self.status["climb"] = 0.0
-
-				elif self.status["mode"] == 3:
-
-					self.status["lat"] = self.packet.lat
-					self.status["lon"] = self.packet.lon
-					self.status["track"] = self.packet.track
-					self.status["hspeed"] = self.packet.track
-					self.status["time_utc"] = str(self.packet.time)
-
-					self.status["error_c"] = float(self.packet.error["c"])
-					self.status["error_s"] = float(self.packet.error["s"])
-					self.status["error_t"] = float(self.packet.error["t"])
-					self.status["error_v"] = float(self.packet.error["v"])
-					self.status["error_x"] = float(self.packet.error["x"])
-					self.status["error_y"] = float(self.packet.error["y"])
-
-					self.status["mgrs"] = self.m.toMGRS(self.packet.lat, self.packet.lon).decode('utf-8')
-					self.status["grid"] = self.to_grid(self.packet.lat, self.packet.lon)
-					self.status["alt"] = self.packet.alt
-					self.status["climb"] = self.packet.climb
-
-				self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
-				time.sleep(1)
+				try:
+					report = self.stream.read()
+				except Exception as e:
+					if not self.connected:
+						break
+					print("gpsd: {}".format(str(e)))
+					time.sleep(1)
+					try:
+						self.stream.connect()
+					except Exception:
+						pass
+					continue
+
+				if report is not None:
+					if report.get("class") == "TPV":
+						self._handle_tpv(report)
+					elif report.get("class") == "SKY":
+						self._handle_sky(report)
+
+				now = time.monotonic()
+				if now - last_dump >= self.config["f_dump_period"]:
+					last_dump = now
+					self.parent.database.dumpData(id=self.config["s_id"], fields=self.status)
 			time.sleep(0.5)
 
 
@@ -1970,25 +2297,19 @@ class Database():
 
 		self.dbclient = InfluxDBClient(host=self.config["s_db_host"], port=self.config["i_db_port"], username=self.config["s_db_username"], password=self.config["s_db_password"], database=self.config["s_db_name"])
 
+		#Points are queued here and written by a dedicated thread so polling loops never wait on HTTP
+		self.writer = BatchWriter(self.dbclient, self.config, self.status)
+		self.writer.start()
 
 
+	def dumpData(self, id, fields, timestamp=None):
+		self.writer.put(id, fields, timestamp)
 
-
-	def dumpData(self, id, fields):
-		try:
-			json_body = [{
-							"measurement": id,
-							"time": datetime.datetime.utcnow(),
-							"fields": fields
-						}]
-
-			self.dbclient.write_points(json_body)
-		except Exception as e:
-			print("Exception when writing data to database:" + str(e))
-
-
+	def close(self):
+		self.writer.stop()
 
 	def get_status(self):
+		self.status["queue_depth"] = self.writer.queue.qsize()
 		return {"success": True, "status": self.status}
 
 	def get_config(self):
@@ -2049,14 +2370,15 @@ class Bluetooth(GenericSystem):
 							"power" : 0,
 							"mac" : "",
 							"conn" : "",
-							"cmds" : 0
+							"cmds" : 0,
+							"degraded" : 0,
+							"error" : ""
 						}
 
-		self.socket = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
 		self.size = 1024
-
-		self.socket.bind((self.config["s_bt_mac"], self.config["i_socket_port"]))
-		self.socket.listen(1)
+		self.socket = LazyDevice(self._open_socket)
+		if not self.parent.lazy_hardware:
+			self.socket.open()
 
 		if self.config["b_on_startup"]:
 			self.set_power(True)
@@ -2090,11 +2412,26 @@ class Bluetooth(GenericSystem):
 		else:
 			return self.set_power(False)
 
+	def _open_socket(self):
+		server_socket = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+		server_socket.bind((self.config["s_bt_mac"], self.config["i_socket_port"]))
+		server_socket.listen(1)
+		return server_socket
+
+	def activate(self):
+		activate_devices(self.status, self.socket)
+
 	def run(self):
 		while self.alive:
 			while self.running:
+				self.activate()
+				if not self.socket.available:
+					time.sleep(1)
+					continue
+
+				client = None
 				try:
-					client, address = self.socket.accept()
+					client, address = self.socket.device.accept()
 					#print("Incoming connection from {CLI}".format(CLI=address))
 					self.status["conn"] = address[0]
 					while True:
@@ -2106,14 +2443,15 @@ class Bluetooth(GenericSystem):
 
 				except Exception as e:
 					#print("Client disconnected with error:{ERR}".format(ERR=e))
-					client.close()
+					if client is not None:
+						client.close()
 					self.status["conn"] = ""
 					time.sleep(1)
 			time.sleep(1) #Idle at 1 Hz if not active
 
 
 	def _shutdown_thread(self):
-		self.socket.close()		
+		self.socket.close()
 		self.running = False
 		self.alive = False
 
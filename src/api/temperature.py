@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+from threading import Thread, Lock, Event
+
+import hal
+
+
+class TemperatureService(Thread):
+
+	"""
+	Reads every DS18B20 on the 1-wire bus on behalf of all subsystems. Each cycle
+	starts one bulk conversion for the whole bus, waits for it once, then reads the
+	latched values from sysfs. Subsystems get the cached reading immediately.
+
+	Sensors are registered on their first read, the cycle is then started early so
+	the value is available by the next poll. Readings older than f_max_age seconds
+	are reported as invalid.
+	"""
+
+	def __init__(self, config):
+		Thread.__init__(self)
+		self.config = config
+		self.name = self.config["s_id"]
+		self.daemon = True
+
+		self.lock = Lock()
+		self.wakeup = Event()
+		self.sensors = []
+		self.cache = {}
+
+		self.status = 	{
+							"sensors" : 0,
+							"cycles" : 0,
+							"bulk" : 0,
+							"conversion_time" : 0.0,
+							"failed" : 0
+						}
+
+		self.running = True
+
+	def read(self, sensor):
+		with self.lock:
+			entry = self.cache.get(sensor)
+			if sensor not in self.sensors:
+				self.sensors.append(sensor)
+				self.status["sensors"] = len(self.sensors)
+				self.wakeup.set()
+
+		if entry is None or time.monotonic() - entry[1] > self.config["f_max_age"]:
+			return 0.0, False
+		return entry[0], True
+
+	def reading(self, sensor):
+		#Value and age in seconds, None if the sensor never answered
+		with self.lock:
+			entry = self.cache.get(sensor)
+		if entry is None:
+			return None
+		return {"value": entry[0], "age": round(time.monotonic() - entry[1], 3)}
+
+	def get_status(self):
+		return {"success": True, "status": self.status}
+
+	def _convert(self):
+		start = time.monotonic()
+		bulk = hal.trigger_temperature_conversion()
+		if bulk:
+			deadline = start + self.config["f_conversion_timeout"]
+			while hal.temperature_conversion_pending() and time.monotonic() < deadline:
+				time.sleep(0.05)
+		self.status["bulk"] = int(bulk)
+		self.status["conversion_time"] = round(time.monotonic() - start, 3)
+
+	def _cycle(self):
+		with self.lock:
+			sensors = list(self.sensors)
+		if not sensors:
+			return
+
+		self._convert()
+		for sensor in sensors:
+			value, valid = hal.read_temperature(sensor)
+			if valid:
+				with self.lock:
+					self.cache[sensor] = (value, time.monotonic())
+			else:
+				self.status["failed"] += 1
+		self.status["cycles"] += 1
+
+	def stop(self):
+		self.running = False
+		self.wakeup.set()
+
+	def run(self):
+		while self.running:
+			start = time.monotonic()
+			self.wakeup.clear()
+			try:
+				self._cycle()
+			except Exception as e:
+				print("Temperature cycle failed: {}".format(str(e)))
+			self.wakeup.wait(max(0.0, self.config["f_period"] - (time.monotonic() - start)))
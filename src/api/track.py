@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+import datetime
+from threading import Lock
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+COLUMNS = ("t", "lat", "lon", "alt", "speed", "track", "epx", "epy", "epv")
+T, LAT, LON, ALT, SPEED, TRACK, EPX, EPY, EPV = range(len(COLUMNS))
+
+METERS_PER_DEGREE = 111320.0
+
+
+def _project(points):
+	#Local equirectangular projection in meters, good enough for tolerances of a few meters
+	lat0 = np.radians(points[:, LAT].mean())
+	return points[:, LON] * METERS_PER_DEGREE * np.cos(lat0), points[:, LAT] * METERS_PER_DEGREE
+
+def douglas_peucker(points, tolerance):
+	"""
+	Indices of the points kept by Douglas-Peucker with a tolerance in meters.
+	Iterative, each segment is evaluated with one vectorized distance computation.
+	"""
+
+	n = len(points)
+	if n < 3:
+		return np.arange(n)
+
+	x, y = _project(points)
+	keep = np.zeros(n, dtype=bool)
+	keep[0] = keep[-1] = True
+
+	stack = [(0, n - 1)]
+	while stack:
+		start, end = stack.pop()
+		if end - start < 2:
+			continue
+		dx, dy = x[end] - x[start], y[end] - y[start]
+		px, py = x[start+1:end] - x[start], y[start+1:end] - y[start]
+		norm = np.hypot(dx, dy)
+		if norm > 0:
+			distance = np.abs(dx * py - dy * px) / norm
+		else:
+			distance = np.hypot(px, py)
+		i = int(np.argmax(distance))
+		if distance[i] > tolerance:
+			k = start + 1 + i
+			keep[k] = True
+			stack.append((start, k))
+			stack.append((k, end))
+
+	return np.nonzero(keep)[0]
+
+def time_buckets(points, interval):
+	#Index of the last point in every interval seconds bucket
+	buckets = np.floor(points[:, T] / interval)
+	last = np.nonzero(np.diff(buckets))[0]
+	return np.append(last, len(points) - 1)
+
+
+class TrackStore(object):
+
+	"""
+	Position history in a fixed size ring buffer, one row per COLUMNS entry.
+	Fixes closer together than min_interval seconds are dropped, so a 10 Hz
+	receiver does not shorten the history.
+	"""
+
+	def __init__(self, capacity, min_interval):
+		self.data = np.zeros((capacity, len(COLUMNS)))
+		self.capacity = capacity
+		self.min_interval = min_interval
+		self.head = 0
+		self.count = 0
+		self.last = 0.0
+		self.lock = Lock()
+
+	def add(self, t, lat, lon, alt, speed, track, epx, epy, epv):
+		if t - self.last < self.min_interval:
+			return False
+		with self.lock:
+			self.data[self.head] = (t, lat, lon, alt, speed, track, epx, epy, epv)
+			self.head = (self.head + 1) % self.capacity
+			self.count = min(self.count + 1, self.capacity)
+			self.last = t
+		return True
+
+	def __len__(self):
+		return self.count
+
+	def window(self, seconds=None):
+		#Rows of the last seconds in time order, a copy
+		with self.lock:
+			if self.count < self.capacity:
+				points = self.data[:self.count].copy()
+			else:
+				points = np.concatenate((self.data[self.head:], self.data[:self.head]))
+		if seconds is not None and len(points):
+			points = points[np.searchsorted(points[:, T], time.time() - seconds):]
+		return points
+
+	def query(self, hours=None, method="none", tolerance=0.0):
+		points = self.window(hours * 3600.0 if hours else None)
+		if method == "dp" and tolerance > 0:
+			points = points[douglas_peucker(points, tolerance)]
+		elif method == "time" and tolerance > 0 and len(points):
+			points = points[time_buckets(points, tolerance)]
+		elif method not in ("none", "dp", "time"):
+			raise ValueError('Unknown downsampling method {}, expected none, dp or time'.format(method))
+		return points
+
+
+def _utc(t):
+	return datetime.datetime.utcfromtimestamp(t).isoformat(timespec='milliseconds') + 'Z'
+
+def to_geojson(points, name):
+	return 	{
+				"type" : "Feature",
+				"geometry" : {
+								"type" : "LineString",
+								"coordinates" : [[round(p[LON], 7), round(p[LAT], 7), round(p[ALT], 1)] for p in points]
+							},
+				"properties" : {
+								"name" : name,
+								"times" : [_utc(p[T]) for p in points],
+								"speed" : [round(p[SPEED], 2) for p in points],
+								"track" : [round(p[TRACK], 1) for p in points]
+							}
+			}
+
+def to_gpx(points, name):
+	lines = [	'<?xml version="1.0" encoding="UTF-8"?>',
+				'<gpx version="1.1" creator="pisdr-cyberdeck" xmlns="http://www.topografix.com/GPX/1/1">',
+				'<trk><name>{}</name><trkseg>'.format(escape(name))]
+	for p in points:
+		lines.append('<trkpt lat="{:.7f}" lon="{:.7f}"><ele>{:.1f}</ele><time>{}</time></trkpt>'.format(p[LAT], p[LON], p[ALT], _utc(p[T])))
+	lines.append('</trkseg></trk></gpx>')
+	return '\n'.join(lines)
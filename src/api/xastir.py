@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'Tom Mladenov'
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+def station(aprs):
+	#Source call of an APRS string, as Xastir shows the station
+	return aprs.split('>', 1)[0]
+
+def position_hash(record, digits):
+	#Same position when the coordinates agree to digits decimals (4 is about 10 m), records
+	#without a position are compared on the APRS information field, which digipeaters leave intact
+	if record["lat"] is not None:
+		return hash((round(record["lat"], digits), round(record["lon"], digits)))
+	return hash(record["aprs"].split(':', 1)[-1])
+
+
+class XastirSink(object):
+
+	"""
+	Deduplication and rate limiting in front of the Xastir UDP port. offer() is called per
+	record by the xastir stage and flush() after every batch and while the stage is idle,
+	it returns the APRS strings to send.
+
+	An update is suppressed when the same (station, position hash) was forwarded less
+	than f_xastir_duplicate_timeout seconds ago. Otherwise it is pending until its station
+	was last forwarded at least f_xastir_min_interval seconds ago, a newer update of the
+	station replaces it (coalesced), so the last position always reaches Xastir. All
+	three tables are LRUs of i_xastir_cache_size entries, a pending update pushed out
+	by newer stations is dropped (evicted).
+	"""
+
+	def __init__(self, config):
+		self.config = config
+		self.lock = Lock()
+
+		#(station, position hash) -> time forwarded
+		self.seen = OrderedDict()
+		#station -> time forwarded
+		self.stations = OrderedDict()
+		#station -> (key, APRS string) to send once the station is out of its interval
+		self.pending = OrderedDict()
+
+		self.stats = 	{
+							"offered" : 0,
+							"forwarded" : 0,
+							"suppressed" : 0,
+							"coalesced" : 0,
+							"evicted" : 0,
+							"flushes" : 0
+						}
+
+	def _recent(self, table, key, now, period):
+		forwarded = table.get(key)
+		if forwarded is None:
+			return False
+		if now - forwarded >= period:
+			del table[key]
+			return False
+		table.move_to_end(key)
+		return True
+
+	def _remember(self, table, key, now):
+		table[key] = now
+		table.move_to_end(key)
+		while len(table) > self.config["i_xastir_cache_size"]:
+			table.popitem(last=False)
+
+	def offer(self, record):
+		"""
+		Queue the APRS string of a record unless it is a duplicate. Returns True when it was queued.
+		"""
+
+		if record["aprs"] is None:
+			return False
+
+		now = time.monotonic()
+		name = station(record["aprs"])
+		key = (name, position_hash(record, self.config["i_xastir_position_digits"]))
+
+		with self.lock:
+			self.stats["offered"] += 1
+			if self._recent(self.seen, key, now, self.config["f_xastir_duplicate_timeout"]):
+				#Xastir already shows this position, a pending update of the station is older
+				if self.pending.pop(name, None) is not None:
+					self.stats["coalesced"] += 1
+				self.stats["suppressed"] += 1
+				return False
+
+			if name in self.pending:
+				self.stats["coalesced"] += 1
+			self.pending[name] = (key, record["aprs"])
+			self.pending.move_to_end(name)
+			while len(self.pending) > self.config["i_xastir_cache_size"]:
+				self.pending.popitem(last=False)
+				self.stats["evicted"] += 1
+			return True
+
+	def flush(self):
+		"""
+		Pending APRS strings of stations outside f_xastir_min_interval, their stations count as forwarded now.
+		"""
+
+		now = time.monotonic()
+		with self.lock:
+			due = [name for name in self.pending if not self._recent(self.stations, name, now, self.config["f_xastir_min_interval"])]
+			if not due:
+				return []
+
+			strings = []
+			for name in due:
+				key, aprs = self.pending.pop(name)
+				self._remember(self.seen, key, now)
+				self._remember(self.stations, name, now)
+				strings.append(aprs)
+			self.stats["forwarded"] += len(strings)
+			self.stats["flushes"] += 1
+			return strings
+
+	def get_stats(self):
+		with self.lock:
+			stats = dict(self.stats)
+			stats["cache"] = len(self.seen)
+			stats["stations"] = len(self.stations)
+			stats["pending"] = len(self.pending)
+			return stats
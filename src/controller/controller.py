@@ -5,6 +5,7 @@ __author__ = 'Tom Mladenov'
 
 import os
 import struct
+import fcntl
 import sys
 import time
 from threading import Thread, Lock
@@ -29,6 +30,9 @@ from adafruit_bus_device.i2c_device import I2CDevice
 CMD_ID = 0x33
 PARAM_ID = 0x54
 
+#Shared with the I2C scheduler of the API server (s_lock_file in [i2c])
+I2C_LOCK_FILE = '/run/lock/cyberdeck-i2c.lock'
+
 class Controller(Thread):
 
 	alive = True
@@ -39,12 +43,20 @@ class Controller(Thread):
 		self.parent = parent
 		self.i2c_bus = i2c_instance
 		self.controller_device = I2CDevice(self.i2c_bus, self.parent.parent.datapool.ADDR_REMOTE_CONTROL)
+		self.bus_lock = open(I2C_LOCK_FILE, 'a')
+
+	def _transaction(self, function, *args):
+		fcntl.flock(self.bus_lock, fcntl.LOCK_EX)
+		try:
+			return function(*args)
+		finally:
+			fcntl.flock(self.bus_lock, fcntl.LOCK_UN)
 
 
 	def alive(self):
 		#Poll if device reachable
 		command = bytearray([0xFF, 0x00, 0xFF, 0x00])
-		self.controller_device.write_then_readinto(command, response)
+		self._transaction(self.controller_device.write_then_readinto, command, response)
 		if response.decode('utf-8') == 'OK':
 			return True
 		else:
@@ -74,7 +86,7 @@ class Controller(Thread):
 
 					arr = bytearray(rList)
 					payload = arr #+ bytearray.fromhex(str(crc))
-					self.controller_device.write(payload)
+					self._transaction(self.controller_device.write, payload)
 					print(str(payload))
 
 				except Exception as e:
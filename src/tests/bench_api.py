@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Requests/second for GET /systems/{system}/status, before and after the route table.
+Run from this directory on the target (Pi) to get representative numbers:
+
+	python3 bench_api.py                              in-process, legacy vs route table
+	python3 bench_api.py -u http://127.0.0.1:5000     against a running server
+"""
+
+__author__ = 'Tom Mladenov'
+
+import sys
+sys.path.append("../api")
+import time
+import inspect
+import argparse
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routes
+
+
+class FakeSystem(object):
+
+	def __init__(self, id):
+		self.config = {"s_id": id, "s_type": "device"}
+		self.status = {"power": 1, "temp1": 48.3, "voltage": 5.12, "current": 1.37}
+
+	def get_status(self):
+		return {"success": True, "status": self.status}
+
+
+#Same number of systems as the real server
+systems = [FakeSystem("system{}".format(i)) for i in range(35)]
+registry = {s.config["s_id"]: s for s in systems}
+
+
+def legacy_dispatch(**kwargs):
+	try:
+		s = [sys for sys in systems if sys.config["s_id"] == kwargs["system"]][0]
+		target_function = getattr(s, kwargs["function_name"])
+		if kwargs["args"]:
+			return target_function(*kwargs["args"])
+		else:
+			return target_function()
+	except IndexError:
+		return {"success": False, "response": "System with provided ID not found"}
+
+def registry_dispatch(**kwargs):
+	s = registry.get(kwargs["system"])
+	if s is None:
+		return {"success": False, "response": "System with provided ID not found"}
+	target_function = getattr(s, kwargs["function_name"])
+	if kwargs["args"]:
+		return target_function(*kwargs["args"])
+	else:
+		return target_function()
+
+
+legacy_api = FastAPI()
+
+@legacy_api.get("/systems/{system}/status")
+def get_status(system: str):
+	return legacy_dispatch(system=system, function_name=inspect.stack()[0][3], args=None)
+
+table_api = FastAPI()
+routes.register(table_api, registry_dispatch)
+
+
+def bench_handler(name, handler, n):
+	start = time.perf_counter()
+	for i in range(n):
+		handler(system="system34")
+	elapsed = time.perf_counter() - start
+	print('{:<12} handler  {:>10.1f} us/call'.format(name, elapsed/n*1e6))
+
+def bench_http(name, get, n):
+	start = time.perf_counter()
+	for i in range(n):
+		r = get("/systems/system34/status")
+		assert r.status_code == 200
+	elapsed = time.perf_counter() - start
+	print('{:<12} http     {:>10.0f} req/s'.format(name, n/elapsed))
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='REST dispatch benchmark')
+	parser.add_argument('-n', '--iterations', type=int, default=2000, help='requests per measurement')
+	parser.add_argument('-u', '--url', type=str, help='base url of a running server')
+	args = parser.parse_args()
+
+	if args.url:
+		import requests
+		session = requests.Session()
+		bench_http('server', lambda path: session.get(args.url + path), args.iterations)
+		sys.exit()
+
+	table_handler = [r.endpoint for r in table_api.routes if getattr(r, "path", "") == "/systems/{system}/status"][0]
+	bench_handler('legacy', get_status, args.iterations)
+	bench_handler('routetable', table_handler, args.iterations)
+
+	bench_http('legacy', TestClient(legacy_api).get, args.iterations)
+	bench_http('routetable', TestClient(table_api).get, args.iterations)
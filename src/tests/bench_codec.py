@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compare the binary wire codec against the previous pickle path.
+Run from this directory: python3 bench_codec.py [-n iterations]
+"""
+
+__author__ = 'Tom Mladenov'
+
+import sys
+sys.path.append("../api")
+import time
+import json
+import pickle
+import argparse
+from configparser import ConfigParser
+
+import codec
+from packet import Packet
+
+
+def build_configstatus():
+	#Representative status frame, built from the real server configuration
+	configurator = ConfigParser()
+	configurator.read("../api/config.ini")
+	configstatus = []
+	for section in configurator.sections():
+		config = dict(configurator.items(section))
+		status = {"running": 1, "power": 1, "temp1": 48.3, "temp2": 31.25, "voltage": 5.12, "current": 1.37, "consumption": 7.01, "time_utc": "2020-10-18T12:00:00.000Z"}
+		configstatus.append({"id": section, "config": config, "status": status})
+	return {"success": True, "configstatus": configstatus}
+
+
+def build_cycles(status):
+	#What the Publisher sends per cycle: one frame per system, keyframes with config and status,
+	#deltas with the changed status keys only
+	keyframes = [{"id": item["id"], "keyframe": True, "config": item["config"], "status": item["status"], "seq": 0} for item in status["configstatus"]]
+	deltas = [{"id": item["id"], "keyframe": False, "status": {"temp1": 48.4, "time_utc": "2020-10-18T12:00:01.000Z"}, "seq": 1} for item in status["configstatus"]]
+	return keyframes, deltas
+
+def cycle(function):
+	return lambda frames: [function(frame) for frame in frames]
+
+def bench(name, message, encode, decode, n):
+	data = encode(message)
+
+	start = time.perf_counter()
+	for i in range(n):
+		encode(message)
+	t_enc = time.perf_counter() - start
+
+	start = time.perf_counter()
+	for i in range(n):
+		decode(data)
+	t_dec = time.perf_counter() - start
+
+	size = sum(len(frame) for frame in data) if isinstance(data, list) else len(data)
+	print('{:<16} {:>8} B {:>12.0f} enc/s {:>12.0f} dec/s'.format(name, size, n/t_enc, n/t_dec))
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Wire codec benchmark')
+	parser.add_argument('-n', '--iterations', type=int, default=20000, help='iterations per measurement')
+	args = parser.parse_args()
+
+	ais = Packet("ais", "!AIVDM,1,1,,A,15RTgt0PAso;90TKcjM8h6g208CQ,0*4A")
+	sonde = Packet("rs1", json.dumps({"frame": 4211, "id": "S1234567", "datetime": "2020-10-18T12:00:00.000Z", "lat": 49.87, "lon": 8.65, "alt": 12034.5, "vel_h": 12.1, "heading": 221.3, "vel_v": 5.2, "sats": 9, "type": "RS41"}))
+	status = build_configstatus()
+
+	print('Packet (AIS)')
+	bench('pickle', ais, pickle.dumps, pickle.loads, args.iterations)
+	bench('codec', ais, codec.encode_packet, codec.decode_packet, args.iterations)
+
+	print('Packet (radiosonde JSON)')
+	bench('pickle', sonde, pickle.dumps, pickle.loads, args.iterations)
+	bench('codec', sonde, codec.encode_packet, codec.decode_packet, args.iterations)
+
+	print('Status frame ({} systems)'.format(len(status["configstatus"])))
+	bench('pickle', status, pickle.dumps, pickle.loads, args.iterations // 10)
+	bench('codec', status, codec.encode_status, codec.decode_status, args.iterations // 10)
+
+	keyframes, deltas = build_cycles(status)
+	print('Publisher keyframe cycle ({} frames)'.format(len(keyframes)))
+	bench('pickle', keyframes, cycle(pickle.dumps), cycle(pickle.loads), args.iterations // 10)
+	bench('codec', keyframes, cycle(codec.encode_status), cycle(codec.decode_status), args.iterations // 10)
+
+	print('Publisher delta cycle ({} frames)'.format(len(deltas)))
+	bench('pickle', deltas, cycle(pickle.dumps), cycle(pickle.loads), args.iterations // 10)
+	bench('codec', deltas, cycle(codec.encode_status), cycle(codec.decode_status), args.iterations // 10)
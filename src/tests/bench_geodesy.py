@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compare the vectorized geodesy module against the per fix conversions it replaces.
+Run from this directory: python3 bench_geodesy.py [-n contacts]
+"""
+
+__author__ = 'Tom Mladenov'
+
+import sys
+sys.path.append("../api")
+import time
+import argparse
+
+import numpy as np
+import mgrs
+
+import geodesy
+
+
+def to_grid(dec_lat, dec_lon):
+	#Previous scalar implementation from GPS.to_grid
+	upper = 'ABCDEFGHIJKLMNOPQRSTUVWX'
+	lower = 'abcdefghijklmnopqrstuvwx'
+	adj_lat = dec_lat + 90.0
+	adj_lon = dec_lon + 180.0
+	return 	upper[int(adj_lon/20)] + upper[int(adj_lat/10)] + str(int((adj_lon/2)%10)) + str(int(adj_lat%10)) + \
+			lower[int(((adj_lon) - int(adj_lon/2)*2) * 60/5)] + lower[int((adj_lat - int(adj_lat)) * 60/2.5)]
+
+
+def rate(name, n, function):
+	start = time.perf_counter()
+	function()
+	elapsed = time.perf_counter() - start
+	print('{:<24} {:>12.0f} contacts/s'.format(name, n/elapsed))
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Geodesy benchmark')
+	parser.add_argument('-n', '--contacts', type=int, default=10000, help='number of contacts')
+	args = parser.parse_args()
+
+	rng = np.random.default_rng(0)
+	lat = rng.uniform(-80.0, 84.0, args.contacts)
+	lon = rng.uniform(-180.0, 180.0, args.contacts)
+	contacts = [{"lat": a, "lon": b} for a, b in zip(lat.tolist(), lon.tolist())]
+	m = mgrs.MGRS()
+
+	rate('grid (scalar)', args.contacts, lambda: [to_grid(a, b) for a, b in zip(lat, lon)])
+	rate('grid (vectorized)', args.contacts, lambda: geodesy.maidenhead(lat, lon))
+	rate('mgrs (library)', args.contacts, lambda: [m.toMGRS(a, b) for a, b in zip(lat, lon)])
+	rate('mgrs (vectorized)', args.contacts, lambda: geodesy.mgrs(lat, lon))
+	rate('annotate', args.contacts, lambda: geodesy.annotate(contacts, (50.85, 4.35)))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Line protocol serialization of the database writer.
+Run from this directory: python3 -m pytest test_dbwriter.py
+"""
+
+__author__ = 'Tom Mladenov'
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../api"))
+
+import numpy as np
+from influxdb.exceptions import InfluxDBClientError
+
+from dbwriter import to_line, BatchWriter
+
+
+class Client(object):
+
+	#Rejects batches with a point of the "bad" measurement, like a field type conflict
+
+	def __init__(self):
+		self.written = []
+		self.writes = 0
+
+	def write_points(self, lines, protocol):
+		self.writes += 1
+		if any(line.startswith('bad') for line in lines):
+			raise InfluxDBClientError('field type conflict', 400)
+		self.written.extend(lines)
+
+def writer(client):
+	config = {"s_id": "database", "i_queue_size": 1000, "b_spool_enabled": False, "f_retry_interval": 30.0, "i_replay_rate": 500, "i_batch_size": 500, "f_flush_interval": 1.0}
+	return BatchWriter(client, config, {})
+
+
+def test_types():
+	line = to_line('obc', {'a': 1, 'b': 1.5, 'c': True, 'd': np.int64(3), 'e': np.float32(0.5), 'f': 'x'}, 1)
+	assert line == 'obc a=1i,b=1.5,c=true,d=3i,e=0.5,f="x" 1'
+
+def test_no_fields():
+	assert to_line('obc', {'a': None}, 1) is None
+	assert to_line('obc', {}, 1) is None
+
+def test_non_finite():
+	assert to_line('obc', {'a': float('nan'), 'b': float('inf'), 'c': 2.0}, 1) == 'obc c=2.0 1'
+	assert to_line('obc', {'a': np.float64('nan')}, 1) is None
+
+def test_newline():
+	line = to_line('obc', {'a': 'x\ny', 'b': 'q"\\'}, 1)
+	assert '\n' not in line
+	assert line == 'obc a="x\\ny",b="q\\"\\\\" 1'
+
+def test_rejected_point():
+	client = Client()
+	database = writer(client)
+	batch = [to_line('good', {'a': i}, i) for i in range(500)]
+	batch[321] = to_line('bad', {'a': 'x'}, 321)
+	database._flush(batch)
+
+	assert database.status["rejected"] == 1
+	assert database.status["written"] == 499
+	assert database.backend_up
+	assert batch[321] not in client.written and len(client.written) == 499
+	#Halving finds one point in about 2 * log2(500) writes
+	assert client.writes < 25
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized grid and MGRS conversions on contacts with invalid positions.
+Run from this directory: python3 -m pytest test_geodesy.py
+"""
+
+__author__ = 'Tom Mladenov'
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../api"))
+
+import json
+
+import geodesy
+
+
+def contacts():
+	#Valid, NaN, past the pole, polar (UPS) and infinite longitude
+	positions = [(50.85, 4.35), (float('nan'), 4.0), (91.0, 0.0), (85.0, 10.0), (1.0, float('inf'))]
+	return [{"lat": lat, "lon": lon} for lat, lon in positions]
+
+
+def test_conversions():
+	lat = [contact["lat"] for contact in contacts()]
+	lon = [contact["lon"] for contact in contacts()]
+
+	assert geodesy.maidenhead(lat, lon).tolist() == ["JO20eu", None, None, "JR55aa", None]
+	assert geodesy.mgrs(lat, lon).tolist() == ["31UES9503234012", None, None, "ZAB9645452981", None]
+
+def test_annotate():
+	annotated = geodesy.annotate(contacts(), (50.0, 4.0))
+
+	for i in (1, 2, 4):
+		assert annotated[i] == {"lat": None, "lon": None, "grid": None, "mgrs": None, "range": None, "bearing": None}
+	assert annotated[0]["mgrs"] == "31UES9503234012" and annotated[0]["range"] > 0
+	assert annotated[3]["grid"] == "JR55aa"
+	#The contacts endpoint serializes without NaN
+	json.dumps(annotated, allow_nan=False)
+
+def test_all_valid():
+	assert geodesy.mgrs(50.85, 4.35).tolist() == ["31UES9503234012"]
+	assert geodesy.maidenhead([], []).tolist() == []
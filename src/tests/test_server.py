@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Runtime removal of subsystems from the server.
+Run from this directory: python3 -m pytest test_server.py
+"""
+
+__author__ = 'Tom Mladenov'
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../api"))
+os.environ.setdefault("CYBERDECK_HAL", "sim")
+
+from server import Server, SystemRegistry
+
+
+class System(object):
+
+	#Minimal application, no thread and no process
+
+	def __init__(self, id):
+		self.config = {"s_id": id, "s_type": "application"}
+		self.status = {"running": 0}
+
+def server(*ids):
+	instance = Server.__new__(Server)
+	instance.systems = SystemRegistry()
+	instance.system_classes = {}
+	for id in ids:
+		system = System(id)
+		instance.systems.add(system)
+		setattr(instance, id, system)
+	return instance
+
+
+def test_remove_system():
+	instance = server("keyboard", "gqrx")
+	response = instance.remove_system("keyboard")
+
+	assert response["success"]
+	assert response["systems"] == ["gqrx"]
+	assert "keyboard" not in instance.systems
+	assert not hasattr(instance, "keyboard")
+	assert instance.gqrx is instance.systems.get("gqrx")
+
+def test_remove_unknown_system():
+	instance = server("keyboard")
+	assert not instance.remove_system("gqrx")["success"]
+	assert hasattr(instance, "keyboard")
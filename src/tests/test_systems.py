@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Status placeholders of the polling subsystems, as the database sees them before the first reading.
+Run from this directory: python3 -m pytest test_systems.py
+"""
+
+__author__ = 'Tom Mladenov'
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../api"))
+
+import hal
+from dbwriter import to_line
+from systems import OBC, Display
+
+hal.init("sim", {})
+
+
+class Parent(object):
+
+	#Devices are opened on first use, nothing touches the bus here
+
+	lazy_hardware = True
+
+def fields(line):
+	#Field set of a line protocol point, string fields must not contain ',' or ' '
+	return dict(field.split('=', 1) for field in line.split(' ')[1].split(','))
+
+
+def first_point(system):
+	return fields(to_line(system.config["s_id"], {key: value for key, value in system.status.items() if key != "error"}, 1))
+
+
+def test_obc_first_point():
+	config = {"s_id": "obc", "s_power_ina219_addr": "0x40", "b_power_highrate": True, "i_power_sample_rate": 200, "i_power_averaging": 4, "s_temp_sensor": "28-00000a2f70d2", "i_polling_period": 1}
+	values = first_point(OBC(Parent(), config))
+
+	for key in ("temp1", "temp2", "voltage", "current", "consumption"):
+		assert not values[key].endswith('i'), key
+
+def test_display_first_point():
+	config = {"s_id": "display", "b_power_polling_enabled": True, "s_power_ina219_addr": "0x41", "b_power_highrate": True, "i_power_sample_rate": 200, "i_power_averaging": 4, "i_polling_period": 5}
+	values = first_point(Display(Parent(), config))
+
+	for key in ("voltage", "current", "consumption"):
+		assert not values[key].endswith('i'), key